@@ -23,6 +23,7 @@ from bubblesub.api.audio_stream import AudioStream
 from bubblesub.api.base_streams_api import BaseStreamsApi, TStream
 from bubblesub.api.log import LogApi
 from bubblesub.api.threading import ThreadingApi
+from bubblesub.cfg import Config
 
 if T.TYPE_CHECKING:
     AudioApiBaseClass = BaseStreamsApi[AudioStream]
@@ -33,15 +34,24 @@ else:
 class AudioApi(AudioApiBaseClass):
     """Manages audio streams."""
 
-    def __init__(self, threading_api: ThreadingApi, log_api: LogApi) -> None:
+    def __init__(
+        self, cfg: Config, threading_api: ThreadingApi, log_api: LogApi
+    ) -> None:
         """Initialize self.
 
+        :param cfg: program configuration
         :param threading_api: threading API
         :param log_api: logging API
         """
         super().__init__()
+        self._cfg = cfg
         self._threading_api = threading_api
         self._log_api = log_api
 
+        self.stream_unloaded.connect(self._on_stream_unload)
+
+    def _on_stream_unload(self, stream: AudioStream) -> None:
+        stream.cancel_loading()
+
     def _create_stream(self, path: Path) -> TStream:
-        return AudioStream(self._threading_api, self._log_api, path)
+        return AudioStream(self._cfg, self._threading_api, self._log_api, path)
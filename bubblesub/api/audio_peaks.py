@@ -0,0 +1,178 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Audio peak pyramid."""
+
+import typing as T
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+PEAK_BLOCK_SIZE = 256
+PEAK_LEVEL_FACTOR = 4
+
+# columns of each pyramid level
+PEAK_MIN = 0
+PEAK_MAX = 1
+PEAK_RMS = 2
+
+
+def _reduce_level(level: np.array) -> np.array:
+    """Compute the next, coarser pyramid level.
+
+    :param level: 2D array of min/max/RMS rows
+    :return: 2D array of min/max/RMS rows, PEAK_LEVEL_FACTOR times shorter
+    """
+    padding = -len(level) % PEAK_LEVEL_FACTOR
+    level = np.pad(level, ((0, padding), (0, 0)), mode="edge")
+    level = level.reshape(-1, PEAK_LEVEL_FACTOR, 3)
+    ret = np.empty((len(level), 3), dtype=np.float32)
+    ret[:, PEAK_MIN] = level[:, :, PEAK_MIN].min(axis=1)
+    ret[:, PEAK_MAX] = level[:, :, PEAK_MAX].max(axis=1)
+    ret[:, PEAK_RMS] = np.sqrt(np.mean(level[:, :, PEAK_RMS] ** 2, axis=1))
+    return ret
+
+
+def _compute_blocks(samples: np.array) -> np.array:
+    """Compute min/max/RMS of consecutive blocks of samples.
+
+    :param samples: 1D array of samples; the last block can be partial
+    :return: 2D array of min/max/RMS rows
+    """
+    count = -(-len(samples) // PEAK_BLOCK_SIZE)
+    edges = np.arange(0, count * PEAK_BLOCK_SIZE, PEAK_BLOCK_SIZE)
+    sizes = np.minimum(PEAK_BLOCK_SIZE, len(samples) - edges)
+    ret = np.empty((count, 3), dtype=np.float32)
+    ret[:, PEAK_MIN] = np.minimum.reduceat(samples, edges)
+    ret[:, PEAK_MAX] = np.maximum.reduceat(samples, edges)
+    ret[:, PEAK_RMS] = np.sqrt(
+        np.add.reduceat(np.square(samples, dtype=np.float64), edges) / sizes
+    )
+    return ret
+
+
+class AudioPeaks:
+    """Pyramid of minimum, maximum and RMS of downmixed audio samples.
+
+    Level 0 describes blocks of PEAK_BLOCK_SIZE samples, and each following
+    level is PEAK_LEVEL_FACTOR times coarser, so that any sample range can be
+    summarized by reading about as many rows as there are output columns.
+    """
+
+    def __init__(self, levels: T.List[np.array]) -> None:
+        """Initialize self.
+
+        :param levels: 2D min/max/RMS arrays, from the finest to the coarsest
+        """
+        self.levels = levels
+
+    @staticmethod
+    def compute(chunks: T.Iterable[np.array]) -> "AudioPeaks":
+        """Build the pyramid in one pass over downmixed samples.
+
+        :param chunks: consecutive 1D float arrays of samples
+        :return: peak pyramid
+        """
+        blocks: T.List[np.array] = []
+        leftover = np.empty(0, dtype=np.float32)
+        for chunk in chunks:
+            samples = np.concatenate((leftover, chunk))
+            usable = len(samples) - len(samples) % PEAK_BLOCK_SIZE
+            if usable:
+                blocks.append(_compute_blocks(samples[:usable]))
+            leftover = samples[usable:]
+        if len(leftover):
+            blocks.append(_compute_blocks(leftover))
+
+        levels = [
+            np.concatenate(blocks)
+            if blocks
+            else np.zeros((1, 3), dtype=np.float32)
+        ]
+        while len(levels[-1]) > 1:
+            levels.append(_reduce_level(levels[-1]))
+        return AudioPeaks(levels)
+
+    @staticmethod
+    def load(path: Path) -> T.Optional["AudioPeaks"]:
+        """Read the pyramid from a file.
+
+        :param path: path to read from
+        :return: peak pyramid or None if the file is missing or corrupt
+        """
+        try:
+            with np.load(str(path)) as handle:
+                levels = [
+                    handle[f"level{i}"] for i in range(len(handle.files))
+                ]
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+        if not levels:
+            return None
+        return AudioPeaks(levels)
+
+    def save(self, handle: T.IO[bytes]) -> None:
+        """Write the pyramid to a file.
+
+        :param handle: file to write to
+        """
+        np.savez(
+            handle,
+            **{f"level{i}": level for i, level in enumerate(self.levels)},
+        )
+
+    def get(self, start_frame: int, end_frame: int, count: int) -> np.array:
+        """Summarize samples within given range, split into equal slices.
+
+        :param start_frame: first sample (may be negative)
+        :param end_frame: sample past the range end
+        :param count: number of slices
+        :return: 2D array of min/max/RMS rows, one per slice; slices outside
+            of the audio are zeroed
+        """
+        samples_per_slice = max(1.0, (end_frame - start_frame) / max(1, count))
+        level_idx = 0
+        bucket_size = PEAK_BLOCK_SIZE
+        while (
+            level_idx + 1 < len(self.levels)
+            and bucket_size * PEAK_LEVEL_FACTOR <= samples_per_slice
+        ):
+            level_idx += 1
+            bucket_size *= PEAK_LEVEL_FACTOR
+        level = self.levels[level_idx]
+
+        edges = np.floor(
+            np.linspace(start_frame, end_frame, count + 1) / bucket_size
+        ).astype(np.int64)
+        valid = (edges[:-1] >= 0) & (edges[:-1] < len(level))
+        edges = np.clip(edges, 0, len(level) - 1)
+        last = max(int(edges[-1]), int(edges[-2]) + 1) if count else 0
+        first = edges[:-1]
+
+        # slices narrower than a bucket repeat the same bucket, for which
+        # reduceat returns the bucket itself
+        sizes = np.maximum(1, np.diff(np.append(first, last)))
+        ret = np.zeros((count, 3), dtype=np.float32)
+        if count:
+            level = level[:last]
+            ret[:, PEAK_MIN] = np.minimum.reduceat(level[:, PEAK_MIN], first)
+            ret[:, PEAK_MAX] = np.maximum.reduceat(level[:, PEAK_MAX], first)
+            ret[:, PEAK_RMS] = np.sqrt(
+                np.add.reduceat(level[:, PEAK_RMS] ** 2, first) / sizes
+            )
+        ret[~valid] = 0
+        return ret
@@ -0,0 +1,187 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Audio energy envelope and voice activity index."""
+
+import typing as T
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+SPEECH_FRAME_DURATION = 10
+SPEECH_MIN_SILENCE_DURATION = 200
+SPEECH_MIN_DURATION = 100
+SPEECH_THRESHOLD = 0.35
+
+
+def _compute_energy(samples: np.array, frame_size: int) -> np.array:
+    """Compute energy of consecutive frames of samples.
+
+    :param samples: 1D array of samples; the last frame can be partial
+    :param frame_size: number of samples per frame
+    :return: 1D array of frame energies in decibels
+    """
+    count = -(-len(samples) // frame_size)
+    edges = np.arange(0, count * frame_size, frame_size)
+    sizes = np.minimum(frame_size, len(samples) - edges)
+    power = np.add.reduceat(np.square(samples, dtype=np.float64), edges)
+    return (10 * np.log10(power / sizes + 1e-10)).astype(np.float16)
+
+
+def _find_speech(energy: np.array, frame_duration: float) -> np.array:
+    """Find ranges of frames that contain speech.
+
+    The threshold adapts to the material: it lies between the noise floor
+    and the level of loud passages. Short pauses are bridged and short
+    bursts are discarded, so that breaths and clicks don't split lines.
+
+    :param energy: 1D array of frame energies in decibels
+    :param frame_duration: duration of a frame in milliseconds
+    :return: 2D array of (first frame, frame past the end) rows
+    """
+    if not len(energy):
+        return np.empty((0, 2), dtype=np.int64)
+    noise_floor, loud = np.percentile(energy.astype(np.float32), [10, 95])
+    threshold = noise_floor + (loud - noise_floor) * SPEECH_THRESHOLD
+    mask = energy > threshold
+
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    keep = (starts[1:] - ends[:-1]) * frame_duration >= (
+        SPEECH_MIN_SILENCE_DURATION
+    )
+    starts = np.concatenate((starts[:1], starts[1:][keep]))
+    ends = np.concatenate((ends[:-1][keep], ends[-1:]))
+
+    keep = (ends - starts) * frame_duration >= SPEECH_MIN_DURATION
+    return np.stack((starts[keep], ends[keep]), axis=1)
+
+
+def _snap(
+    boundaries: np.array, values: np.array, max_distance: int
+) -> np.array:
+    """Move values to the nearest boundary, if it is close enough.
+
+    :param boundaries: sorted 1D array of boundaries
+    :param values: 1D array of values to snap
+    :param max_distance: how far the boundary can be from a value
+    :return: 1D array of snapped values
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if not len(boundaries):
+        return values.copy()
+    idx = np.searchsorted(boundaries, values)
+    left = boundaries[np.maximum(idx - 1, 0)]
+    right = boundaries[np.minimum(idx, len(boundaries) - 1)]
+    nearest = np.where(values - left <= right - values, left, right)
+    return np.where(np.abs(nearest - values) <= max_distance, nearest, values)
+
+
+class SpeechIndex:
+    """Energy envelope of downmixed audio samples and speech boundaries.
+
+    The envelope has one value per SPEECH_FRAME_DURATION milliseconds,
+    which makes it small enough to be kept in memory and cached on disk,
+    and lets the boundaries be looked up without decoding any audio.
+    """
+
+    def __init__(self, energy: np.array, frame_duration: float) -> None:
+        """Initialize self.
+
+        :param energy: 1D array of frame energies in decibels
+        :param frame_duration: duration of a frame in milliseconds
+        """
+        self.energy = energy
+        self.frame_duration = frame_duration
+        speech = _find_speech(energy, frame_duration)
+        self.onsets = np.round(speech[:, 0] * frame_duration).astype(np.int64)
+        self.offsets = np.round(speech[:, 1] * frame_duration).astype(np.int64)
+
+    @staticmethod
+    def compute(
+        chunks: T.Iterable[np.array], sample_rate: int
+    ) -> "SpeechIndex":
+        """Build the index in one pass over downmixed samples.
+
+        :param chunks: consecutive 1D float arrays of samples
+        :param sample_rate: sample rate of the samples
+        :return: speech index
+        """
+        frame_size = max(1, round(sample_rate * SPEECH_FRAME_DURATION / 1000))
+        energies: T.List[np.array] = []
+        leftover = np.empty(0, dtype=np.float32)
+        for chunk in chunks:
+            samples = np.concatenate((leftover, chunk))
+            usable = len(samples) - len(samples) % frame_size
+            if usable:
+                energies.append(_compute_energy(samples[:usable], frame_size))
+            leftover = samples[usable:]
+        if len(leftover):
+            energies.append(_compute_energy(leftover, frame_size))
+
+        return SpeechIndex(
+            np.concatenate(energies)
+            if energies
+            else np.empty(0, dtype=np.float16),
+            frame_size * 1000 / sample_rate,
+        )
+
+    @staticmethod
+    def load(path: Path) -> T.Optional["SpeechIndex"]:
+        """Read the index from a file.
+
+        :param path: path to read from
+        :return: speech index or None if the file is missing or corrupt
+        """
+        try:
+            with np.load(str(path)) as handle:
+                return SpeechIndex(
+                    handle["energy"], float(handle["frame_duration"])
+                )
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+
+    def save(self, handle: T.IO[bytes]) -> None:
+        """Write the index to a file.
+
+        :param handle: file to write to
+        """
+        np.savez(
+            handle, energy=self.energy, frame_duration=self.frame_duration
+        )
+
+    def snap_starts(self, pts: np.array, max_distance: int) -> np.array:
+        """Move start times to the nearest speech onset.
+
+        :param pts: 1D array of start times in milliseconds
+        :param max_distance: how far the onset can be, in milliseconds
+        :return: 1D array of snapped times; times without a close enough
+            onset are left intact
+        """
+        return _snap(self.onsets, pts, max_distance)
+
+    def snap_ends(self, pts: np.array, max_distance: int) -> np.array:
+        """Move end times to the nearest speech offset.
+
+        :param pts: 1D array of end times in milliseconds
+        :param max_distance: how far the offset can be, in milliseconds
+        :return: 1D array of snapped times; times without a close enough
+            offset are left intact
+        """
+        return _snap(self.offsets, pts, max_distance)
@@ -16,8 +16,8 @@
 
 """Audio stream."""
 
+import os
 import threading
-import time
 import typing as T
 import uuid
 from pathlib import Path
@@ -26,23 +26,59 @@ import ffms2
 import numpy as np
 from PyQt5 import QtCore
 
+from bubblesub.api.audio_peaks import AudioPeaks
+from bubblesub.api.audio_speech import SpeechIndex
+from bubblesub.api.ffms2_index import load_index
 from bubblesub.api.log import LogApi
 from bubblesub.api.threading import ThreadingApi
+from bubblesub.cache import get_cache_file_path, get_file_fingerprint
+from bubblesub.cfg import Config
 from bubblesub.compat import nullcontext
-from bubblesub.fmt.wav import write_wav
+from bubblesub.fmt.wav import WavWriter
 
-_LOADING = object()
-_SAMPLER_LOCK = threading.Lock()
+PCM_CACHE_SUFFIX = ".f32"
+PCM_CACHE_CHUNK_SIZE = 1 << 20
+PEAKS_CACHE_SUFFIX = ".npz"
+SPEECH_CACHE_SUFFIX = ".npz"
+WAV_EXPORT_CHUNK_SIZE = 1 << 16
+
+
+def _downmix(samples: np.array, sample_format: T.Optional[int]) -> np.array:
+    """Average channels and normalize samples to [-1, 1] float range.
+
+    :param samples: 2D array of raw samples, as returned by FFMS
+    :param sample_format: FFMS sample format of the samples
+    :return: 1D float32 array
+    """
+    mono = np.mean(samples, axis=1, dtype=np.float32)
+    # every integer format is divided by its own full scale, so that the
+    # same signal has the same level whatever the format
+    if sample_format == ffms2.FFMS_FMT_U8:
+        mono -= 128.0
+        mono /= 128.0
+    elif sample_format == ffms2.FFMS_FMT_S16:
+        mono /= 32768.0
+    elif sample_format == ffms2.FFMS_FMT_S32:
+        mono /= 2_147_483_648.0
+    elif sample_format not in (ffms2.FFMS_FMT_FLT, ffms2.FFMS_FMT_DBL):
+        raise RuntimeError(f"unknown sample format: {sample_format}")
+    return mono
 
 
 def _load_audio_source(
-    log_api: LogApi, uid: uuid.UUID, path: Path
+    log_api: LogApi,
+    uid: uuid.UUID,
+    path: Path,
+    progress_callback: T.Callable[[int, int], bool],
 ) -> T.Optional[ffms2.AudioSource]:
     """Create FFMS audio source.
 
     :param log_api: logging API
     :param uid: uid of the stream (for logging)
     :param path: path to the audio file
+    :param progress_callback:
+        function receiving indexing progress; returning True from it cancels
+        the loading
     :return: resulting FFMS audio source or None if failed to create
     """
     log_api.info(f"audio {uid} started loading ({path})")
@@ -52,10 +88,9 @@ def _load_audio_source(
         return None
 
     try:
-        indexer = ffms2.Indexer(str(path))
-        for track in indexer.track_info_list:
-            indexer.track_index_settings(track.num, 1, 0)
-        index = indexer.do_indexing2()
+        index = load_index(
+            log_api, uid, "audio", path, progress_callback=progress_callback
+        )
     except ffms2.Error as ex:
         log_api.error(f"error loading audio {uid} ({ex})")
         return None
@@ -81,10 +116,15 @@ class AudioStream(QtCore.QObject):
     loaded = QtCore.pyqtSignal()
 
     def __init__(
-        self, threading_api: ThreadingApi, log_api: LogApi, path: Path
+        self,
+        cfg: Config,
+        threading_api: ThreadingApi,
+        log_api: LogApi,
+        path: Path,
     ) -> None:
         """Initialize self.
 
+        :param cfg: program configuration
         :param threading_api: threading API
         :param log_api: logging API
         :param path: path to the audio file to load
@@ -92,6 +132,8 @@ class AudioStream(QtCore.QObject):
         super().__init__()
         self._threading_api = threading_api
         self._log_api = log_api
+        self._use_pcm_cache = bool(cfg.opt["audio"]["pcm_cache"])
+        self._use_speech_index = bool(cfg.opt["audio"]["speech_index"])
 
         self.uid = uuid.uuid4()
 
@@ -106,12 +148,19 @@ class AudioStream(QtCore.QObject):
         self._delay = 0
 
         self._source: T.Union[None, ffms2.AudioSource] = None
+        self._pcm_cache: T.Optional[np.memmap] = None
+        self._peaks: T.Optional[AudioPeaks] = None
+        self._peaks_requested = False
+        self._speech_index: T.Optional[SpeechIndex] = None
+        self._speech_index_requested = False
+        self._load_canceled = threading.Event()
+        # decoders aren't thread safe, but separate streams can decode
+        # in parallel
+        self._decoder_lock = threading.Lock()
+        self._source_ready = threading.Event()
 
         self._log_api.info(f"audio: loading {path}")
-        self._threading_api.schedule_task(
-            lambda: _load_audio_source(self._log_api, self.uid, self._path),
-            self._got_source,
-        )
+        self._threading_api.schedule_task(self._load_source, self._got_source)
 
     @property
     def path(self) -> Path:
@@ -129,6 +178,64 @@ class AudioStream(QtCore.QObject):
         """
         return self._source is not None
 
+    def wait_until_ready(self, timeout: T.Optional[float] = None) -> bool:
+        """Block until the audio finishes loading.
+
+        :param timeout: how many seconds to wait at most; None to wait for as
+            long as it takes
+        :return: whether the audio is loaded
+        """
+        return self._source_ready.wait(timeout) and self._source is not None
+
+    def cancel_loading(self) -> None:
+        """Abort indexing and decoding the audio, if still in progress."""
+        self._load_canceled.set()
+        # release the threads waiting for the audio right away, rather than
+        # once the indexer notices the cancellation
+        self._source_ready.set()
+
+    @property
+    def peaks(self) -> T.Optional[AudioPeaks]:
+        """Return the waveform peak pyramid.
+
+        :return: peak pyramid or None if not built yet
+        """
+        return self._peaks
+
+    def request_peaks(self) -> None:
+        """Build or load the waveform peak pyramid in the background.
+
+        Emits the changed signal once the pyramid is available.
+        """
+        if self._peaks_requested or not self._source:
+            return
+        self._peaks_requested = True
+        source = self._source
+        self._threading_api.schedule_task(
+            lambda: self._build_peaks(source), self._got_peaks
+        )
+
+    @property
+    def speech_index(self) -> T.Optional[SpeechIndex]:
+        """Return the energy envelope and speech boundaries.
+
+        :return: speech index or None if not built yet
+        """
+        return self._speech_index
+
+    def request_speech_index(self) -> None:
+        """Build or load the speech index in the background.
+
+        Emits the changed signal once the index is available.
+        """
+        if self._speech_index_requested or not self._source:
+            return
+        self._speech_index_requested = True
+        source = self._source
+        self._threading_api.schedule_task(
+            lambda: self._build_speech_index(source), self._got_speech_index
+        )
+
     @property
     def channel_count(self) -> int:
         """Return channel count for currently loaded audio source.
@@ -210,8 +317,8 @@ class AudioStream(QtCore.QObject):
         :param count: how many samples to get
         :return: numpy array of samples
         """
-        with _SAMPLER_LOCK:
-            self._wait_for_source()
+        self._source_ready.wait()
+        with self._decoder_lock:
             if not self._source:
                 channel_count = max(1, self.channel_count)
                 return np.zeros(count * channel_count).reshape(
@@ -224,18 +331,48 @@ class AudioStream(QtCore.QObject):
             self._source.init_buffer(count)
             return self._source.get_audio(start_frame)
 
+    def get_mono_samples(self, start_frame: int, count: int) -> np.array:
+        """Get audio samples downmixed to a single channel and normalized to
+        [-1, 1] range. Doesn't take delay into account.
+
+        If the decoded samples cache is enabled and ready, this is a
+        zero-copy slice of the memory-mapped cache that doesn't need to
+        acquire the decoder lock.
+
+        :param start_frame: start frame (not PTS)
+        :param count: how many samples to get
+        :return: 1D float32 numpy array of samples
+        """
+        pcm_cache = self._pcm_cache
+        if pcm_cache is not None:
+            start_frame = max(0, start_frame)
+            return pcm_cache[start_frame : start_frame + max(0, count)]
+        samples = self.get_samples(start_frame, count)
+        if not self._source:
+            return np.zeros(count, dtype=np.float32)
+        return _downmix(samples, self.sample_format)
+
     def save_wav(
         self,
         path_or_handle: T.Union[Path, T.IO[bytes]],
         start_pts: int,
         end_pts: int,
-    ) -> None:
+        progress_callback: T.Optional[T.Callable[[int, int], bool]] = None,
+    ) -> bool:
         """Save samples for the currently loaded audio source as WAV file.
         Takes user-configured delay into account.
 
+        Samples are read, converted and written in chunks, so the memory
+        usage doesn't depend on the length of the range.
+
         :param path_or_handle: where to put the result WAV file in
         :param start_pts: start PTS
         :param end_pts: end PTS
+        :param progress_callback:
+            optional function receiving the number of frames written so far
+            and the total; returning True from it cancels the export and
+            removes the partially written file if it was given as a path
+        :return: whether the export was completed
         """
         start_pts -= self.delay
         end_pts -= self.delay
@@ -244,11 +381,6 @@ class AudioStream(QtCore.QObject):
         frame_count = end_frame - start_frame
         if frame_count < 0:
             raise ValueError("negative number of frames")
-        samples = self.get_samples(start_frame, frame_count)
-
-        # increase compatibility with external programs
-        if samples.dtype.name in ("float32", "float64"):
-            samples = (samples * (1 << 31)).astype(np.int32)
 
         ctx: T.ContextManager[T.IO[bytes]]
         if isinstance(path_or_handle, Path):
@@ -256,8 +388,50 @@ class AudioStream(QtCore.QObject):
         else:
             ctx = nullcontext(path_or_handle)
 
+        canceled = False
         with ctx as handle:
-            write_wav(handle, self.sample_rate, samples)
+            writer: T.Optional[WavWriter] = None
+            offset = 0
+            while True:
+                if progress_callback and progress_callback(
+                    offset, frame_count
+                ):
+                    canceled = True
+                    break
+
+                samples = self.get_samples(
+                    start_frame + offset,
+                    min(WAV_EXPORT_CHUNK_SIZE, frame_count - offset),
+                )
+
+                # increase compatibility with external programs
+                if samples.dtype.name in ("float32", "float64"):
+                    samples = (samples * (1 << 31)).astype(np.int32)
+
+                if writer is None:
+                    writer = WavWriter(
+                        handle,
+                        self.sample_rate,
+                        samples.dtype,
+                        samples.shape[1],
+                    )
+                if not len(samples):
+                    break
+                writer.write(samples)
+                offset += len(samples)
+                if offset >= frame_count:
+                    break
+
+            if writer and not canceled:
+                writer.finish()
+
+        if canceled:
+            if isinstance(path_or_handle, Path):
+                path_or_handle.unlink()
+            return False
+        if progress_callback:
+            progress_callback(frame_count, frame_count)
+        return True
 
     def _create_empty_sample_buffer(self) -> np.array:
         return np.zeros(
@@ -271,33 +445,207 @@ class AudioStream(QtCore.QObject):
             }[self.sample_format],
         ).reshape(0, max(1, self.channel_count))
 
-    def _got_source(self, source: T.Optional[ffms2.AudioSource]) -> None:
-        self._source = source
+    def _load_source(self) -> T.Optional[ffms2.AudioSource]:
+        try:
+            return self._set_source(
+                _load_audio_source(
+                    self._log_api,
+                    self.uid,
+                    self._path,
+                    lambda _current, _total: self._load_canceled.is_set(),
+                )
+            )
+        finally:
+            # unexpected errors are only logged by the threading API, and
+            # mustn't leave the threads waiting for the audio stuck
+            self._source_ready.set()
+
+    def _set_source(
+        self, source: T.Optional[ffms2.AudioSource]
+    ) -> T.Optional[ffms2.AudioSource]:
+        # runs on the loading thread, so that the threads waiting for the
+        # audio don't need to wait for the Qt event loop as well
+        if source is not None:
+            self._min_time = round(
+                T.cast(float, source.properties.FirstTime) * 1000
+            )
+            self._max_time = round(
+                T.cast(float, source.properties.LastTime) * 1000
+            )
+            self._channel_count = T.cast(int, source.properties.Channels)
+            self._bits_per_sample = T.cast(
+                int, source.properties.BitsPerSample
+            )
+            self._sample_count = T.cast(int, source.properties.NumSamples)
+            self._sample_rate = T.cast(int, source.properties.SampleRate)
+            self._sample_format = T.cast(
+                T.Optional[int], source.properties.SampleFormat
+            )
+        with self._decoder_lock:
+            self._source = source
+        self._source_ready.set()
+        return source
 
+    def _got_source(self, source: T.Optional[ffms2.AudioSource]) -> None:
         if source is None:
             self.errored.emit()
             return
 
-        self._min_time = round(
-            T.cast(float, source.properties.FirstTime) * 1000
+        self.loaded.emit()
+
+        if self._use_pcm_cache:
+            self._threading_api.schedule_task(
+                lambda: self._build_pcm_cache(source), self._got_pcm_cache
+            )
+        if self._use_speech_index:
+            self.request_speech_index()
+
+    def _build_pcm_cache(
+        self, source: ffms2.AudioSource
+    ) -> T.Optional[np.memmap]:
+        cache_path = get_cache_file_path(
+            f"{get_file_fingerprint(self._path)}-pcm", PCM_CACHE_SUFFIX
         )
-        self._max_time = round(
-            T.cast(float, source.properties.LastTime) * 1000
+        sample_count = self._sample_count
+        if not sample_count:
+            # there's nothing to cache and memmap can't map empty files
+            return None
+        expected_size = sample_count * np.dtype(np.float32).itemsize
+
+        tmp_path = cache_path.with_name(cache_path.name + f".{self.uid}")
+        try:
+            if (
+                cache_path.exists()
+                and cache_path.stat().st_size == expected_size
+            ):
+                return np.memmap(
+                    cache_path, dtype=np.float32, mode="r", shape=sample_count
+                )
+
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            pcm_cache = np.memmap(
+                tmp_path, dtype=np.float32, mode="w+", shape=sample_count
+            )
+            start_frame = 0
+            for chunk in self._iter_mono_chunks(source):
+                pcm_cache[start_frame : start_frame + len(chunk)] = chunk
+                start_frame += len(chunk)
+            if self._load_canceled.is_set():
+                del pcm_cache
+                return None
+            pcm_cache.flush()
+            del pcm_cache
+            os.replace(str(tmp_path), str(cache_path))
+            return np.memmap(
+                cache_path, dtype=np.float32, mode="r", shape=sample_count
+            )
+        except (ffms2.Error, OSError, ValueError) as ex:
+            self._log_api.warn(
+                f"audio {self.uid}: could not cache decoded samples ({ex})"
+            )
+            return None
+        finally:
+            # canceled or failed halfway through
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _got_pcm_cache(self, pcm_cache: T.Optional[np.memmap]) -> None:
+        if pcm_cache is not None:
+            self._pcm_cache = pcm_cache
+            self._log_api.info(f"audio {self.uid}: decoded samples cached")
+
+    def _iter_mono_chunks(
+        self, source: ffms2.AudioSource
+    ) -> T.Iterable[np.array]:
+        """Go through all samples in one pass, downmixed.
+
+        Stops early if the loading gets canceled.
+
+        :param source: loaded FFMS audio source
+        :return: generator of consecutive 1D float32 arrays
+        """
+        pcm_cache = self._pcm_cache
+        if pcm_cache is not None:
+            for start_frame in range(0, len(pcm_cache), PCM_CACHE_CHUNK_SIZE):
+                if self._load_canceled.is_set():
+                    return
+                yield pcm_cache[
+                    start_frame : start_frame + PCM_CACHE_CHUNK_SIZE
+                ]
+            return
+
+        # decode using a separate FFMS source, so that it doesn't compete
+        # for the decoder lock with the regular sample requests
+        decoder = ffms2.AudioSource(
+            str(self._path), source.track_number, source.index
         )
-        self._channel_count = T.cast(int, source.properties.Channels)
-        self._bits_per_sample = T.cast(int, source.properties.BitsPerSample)
-        self._sample_count = T.cast(int, source.properties.NumSamples)
-        self._sample_rate = T.cast(int, source.properties.SampleRate)
-        self._sample_format = T.cast(
-            T.Optional[int], source.properties.SampleFormat
+        sample_count = self._sample_count
+        for start_frame in range(0, sample_count, PCM_CACHE_CHUNK_SIZE):
+            if self._load_canceled.is_set():
+                return
+            count = min(PCM_CACHE_CHUNK_SIZE, sample_count - start_frame)
+            decoder.init_buffer(count)
+            yield _downmix(decoder.get_audio(start_frame), self._sample_format)
+
+    def _build_peaks(
+        self, source: ffms2.AudioSource
+    ) -> T.Optional[AudioPeaks]:
+        cache_path = get_cache_file_path(
+            f"{get_file_fingerprint(self._path)}-peaks", PEAKS_CACHE_SUFFIX
         )
-        self.loaded.emit()
-
-    def _wait_for_source(self) -> bool:
-        if self._source is None:
-            return False
-        while self._source is _LOADING:
-            time.sleep(0.01)
-        if self._source is None:
-            return False
-        return True
+        peaks = AudioPeaks.load(cache_path)
+        if peaks is not None:
+            return peaks
+
+        try:
+            peaks = AudioPeaks.compute(self._iter_mono_chunks(source))
+            if self._load_canceled.is_set():
+                return None
+            tmp_path = cache_path.with_name(cache_path.name + f".{self.uid}")
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open("wb") as handle:
+                peaks.save(handle)
+            os.replace(str(tmp_path), str(cache_path))
+        except (ffms2.Error, OSError) as ex:
+            self._log_api.warn(
+                f"audio {self.uid}: could not cache waveform peaks ({ex})"
+            )
+        return peaks
+
+    def _got_peaks(self, peaks: T.Optional[AudioPeaks]) -> None:
+        if peaks is not None:
+            self._peaks = peaks
+            self.changed.emit()
+
+    def _build_speech_index(
+        self, source: ffms2.AudioSource
+    ) -> T.Optional[SpeechIndex]:
+        cache_path = get_cache_file_path(
+            f"{get_file_fingerprint(self._path)}-speech", SPEECH_CACHE_SUFFIX
+        )
+        speech_index = SpeechIndex.load(cache_path)
+        if speech_index is not None:
+            return speech_index
+
+        try:
+            speech_index = SpeechIndex.compute(
+                self._iter_mono_chunks(source), self._sample_rate
+            )
+            if self._load_canceled.is_set():
+                return None
+            tmp_path = cache_path.with_name(cache_path.name + f".{self.uid}")
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open("wb") as handle:
+                speech_index.save(handle)
+            os.replace(str(tmp_path), str(cache_path))
+        except (ffms2.Error, OSError) as ex:
+            self._log_api.warn(
+                f"audio {self.uid}: could not cache speech index ({ex})"
+            )
+        return speech_index
+
+    def _got_speech_index(self, speech_index: T.Optional[SpeechIndex]) -> None:
+        if speech_index is not None:
+            self._speech_index = speech_index
+            self._log_api.info(f"audio {self.uid}: speech index ready")
+            self.changed.emit()
@@ -0,0 +1,103 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Persistent cache of FFMS2 indexes."""
+
+import os
+import typing as T
+import uuid
+from pathlib import Path
+
+import ffms2
+
+from bubblesub.api.log import LogApi
+from bubblesub.cache import get_cache_file_path, get_file_fingerprint
+
+INDEX_SUFFIX = ".ffindex"
+
+
+def get_index_path(path: Path, kind: str) -> Path:
+    """Return the cache path of the FFMS index for given media file.
+
+    :param path: path to the media file
+    :param kind: what the index is used for ("audio" or "video")
+    :return: path to the index file
+    """
+    return get_cache_file_path(
+        f"{get_file_fingerprint(path)}-{kind}", INDEX_SUFFIX
+    )
+
+
+def load_index(
+    log_api: LogApi,
+    uid: uuid.UUID,
+    kind: str,
+    path: Path,
+    track_type: T.Optional[int] = None,
+    progress_callback: T.Optional[T.Callable[[int, int], bool]] = None,
+) -> ffms2.Index:
+    """Load FFMS index of given media file, reusing the disk cache if possible.
+
+    Cached indexes that don't match the file anymore are discarded and
+    rebuilt.
+
+    :param log_api: logging API
+    :param uid: uid of the stream (for logging)
+    :param kind: what the index is used for ("audio" or "video")
+    :param path: path to the media file
+    :param track_type: type of the tracks to index, or None to index all
+    :param progress_callback:
+        optional function receiving the current and total indexing progress;
+        returning True from it cancels the indexing
+    :return: FFMS index
+    """
+    index_path = get_index_path(path, kind)
+
+    if index_path.exists():
+        try:
+            index = ffms2.Index.read(str(index_path), str(path))
+        except ffms2.Error as ex:
+            log_api.warn(f"{kind} {uid}: discarding stale index ({ex})")
+            try:
+                index_path.unlink()
+            except FileNotFoundError:
+                pass
+        else:
+            log_api.info(f"{kind} {uid}: reusing cached index")
+            return index
+
+    indexer = ffms2.Indexer(str(path))
+    for track in indexer.track_info_list:
+        if track_type is None or track.type == track_type:
+            indexer.track_index_settings(track.num, 1, 0)
+    if progress_callback:
+        indexer.set_progress_callback(
+            lambda current, total, _private: int(
+                bool(progress_callback(current, total))
+            )
+        )
+    index = indexer.do_indexing2()
+
+    # write to a temporary file first so that concurrent instances never see
+    # a partially written index
+    tmp_path = index_path.with_name(index_path.name + f".{uid}.tmp")
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        index.write(str(tmp_path))
+        os.replace(str(tmp_path), str(index_path))
+    except (ffms2.Error, OSError) as ex:
+        log_api.warn(f"{kind} {uid}: could not cache index ({ex})")
+    return index
@@ -16,7 +16,9 @@
 
 """GUI API."""
 
+import asyncio
 import contextlib
+import threading
 import typing as T
 from pathlib import Path
 
@@ -26,6 +28,11 @@ import bubblesub.api  # pylint: disable=unused-import
 from bubblesub.ui.util import SUBS_FILE_FILTER, async_dialog_exec, save_dialog
 
 
+class _ProgressSignals(QtCore.QObject):
+    value_changed = QtCore.pyqtSignal(int)
+    maximum_changed = QtCore.pyqtSignal(int)
+
+
 class GuiApi(QtCore.QObject):
     """The GUI API."""
 
@@ -131,3 +138,71 @@ class GuiApi(QtCore.QObject):
             yield
         finally:
             self.request_end_update.emit()
+
+    async def run_with_progress(
+        self,
+        label: str,
+        function: T.Callable[[T.Callable[[int, int], bool]], T.Any],
+    ) -> T.Any:
+        """Run a long function in the background, showing its progress.
+
+        The function runs on a worker thread, so that the GUI stays
+        responsive. It receives a progress callback that takes the number of
+        processed items and their total, and returns True once the user
+        cancels the operation.
+
+        :param label: text to show next to the progress bar
+        :param function: function to run
+        :return: function result
+        """
+        canceled = threading.Event()
+        signals = _ProgressSignals()
+        dialog = QtWidgets.QProgressDialog(
+            label, "Cancel", 0, 0, self._main_window
+        )
+        dialog.setMinimumDuration(500)
+        dialog.canceled.connect(canceled.set)
+        signals.maximum_changed.connect(dialog.setMaximum)
+        signals.value_changed.connect(dialog.setValue)
+
+        def progress_callback(current: int, total: int) -> bool:
+            """Report the progress to the dialog.
+
+            :param current: number of processed items
+            :param total: number of all items
+            :return: whether the user canceled the operation
+            """
+            signals.maximum_changed.emit(total)
+            signals.value_changed.emit(current)
+            return canceled.is_set()
+
+        def run() -> T.Tuple[T.Any, T.Optional[Exception]]:
+            """Run the function on the worker thread.
+
+            :return: function result and the exception it raised, if any
+            """
+            # the threading API only logs the errors, while the caller
+            # should see them
+            try:
+                return function(progress_callback), None
+            except Exception as ex:  # pylint: disable=broad-except
+                return None, ex
+
+        def finish(outcome: T.Tuple[T.Any, T.Optional[Exception]]) -> None:
+            """Pass the outcome back to the awaiting coroutine.
+
+            :param outcome: function result and the exception it raised
+            """
+            result, error = outcome
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        future: "asyncio.Future[T.Any]" = asyncio.Future()
+        self._api.threading.schedule_task(run, finish)
+        try:
+            return await future
+        finally:
+            dialog.close()
+            dialog.deleteLater()
@@ -17,9 +17,9 @@
 """Threading API."""
 
 import functools
+import itertools
 import queue
 import threading
-import time
 import typing as T
 
 from PyQt5 import QtCore
@@ -57,7 +57,11 @@ class _WorkerSignals(QtCore.QObject):
 
 
 class QueueWorker(QtCore.QRunnable):
-    """Worker thread for continuous task queues."""
+    """Worker thread for continuous task queues.
+
+    Tasks are processed in the order of their priority, and in the order they
+    were scheduled within the same priority.
+    """
 
     def __init__(self, log_api: LogApi) -> None:
         """Initialize self.
@@ -67,10 +71,14 @@ class QueueWorker(QtCore.QRunnable):
         super().__init__()
         self._log_api = log_api
         self._running = False
-        self._clearing = False
-        self._queue: queue.Queue[  # pylint: disable=unsubscriptable-object
-            T.Any
-        ] = queue.Queue()
+        self._not_clearing = threading.Event()
+        self._not_clearing.set()
+        self._counter = itertools.count()
+        self._generation = 0
+        self._task_generation = 0
+        self._queue: queue.PriorityQueue[  # pylint: disable=E1136
+            T.Tuple[T.Any, ...]
+        ] = queue.PriorityQueue()
 
     def run(self) -> None:
         """Run the thread.
@@ -84,15 +92,14 @@ class QueueWorker(QtCore.QRunnable):
         with self._log_api.exception_guard():
             self._started()
         while self._running:
-            if self._clearing:
-                time.sleep(0.1)
-                continue
-
-            task = self._queue.get()
-            if task is None:
+            self._not_clearing.wait()
+            is_task, _priority, _seq, generation, task = self._queue.get()
+            if not is_task:
                 break
-            with self._log_api.exception_guard():
-                self._process_task(task)
+            if generation == self._generation:
+                self._task_generation = generation
+                with self._log_api.exception_guard():
+                    self._process_task(task)
             self._queue.task_done()
         with self._log_api.exception_guard():
             self._finished()
@@ -107,28 +114,44 @@ class QueueWorker(QtCore.QRunnable):
         """Stop processing any remaining tasks and quit the thread ASAP."""
         self.clear_tasks()
         self._running = False
-        self._queue.put(None)  # make sure run() exits
+        # make sure run() exits
+        self._queue.put((False, None, next(self._counter), None, None))
 
-    def schedule_task(self, task_data: T.Any) -> None:
+    def schedule_task(self, task_data: T.Any, priority: T.Any = 0) -> None:
         """Put a new task onto internal task queue.
 
         :param task_data: task to process
+        :param priority: tasks with lower values are processed first; must be
+            comparable with priorities of other tasks of this worker
         """
-        self._queue.put(task_data)
+        self._queue.put(
+            (True, priority, next(self._counter), self._generation, task_data)
+        )
 
     def clear_tasks(self) -> None:
-        """Remove all remaining tasks.
+        """Remove all remaining tasks and mark the task being processed as
+        canceled.
 
         Doesn't fire the finished signal.
         """
-        self._clearing = True
+        self._generation += 1
+        self._not_clearing.clear()
         while not self._queue.empty():
             try:
                 self._queue.get(False)
             except queue.Empty:
                 continue
             self._queue.task_done()
-        self._clearing = False
+        self._not_clearing.set()
+
+    def _is_task_canceled(self) -> bool:
+        """Check whether the task being processed was canceled.
+
+        Long running tasks can use this to stop early.
+
+        :return: whether clear_tasks was called after the task was scheduled
+        """
+        return self._task_generation != self._generation
 
     def _started(self) -> None:
         """Called when the thread starts."""
@@ -137,6 +160,27 @@ class QueueWorker(QtCore.QRunnable):
         """Called when the thread finishes."""
 
 
+class _QueueWorkerRunner(QtCore.QRunnable):
+    def __init__(
+        self, worker: QueueWorker, finished: T.Callable[[], None]
+    ) -> None:
+        """Initialize self.
+
+        :param worker: queue worker to run
+        :param finished: function to call once the worker quits
+        """
+        super().__init__()
+        self._worker = worker
+        self._finished = finished
+
+    def run(self) -> None:
+        """Run the queue worker."""
+        try:
+            self._worker.run()
+        finally:
+            self._finished()
+
+
 class OneShotWorker(QtCore.QRunnable):
     """Worker thread for one shot tasks."""
 
@@ -169,6 +213,9 @@ class ThreadingApi:
         """
         self._log_api = log_api
         self._thread_pool = QtCore.QThreadPool()
+        self._thread_count_lock = threading.Lock()
+        self._base_thread_count = self._thread_pool.maxThreadCount()
+        self._queue_worker_count = 0
 
     def schedule_task(
         self,
@@ -189,6 +236,22 @@ class ThreadingApi:
     def schedule_runnable(self, runnable: QtCore.QRunnable) -> None:
         """Schedule a QRunnable to run in the background thread pool.
 
+        Queue workers occupy their thread until they're stopped, so each of
+        them grows the pool by one thread to keep one shot tasks running, for
+        as long as it runs.
+
         :param runnable: QRunnable to schedule
         """
+        if isinstance(runnable, QueueWorker):
+            self._change_queue_worker_count(1)
+            runnable = _QueueWorkerRunner(
+                runnable, lambda: self._change_queue_worker_count(-1)
+            )
         self._thread_pool.start(runnable)
+
+    def _change_queue_worker_count(self, delta: int) -> None:
+        with self._thread_count_lock:
+            self._queue_worker_count += delta
+            self._thread_pool.setMaxThreadCount(
+                self._base_thread_count + self._queue_worker_count
+            )
@@ -24,6 +24,7 @@ from bubblesub.api.log import LogApi
 from bubblesub.api.subs import SubtitlesApi
 from bubblesub.api.threading import ThreadingApi
 from bubblesub.api.video_stream import VideoStream
+from bubblesub.cfg import Config
 
 # TODO: remove this condition when switching to Python 3.7
 if T.TYPE_CHECKING:
@@ -39,22 +40,30 @@ class VideoApi(VideoApiBaseClass):
 
     def __init__(
         self,
+        cfg: Config,
         threading_api: ThreadingApi,
         log_api: LogApi,
         subs_api: SubtitlesApi,
     ) -> None:
         """Initialize self.
 
+        :param cfg: program configuration
         :param threading_api: threading API
         :param log_api: logging API
         :param subs_api: subtitles API
         """
         super().__init__()
+        self._cfg = cfg
         self._threading_api = threading_api
         self._log_api = log_api
         self._subs_api = subs_api
 
+        self.stream_unloaded.connect(self._on_stream_unload)
+
+    def _on_stream_unload(self, stream: VideoStream) -> None:
+        stream.cancel_loading()
+
     def _create_stream(self, path: Path) -> TStream:
         return VideoStream(
-            self._threading_api, self._log_api, self._subs_api, path
+            self._cfg, self._threading_api, self._log_api, self._subs_api, path
         )
@@ -0,0 +1,118 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Video scene change index."""
+
+import threading
+import typing as T
+
+import numpy as np
+
+SCENE_HISTOGRAM_BINS = 8
+SCENE_SCORE_SCALE = 255
+SCENE_CHANGE_THRESHOLD = 0.4
+
+
+def compute_histogram(frame: np.array) -> np.array:
+    """Compute a coarse color histogram of a frame.
+
+    :param frame: 3D array of RGB24 pixels
+    :return: 1D array of pixel counts, SCENE_HISTOGRAM_BINS per channel
+    """
+    bins = frame.reshape(-1, 3) // (256 // SCENE_HISTOGRAM_BINS)
+    bins = bins + np.arange(3) * SCENE_HISTOGRAM_BINS
+    return np.bincount(
+        bins.ravel(), minlength=3 * SCENE_HISTOGRAM_BINS
+    ).astype(np.uint16)
+
+
+def compute_scores(
+    histograms: np.array, prev_histograms: np.array
+) -> np.array:
+    """Compute how much frames differ from the frames preceding them.
+
+    :param histograms: 2D array of frame histograms
+    :param prev_histograms: 2D array of histograms of the preceding frames
+    :return: 1D array of scores, from 0 for identical color distributions to
+        SCENE_SCORE_SCALE for disjoint ones
+    """
+    diff = np.abs(
+        histograms.astype(np.int32) - prev_histograms.astype(np.int32)
+    ).sum(axis=1)
+    total = np.maximum(1, 2 * histograms.sum(axis=1, dtype=np.int64))
+    return np.round(diff * SCENE_SCORE_SCALE / total).astype(np.uint8)
+
+
+class SceneIndex:
+    """Per-frame scene change scores.
+
+    Scores take one byte per frame, so that the index is cheap to keep next to
+    the video band, and the cuts can be looked up without decoding anything.
+    """
+
+    def __init__(
+        self,
+        scores: np.array,
+        timecodes: np.array,
+        threshold: float = SCENE_CHANGE_THRESHOLD,
+    ) -> None:
+        """Initialize self.
+
+        :param scores: 1D array of scores, one per frame
+        :param timecodes: presentation times of the frames
+        :param threshold: minimum score of a cut, between 0 and 1
+        """
+        self.scores = scores
+        self._timecodes = np.asarray(timecodes, dtype=np.int64)
+        self._threshold = threshold
+        self._lock = threading.Lock()
+        self._cuts: T.Optional[T.Tuple[np.array, np.array]] = None
+
+    @property
+    def cuts(self) -> np.array:
+        """Return frames that start a new scene.
+
+        :return: sorted 1D array of frame numbers
+        """
+        return self._get_cuts()[0]
+
+    @property
+    def cut_pts(self) -> np.array:
+        """Return presentation times of frames that start a new scene.
+
+        :return: sorted 1D array of times in milliseconds
+        """
+        return self._get_cuts()[1]
+
+    def update(self, frame_idxs: np.array, scores: np.array) -> None:
+        """Store scores of given frames.
+
+        :param frame_idxs: 1D array of frame numbers
+        :param scores: 1D array of their scores
+        """
+        with self._lock:
+            self.scores[frame_idxs] = scores
+            self._cuts = None
+
+    def _get_cuts(self) -> T.Tuple[np.array, np.array]:
+        # rebuilt only after the scores change, so that lookups just bisect
+        with self._lock:
+            if self._cuts is None:
+                cuts = np.flatnonzero(
+                    self.scores >= self._threshold * SCENE_SCORE_SCALE
+                )
+                self._cuts = (cuts, self._timecodes[cuts])
+            return self._cuts
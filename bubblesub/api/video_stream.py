@@ -16,10 +16,12 @@
 
 """Video API."""
 
-import bisect
+import collections
+import concurrent.futures
 import fractions
+import os
+import queue
 import threading
-import time
 import typing as T
 import uuid
 from pathlib import Path
@@ -29,24 +31,31 @@ import numpy as np
 import PIL.Image
 from PyQt5 import QtCore
 
+from bubblesub.api.ffms2_index import load_index
 from bubblesub.api.log import LogApi
 from bubblesub.api.subs import SubtitlesApi
-from bubblesub.api.threading import ThreadingApi
+from bubblesub.api.threading import QueueWorker, ThreadingApi
+from bubblesub.api.video_scenes import SceneIndex
 from bubblesub.ass_renderer import AssRenderer
+from bubblesub.cfg import Config
 
-_LOADING = object()
-_SAMPLER_LOCK = threading.Lock()
 _PIX_FMT = [ffms2.get_pix_fmt("rgb24")]
 
 
 def _load_video_source(
-    log_api: LogApi, uid: uuid.UUID, path: Path
+    log_api: LogApi,
+    uid: uuid.UUID,
+    path: Path,
+    progress_callback: T.Callable[[int, int], bool],
 ) -> T.Optional[ffms2.VideoSource]:
     """Create video source.
 
     :param log_api: logging API
     :param uid: uid of the stream (for logging)
     :param path: path to the video file
+    :param progress_callback:
+        function receiving indexing progress; returning True from it cancels
+        the loading
     :return: input path and resulting video source
     """
     log_api.info(f"video {uid} started loading ({path})")
@@ -56,7 +65,18 @@ def _load_video_source(
         return None
 
     try:
-        source = ffms2.VideoSource(str(path))
+        index = load_index(
+            log_api,
+            uid,
+            "video",
+            path,
+            ffms2.FFMS_TYPE_VIDEO,
+            progress_callback,
+        )
+        track_number = index.get_first_indexed_track_of_type(
+            ffms2.FFMS_TYPE_VIDEO
+        )
+        source = ffms2.VideoSource(str(path), track_number, index)
     except ffms2.Error as ex:
         log_api.error(f"error loading video {uid} ({ex})")
         return None
@@ -65,15 +85,127 @@ def _load_video_source(
         return source
 
 
+def _align_to_prev(source: np.array, pts: np.array) -> np.array:
+    """Align PTS to the values immediately before them.
+
+    :param source: sorted 1D array of PTS to align to
+    :param pts: PTS to align
+    :return: aligned PTS; PTS before the first value are left intact
+    """
+    if not len(source):
+        return pts
+    idx = np.searchsorted(source, pts, "right") - 1
+    return np.where(idx >= 0, source[np.maximum(idx, 0)], pts)
+
+
+def _align_to_next(source: np.array, pts: np.array) -> np.array:
+    """Align PTS to the values immediately after them.
+
+    :param source: sorted 1D array of PTS to align to
+    :param pts: PTS to align
+    :return: aligned PTS; PTS after the last value are left intact
+    """
+    if not len(source):
+        return pts
+    idx = np.searchsorted(source, pts, "left")
+    return np.where(
+        idx < len(source), source[np.minimum(idx, len(source) - 1)], pts
+    )
+
+
+def _align_to_near(source: np.array, pts: np.array) -> np.array:
+    """Align PTS to the values closest to them.
+
+    :param source: sorted 1D array of PTS to align to
+    :param pts: PTS to align
+    :return: aligned PTS; ties go to the earlier value
+    """
+    if not len(source):
+        return pts
+    max_idx = len(source) - 1
+    prev_pts = source[
+        np.clip(np.searchsorted(source, pts, "right") - 1, 0, max_idx)
+    ]
+    next_pts = source[
+        np.clip(np.searchsorted(source, pts, "left"), 0, max_idx)
+    ]
+    return np.where(
+        np.abs(next_pts - pts) < np.abs(prev_pts - pts), next_pts, prev_pts
+    )
+
+
+def _align(
+    func: T.Callable[[np.array, np.array], np.array],
+    source: np.array,
+    pts: T.Union[int, np.array],
+) -> T.Union[int, np.array]:
+    """Align scalar or vectorized PTS.
+
+    :param func: alignment function
+    :param source: sorted 1D array of PTS to align to
+    :param pts: PTS to align
+    :return: aligned PTS, of the same kind as the input
+    """
+    ret = func(source, np.asarray(pts))
+    if isinstance(pts, np.ndarray):
+        return ret
+    return int(ret)
+
+
+def _save_screenshot(
+    frame: np.array, subs_image: T.Optional[PIL.Image], path: Path
+) -> None:
+    """Compose a screenshot and save it to a file.
+
+    :param frame: 3D array of RGB24 pixels
+    :param subs_image: optional RGBA image of the subtitles
+    :param path: path to save the screenshot to; its extension determines
+        the image format
+    """
+    if not frame.flags.c_contiguous:
+        frame = frame.copy(order="C")
+    image = PIL.Image.fromarray(frame, "RGB")
+    if subs_image is not None:
+        image = PIL.Image.composite(subs_image, image, subs_image)
+    image.save(str(path))
+
+
+class _FramePrefetcher(QueueWorker):
+    """Worker that decodes frames ahead of time into the frame cache."""
+
+    def __init__(
+        self,
+        log_api: LogApi,
+        decode_func: T.Callable[[int, int, int], T.Any],
+    ) -> None:
+        """Initialize self.
+
+        :param log_api: logging API
+        :param decode_func: function that puts given frame into the cache
+        """
+        super().__init__(log_api)
+        self._decode_func = decode_func
+
+    def _process_task(self, task: T.Tuple[int, int, int]) -> None:
+        """Decode a frame.
+
+        :param task: frame index, output width and output height
+        """
+        if not self._is_task_canceled():
+            self._decode_func(*task)
+
+
 class VideoStream(QtCore.QObject):
     """The video API."""
 
     errored = QtCore.pyqtSignal()
     changed = QtCore.pyqtSignal()
     loaded = QtCore.pyqtSignal()
+    load_progress = QtCore.pyqtSignal(int)
 
     def __init__(
         self,
+        cfg: Config,
         threading_api: ThreadingApi,
         log_api: LogApi,
         subs_api: SubtitlesApi,
@@ -81,6 +213,7 @@ class VideoStream(QtCore.QObject):
     ) -> None:
         """Initialize self.
 
+        :param cfg: program configuration
         :param threading_api: threading API
         :param log_api: logging API
         :param subs_api: subtitles API
@@ -94,24 +227,46 @@ class VideoStream(QtCore.QObject):
         self.uid = uuid.uuid4()
 
         self._path = path
-        self._timecodes: T.List[int] = []
-        self._keyframes: T.List[int] = []
+        self._timecodes = np.empty(0, dtype=np.int64)
+        self._keyframes = np.empty(0, dtype=np.int64)
+        self._keyframe_timecodes = np.empty(0, dtype=np.int64)
         self._frame_rate = fractions.Fraction(0, 1)
         self._aspect_ratio = fractions.Fraction(1, 1)
         self._width = 0
         self._height = 0
+        self._scene_index: T.Optional[SceneIndex] = None
 
         self._ass_renderer = AssRenderer()
         self._source: T.Union[None, ffms2.VideoSource] = None
 
         self._last_output_fmt: T.Any = None
 
-        self._log_api.info(f"video: loading {path}")
-        self._threading_api.schedule_task(
-            lambda: _load_video_source(self._log_api, self.uid, self._path),
-            self._got_source,
+        self._frame_cache: T.MutableMapping[
+            T.Tuple[int, int, int], np.array
+        ] = collections.OrderedDict()
+        self._frame_cache_lock = threading.Lock()
+        self._frame_cache_size = 0
+        self._frame_cache_max_size = int(cfg.opt["video"]["frame_cache_size"])
+        self._prefetch_count = int(cfg.opt["video"]["frame_prefetch"])
+        self._prefetcher: T.Optional[_FramePrefetcher] = None
+        self._screenshot_workers = (
+            int(cfg.opt["video"]["screenshot_workers"]) or os.cpu_count() or 1
         )
 
+        # decoders for iter_frames and their output formats
+        self._spare_decoders: T.List[T.Tuple[ffms2.VideoSource, T.Any]] = []
+        self._spare_decoders_lock = threading.Lock()
+
+        self._load_percentage = -1
+        self._load_canceled = threading.Event()
+        # decoders aren't thread safe, but separate streams can decode
+        # in parallel
+        self._decoder_lock = threading.Lock()
+        self._source_ready = threading.Event()
+
+        self._log_api.info(f"video: loading {path}")
+        self._threading_api.schedule_task(self._load_source, self._got_source)
+
     @property
     def path(self) -> Path:
         """Return video source path.
@@ -128,6 +283,33 @@ class VideoStream(QtCore.QObject):
         """
         return self._source is not None
 
+    def wait_until_ready(self, timeout: T.Optional[float] = None) -> bool:
+        """Block until the video finishes loading.
+
+        :param timeout: how many seconds to wait at most; None to wait for as
+            long as it takes
+        :return: whether the video is loaded
+        """
+        return self._source_ready.wait(timeout) and self._source is not None
+
+    def cancel_loading(self) -> None:
+        """Abort indexing the video, if it's still in progress, stop
+        prefetching frames and release the decoders kept for iter_frames
+        and the subtitle renderer.
+
+        The stream emits the errored signal once the indexing stops.
+        """
+        self._load_canceled.set()
+        # release the threads waiting for the video right away, rather than
+        # once the indexer notices the cancellation
+        self._source_ready.set()
+        if self._prefetcher:
+            self._prefetcher.stop()
+            self._prefetcher = None
+        with self._spare_decoders_lock:
+            self._spare_decoders.clear()
+        self._ass_renderer.close()
+
     def screenshot(
         self,
         pts: int,
@@ -144,93 +326,188 @@ class VideoStream(QtCore.QObject):
         :param width: optional width to render to
         :param height: optional height to render to
         """
-
-        if width and height:
-            grab_width = width
-            grab_height = height
-        elif height:
-            grab_width = int(self.width * height / self.height)
-            grab_height = height
-        elif width:
-            grab_height = int(self.height * width / self.width)
-            grab_width = width
-        else:
-            grab_width = self.width
-            grab_height = self.height
-
-        if grab_width <= 0 or grab_height <= 0:
-            raise ValueError("cannot take a screenshot at negative resolution")
-
+        grab_width, grab_height = self._get_screenshot_size(width, height)
         pts = self.align_pts_to_prev_frame(pts)
-        idx = self.timecodes.index(pts)
+        idx = int(self.frame_idx_from_pts(pts))
         frame = self.get_frame(idx, grab_width, grab_height)
-        if not frame.flags.c_contiguous:
-            frame = frame.copy(order="C")
-        image = PIL.Image.frombytes("RGB", (grab_width, grab_height), frame)
 
+        subs_image: T.Optional[PIL.Image] = None
         if include_subtitles:
-            self._ass_renderer.set_source(
-                self._subs_api.styles,
-                self._subs_api.events,
-                self._subs_api.meta,
-                (grab_width, grab_height),
-            )
+            self._set_renderer_source(grab_width, grab_height)
             subs_image = self._ass_renderer.render(
                 time=pts, aspect_ratio=self._aspect_ratio
             )
-            image = PIL.Image.composite(subs_image, image, subs_image)
 
-        image.save(str(path))
+        _save_screenshot(frame, subs_image, path)
+
+    def save_screenshots(
+        self,
+        items: T.Iterable[T.Tuple[int, Path]],
+        include_subtitles: bool,
+        width: T.Optional[int],
+        height: T.Optional[int],
+        progress_callback: T.Optional[T.Callable[[int, int], bool]] = None,
+    ) -> int:
+        """Save screenshots of many frames at once.
+
+        The frames are decoded in PTS order by a dedicated decoder. The
+        subtitles are rendered, composited and encoded on a pool of threads
+        while the next frames are decoded. Each thread has its own subtitle
+        renderer, so that libass doesn't serialize the work.
 
-    def align_pts_to_near_frame(self, pts: int) -> int:
+        :param items: pairs of PTS and paths to save the screenshots to
+        :param include_subtitles: whether to 'burn in' the subtitles
+        :param width: optional width to render to
+        :param height: optional height to render to
+        :param progress_callback: function receiving the number of saved
+            screenshots and their total; returning True from it cancels the
+            export
+        :return: number of saved screenshots
+        """
+        grab_width, grab_height = self._get_screenshot_size(width, height)
+
+        jobs: T.Dict[
+            int, T.List[T.Tuple[int, Path]]
+        ] = collections.defaultdict(list)
+        for pts, path in items:
+            pts = self.align_pts_to_prev_frame(pts)
+            jobs[int(self.frame_idx_from_pts(pts))].append((pts, path))
+        total = sum(len(frame_jobs) for frame_jobs in jobs.values())
+
+        # renderers are only created when all the others are busy, so there's
+        # at most one per worker
+        renderers: "queue.SimpleQueue[AssRenderer]" = queue.SimpleQueue()
+        all_renderers: T.List[AssRenderer] = []
+
+        def save(frame: np.array, pts: int, path: Path) -> None:
+            """Render the subtitles for a frame and save the screenshot.
+
+            :param frame: 3D array of RGB24 pixels
+            :param pts: PTS to render the subtitles at
+            :param path: path to save the screenshot to
+            """
+            subs_image: T.Optional[PIL.Image] = None
+            if include_subtitles:
+                try:
+                    renderer = renderers.get_nowait()
+                except queue.Empty:
+                    renderer = AssRenderer()
+                    all_renderers.append(renderer)
+                try:
+                    renderer.set_source(
+                        self._subs_api.styles,
+                        self._subs_api.events,
+                        self._subs_api.meta,
+                        (grab_width, grab_height),
+                    )
+                    subs_image = renderer.render(
+                        time=pts, aspect_ratio=self._aspect_ratio
+                    )
+                finally:
+                    renderers.put(renderer)
+            _save_screenshot(frame, subs_image, path)
+
+        done = 0
+        pending: T.Deque[concurrent.futures.Future] = collections.deque()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                self._screenshot_workers
+            ) as executor:
+                try:
+                    for frame_idx, frame in self.iter_frames(
+                        jobs.keys(), grab_width, grab_height
+                    ):
+                        for pts, path in jobs[frame_idx]:
+                            pending.append(
+                                executor.submit(save, frame, pts, path)
+                            )
+
+                        # don't let the decoded frames pile up
+                        while len(pending) > 2 * self._screenshot_workers or (
+                            pending and pending[0].done()
+                        ):
+                            pending.popleft().result()
+                            done += 1
+                            if progress_callback and progress_callback(
+                                done, total
+                            ):
+                                return done
+
+                    while pending:
+                        pending.popleft().result()
+                        done += 1
+                        if progress_callback and progress_callback(
+                            done, total
+                        ):
+                            return done
+                finally:
+                    for future in pending:
+                        future.cancel()
+        finally:
+            # the renderers follow the subtitles until they're closed
+            for renderer in all_renderers:
+                renderer.close()
+        return done
+
+    def align_pts_to_near_frame(
+        self, pts: T.Union[int, np.array]
+    ) -> T.Union[int, np.array]:
         """Align PTS to a frame closest to given PTS.
 
-        :param pts: PTS to align
+        :param pts: PTS to align, either a number or a numpy array
         :return: aligned PTS
         """
-        if self.timecodes:
-            max_idx = len(self.timecodes) - 1
-            idx1 = max(
-                0, min(max_idx, bisect.bisect_right(self.timecodes, pts) - 1)
-            )
-            idx2 = max(
-                0, min(max_idx, bisect.bisect_left(self.timecodes, pts))
-            )
-            return min(
-                [self.timecodes[idx1], self.timecodes[idx2]],
-                key=lambda val: abs(val - pts),
-            )
-        return pts
+        return _align(_align_to_near, self.timecodes, pts)
 
-    def align_pts_to_prev_frame(self, pts: int) -> int:
+    def align_pts_to_prev_frame(
+        self, pts: T.Union[int, np.array]
+    ) -> T.Union[int, np.array]:
         """Align PTS to a frame immediately before given PTS.
 
-        :param pts: PTS to align
+        :param pts: PTS to align, either a number or a numpy array
         :return: aligned PTS
         """
-        if self.timecodes:
-            idx = bisect.bisect_right(self.timecodes, pts) - 1
-            if idx >= len(self.timecodes):
-                return self.timecodes[-1]
-            if pts < self.timecodes[idx]:
-                return pts
-            return self.timecodes[idx]
-        return pts
+        return _align(_align_to_prev, self.timecodes, pts)
 
-    def align_pts_to_next_frame(self, pts: int) -> int:
+    def align_pts_to_next_frame(
+        self, pts: T.Union[int, np.array]
+    ) -> T.Union[int, np.array]:
         """Align PTS to a frame immediately after given PTS.
 
-        :param pts: PTS to align
+        :param pts: PTS to align, either a number or a numpy array
         :return: aligned PTS
         """
-        if self.timecodes:
-            idx = bisect.bisect_left(self.timecodes, pts)
-            if idx >= len(self.timecodes):
-                return pts
-            if pts < 0:
-                return self.timecodes[0]
-            return self.timecodes[idx]
-        return pts
+        return _align(_align_to_next, self.timecodes, pts)
+
+    def align_pts_to_near_keyframe(
+        self, pts: T.Union[int, np.array]
+    ) -> T.Union[int, np.array]:
+        """Align PTS to a keyframe closest to given PTS.
+
+        :param pts: PTS to align, either a number or a numpy array
+        :return: aligned PTS
+        """
+        return _align(_align_to_near, self.keyframe_timecodes, pts)
+
+    def align_pts_to_prev_keyframe(
+        self, pts: T.Union[int, np.array]
+    ) -> T.Union[int, np.array]:
+        """Align PTS to a keyframe immediately before given PTS.
+
+        :param pts: PTS to align, either a number or a numpy array
+        :return: aligned PTS
+        """
+        return _align(_align_to_prev, self.keyframe_timecodes, pts)
+
+    def align_pts_to_next_keyframe(
+        self, pts: T.Union[int, np.array]
+    ) -> T.Union[int, np.array]:
+        """Align PTS to a keyframe immediately after given PTS.
+
+        :param pts: PTS to align, either a number or a numpy array
+        :return: aligned PTS
+        """
+        return _align(_align_to_next, self.keyframe_timecodes, pts)
 
     def frame_idx_from_pts(
         self, pts: T.Union[float, int, np.array]
@@ -241,7 +518,9 @@ class VideoStream(QtCore.QObject):
         :return: frame index, -1 if not found
         """
         ret = np.searchsorted(self.timecodes, pts, "right").astype(np.int)
-        ret = np.clip(ret - 1, a_min=0 if self.timecodes else -1, a_max=None)
+        ret = np.clip(
+            ret - 1, a_min=0 if len(self.timecodes) else -1, a_max=None
+        )
         return ret
 
     @property
@@ -277,34 +556,64 @@ class VideoStream(QtCore.QObject):
         return self._aspect_ratio
 
     @property
-    def timecodes(self) -> T.List[int]:
+    def timecodes(self) -> np.array:
         """Return video frames' PTS.
 
-        :return: video frames' PTS
+        :return: sorted 1D array of video frames' PTS
         """
-        if not self._wait_for_source():
-            return []
+        if self._source is None:
+            return np.empty(0, dtype=np.int64)
         return self._timecodes
 
     @property
-    def keyframes(self) -> T.List[int]:
+    def keyframes(self) -> np.array:
         """Return video keyframes' indexes.
 
-        :return: video keyframes' indexes
+        :return: sorted 1D array of video keyframes' indexes
         """
-        if not self._wait_for_source():
-            return []
+        if self._source is None:
+            return np.empty(0, dtype=np.int64)
         return self._keyframes
 
+    @property
+    def keyframe_timecodes(self) -> np.array:
+        """Return video keyframes' PTS.
+
+        :return: sorted 1D array of video keyframes' PTS
+        """
+        if self._source is None:
+            return np.empty(0, dtype=np.int64)
+        return self._keyframe_timecodes
+
+    @property
+    def scene_index(self) -> T.Optional[SceneIndex]:
+        """Return per-frame scene change scores.
+
+        The scores are filled in as the video band is generated;
+        changed is emitted whenever they change.
+
+        :return: scene index or None if not available
+        """
+        return self._scene_index
+
+    @scene_index.setter
+    def scene_index(self, value: T.Optional[SceneIndex]) -> None:
+        """Set per-frame scene change scores.
+
+        :param value: new scene index
+        """
+        self._scene_index = value
+        self.changed.emit()
+
     @property
     def min_pts(self) -> int:
         """Return minimum video time in milliseconds.
 
         :return: minimum PTS
         """
-        if not self.timecodes:
+        if not len(self.timecodes):
             return 0
-        return self.timecodes[0]
+        return int(self.timecodes[0])
 
     @property
     def max_pts(self) -> int:
@@ -312,23 +621,110 @@ class VideoStream(QtCore.QObject):
 
         :return: maximum PTS
         """
-        if not self.timecodes:
+        if not len(self.timecodes):
             return 0
-        return self.timecodes[-1]
+        return int(self.timecodes[-1])
 
     def get_frame(
         self, frame_idx: int, width: int, height: int
     ) -> T.Optional[np.array]:
         """Get raw video data from the currently loaded video source.
 
+        Recently used frames are served from a cache. If prefetching is
+        enabled, the neighboring frames are then decoded in the background.
+
         :param frame_idx: frame number
         :param width: output image width
         :param height: output image height
-        :return: numpy image
+        :return: read-only numpy image
+        """
+        frame = self._get_frame(frame_idx, width, height)
+        if frame is not None and self._prefetch_count > 0:
+            self._prefetch(frame_idx, width, height)
+        return frame
+
+    def iter_frames(
+        self, frame_idxs: T.Iterable[int], width: int, height: int
+    ) -> T.Iterable[T.Tuple[int, np.array]]:
+        """Decode many frames one after another.
+
+        The frames are decoded in ascending order by a dedicated decoder
+        that keeps its output format, so that each GOP is decoded linearly
+        from its keyframe instead of seeking for every frame, and the
+        decoding doesn't compete with get_frame. Concurrent calls get
+        separate single-threaded decoders opened from the same index, so
+        they decode in parallel. The frame cache is bypassed.
+
+        :param frame_idxs: frame numbers
+        :param width: output image width
+        :param height: output image height
+        :return: generator of frame numbers and numpy images
         """
-        with _SAMPLER_LOCK:
+        if not self.wait_until_ready():
+            return
+        assert self._source
+
+        with self._spare_decoders_lock:
+            spare_decoder = (
+                self._spare_decoders.pop() if self._spare_decoders else None
+            )
+        if spare_decoder:
+            decoder, output_fmt = spare_decoder
+        else:
+            # concurrent calls already keep the cores busy, so a decoder
+            # with its own thread per core would only oversubscribe them
+            decoder = ffms2.VideoSource(
+                str(self._path),
+                self._source.track_number,
+                self._source.index,
+                num_threads=1,
+            )
+            output_fmt = None
+
+        try:
+            frame_count = len(self.timecodes)
+            for frame_idx in sorted(frame_idxs):
+                if frame_idx < 0 or frame_idx >= frame_count:
+                    continue
+
+                new_output_fmt = (
+                    _PIX_FMT,
+                    width,
+                    height,
+                    ffms2.FFMS_RESIZER_AREA,
+                )
+                if output_fmt != new_output_fmt:
+                    decoder.set_output_format(*new_output_fmt)
+                    output_fmt = new_output_fmt
+
+                ffms_frame = decoder.get_frame(frame_idx)
+                yield frame_idx, (
+                    ffms_frame.planes[0]
+                    .reshape((height, ffms_frame.Linesize[0]))[
+                        :, 0 : width * 3
+                    ]
+                    .reshape(height, width, 3)
+                    .copy()
+                )
+        finally:
+            with self._spare_decoders_lock:
+                if not self._load_canceled.is_set():
+                    self._spare_decoders.append((decoder, output_fmt))
+
+    def _get_frame(
+        self, frame_idx: int, width: int, height: int
+    ) -> T.Optional[np.array]:
+        key = (frame_idx, width, height)
+        with self._frame_cache_lock:
+            frame = self._frame_cache.get(key)
+            if frame is not None:
+                self._frame_cache[key] = self._frame_cache.pop(key)
+                return frame
+
+        self._source_ready.wait()
+        with self._decoder_lock:
             if (
-                not self._wait_for_source()
+                self._source is None
                 or frame_idx < 0
                 or frame_idx >= len(self.timecodes)
             ):
@@ -340,55 +736,140 @@ class VideoStream(QtCore.QObject):
                 self._source.set_output_format(*new_output_fmt)
                 self._last_output_fmt = new_output_fmt
 
-            frame = self._source.get_frame(frame_idx)
-            return (
-                frame.planes[0]
-                .reshape((height, frame.Linesize[0]))[:, 0 : width * 3]
+            # the decoder reuses its buffer for the next frame
+            ffms_frame = self._source.get_frame(frame_idx)
+            frame = (
+                ffms_frame.planes[0]
+                .reshape((height, ffms_frame.Linesize[0]))[:, 0 : width * 3]
                 .reshape(height, width, 3)
+                .copy()
             )
+        frame.flags.writeable = False
+
+        with self._frame_cache_lock:
+            if key not in self._frame_cache:
+                self._frame_cache[key] = frame
+                self._frame_cache_size += frame.nbytes
+            while (
+                self._frame_cache_size > self._frame_cache_max_size
+                and self._frame_cache
+            ):
+                _key, evicted = self._frame_cache.popitem(last=False)
+                self._frame_cache_size -= evicted.nbytes
+        return frame
+
+    def _prefetch(self, frame_idx: int, width: int, height: int) -> None:
+        if not self._prefetcher:
+            self._prefetcher = _FramePrefetcher(self._log_api, self._get_frame)
+            self._threading_api.schedule_runnable(self._prefetcher)
+        self._prefetcher.clear_tasks()
+
+        # decoding forward is cheap, so go through both the following and
+        # the preceding frames in the decoding order
+        first_idx = max(0, frame_idx - self._prefetch_count)
+        last_idx = min(
+            len(self.timecodes) - 1, frame_idx + self._prefetch_count
+        )
+        with self._frame_cache_lock:
+            idxs = [
+                idx
+                for idx in range(first_idx, last_idx + 1)
+                if (idx, width, height) not in self._frame_cache
+            ]
+        for idx in idxs:
+            self._prefetcher.schedule_task((idx, width, height))
+
+    def _on_load_progress(self, current: int, total: int) -> bool:
+        percentage = current * 100 // total if total > 0 else 0
+        if percentage != self._load_percentage:
+            self._load_percentage = percentage
+            self.load_progress.emit(percentage)
+        return self._load_canceled.is_set()
+
+    def _get_screenshot_size(
+        self, width: T.Optional[int], height: T.Optional[int]
+    ) -> T.Tuple[int, int]:
+        if width and height:
+            grab_width = width
+            grab_height = height
+        elif height:
+            grab_width = int(self.width * height / self.height)
+            grab_height = height
+        elif width:
+            grab_height = int(self.height * width / self.width)
+            grab_width = width
+        else:
+            grab_width = self.width
+            grab_height = self.height
 
-    def _got_source(self, source: ffms2.VideoSource) -> None:
-        with _SAMPLER_LOCK:
-            self._source = source
-
-            if source is None:
-                self.errored.emit()
-                return
+        if grab_width <= 0 or grab_height <= 0:
+            raise ValueError("cannot take a screenshot at negative resolution")
+        return grab_width, grab_height
+
+    def _set_renderer_source(self, width: int, height: int) -> None:
+        self._ass_renderer.set_source(
+            self._subs_api.styles,
+            self._subs_api.events,
+            self._subs_api.meta,
+            (width, height),
+        )
 
-            self._timecodes = [
-                int(round(pts)) for pts in source.track.timecodes
-            ]
-            self._keyframes = source.track.keyframes[:]
-            self._timecodes.sort()
-            self._keyframes.sort()
+    def _load_source(self) -> T.Optional[ffms2.VideoSource]:
+        try:
+            return self._set_source(
+                _load_video_source(
+                    self._log_api, self.uid, self._path, self._on_load_progress
+                )
+            )
+        finally:
+            # unexpected errors are only logged by the threading API, and
+            # mustn't leave the threads waiting for the video stuck
+            self._source_ready.set()
+
+    def _set_source(
+        self, source: T.Optional[ffms2.VideoSource]
+    ) -> T.Optional[ffms2.VideoSource]:
+        # runs on the loading thread, so that the threads waiting for the
+        # video don't need to wait for the Qt event loop as well
+        if source is not None:
+            self._timecodes = np.sort(
+                np.round(source.track.timecodes).astype(np.int64)
+            )
+            self._keyframes = np.sort(
+                np.asarray(source.track.keyframes, dtype=np.int64)
+            )
+            self._keyframe_timecodes = self._timecodes[self._keyframes]
 
             self._frame_rate = fractions.Fraction(
-                self._source.properties.FPSNumerator,
-                self._source.properties.FPSDenominator,
+                source.properties.FPSNumerator,
+                source.properties.FPSDenominator,
             )
 
             self._aspect_ratio = (
                 fractions.Fraction(
-                    self._source.properties.SARNum,
-                    self._source.properties.SARDen,
-                )
-                if (
-                    self._source.properties.SARNum
-                    and self._source.properties.SARDen
+                    source.properties.SARNum, source.properties.SARDen
                 )
+                if (source.properties.SARNum and source.properties.SARDen)
                 else fractions.Fraction(1, 1)
             )
 
-            frame = source.get_frame(0)
-            self._width = frame.EncodedWidth
-            self._height = int(frame.EncodedHeight / self._aspect_ratio)
-            self.loaded.emit()
+            try:
+                frame = source.get_frame(0)
+            except ffms2.Error as ex:
+                # the stream is broken, even though ffms2 could index it
+                self._log_api.error(f"error loading video {self.uid} ({ex})")
+                source = None
+            else:
+                self._width = frame.EncodedWidth
+                self._height = int(frame.EncodedHeight / self._aspect_ratio)
+
+        with self._decoder_lock:
+            self._source = source
+        self._source_ready.set()
+        return source
 
-    def _wait_for_source(self) -> bool:
-        if self._source is None:
-            return False
-        while self._source is _LOADING:
-            time.sleep(0.01)
-        if self._source is None:
-            return False
-        return True
+    def _got_source(self, source: T.Optional[ffms2.VideoSource]) -> None:
+        if source is None:
+            self.errored.emit()
+            return
+        self.loaded.emit()
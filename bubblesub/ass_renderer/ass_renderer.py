@@ -19,15 +19,102 @@
 
 import ctypes
 import fractions
+import threading
 import typing as T
 
 import numpy as np
 import PIL.Image
 
 from bubblesub.ass_renderer import libass
-from bubblesub.fmt.ass.event import AssEventList
+from bubblesub.fmt.ass.event import AssEvent, AssEventList
 from bubblesub.fmt.ass.meta import AssMeta
-from bubblesub.fmt.ass.style import AssStyleList
+from bubblesub.fmt.ass.style import AssStyle, AssStyleList
+
+
+def _get_mask(layer: libass.AssImage) -> np.array:
+    """View the coverage bitmap of a libass image without copying it.
+
+    :param layer: libass image
+    :return: 2D array of uint8 coverage
+    """
+    return np.lib.stride_tricks.as_strided(
+        np.frombuffer(
+            (ctypes.c_uint8 * (layer.stride * layer.h)).from_address(
+                ctypes.addressof(layer.bitmap.contents)
+            ),
+            dtype=np.uint8,
+        ),
+        (layer.h, layer.w),
+        (layer.stride, 1),
+    )
+
+
+def _composite(layers: T.List[libass.AssImage], image_data: np.array) -> None:
+    """Blend libass images together.
+
+    The images are blended with premultiplied alpha into a float accumulator
+    that covers only their common bounding box. Each image touches only its
+    own bounding box, and the per-image temporaries reuse the same scratch
+    buffers.
+
+    :param layers: libass images, from the bottom to the top
+    :param image_data: 3D array of RGBA pixels to write the result to
+    """
+    layers = [layer for layer in layers if layer.w > 0 and layer.h > 0]
+    if not layers:
+        return
+
+    left = min(layer.dst_x for layer in layers)
+    top = min(layer.dst_y for layer in layers)
+    right = max(layer.dst_x + layer.w for layer in layers)
+    bottom = max(layer.dst_y + layer.h for layer in layers)
+    max_area = max(layer.w * layer.h for layer in layers)
+
+    acc = np.zeros((bottom - top, right - left, 4), dtype=np.float32)
+    # flat, so that the views for each layer are contiguous
+    alpha_buffer = np.empty(max_area, dtype=np.float32)
+    delta_buffer = np.empty(max_area * 4, dtype=np.float32)
+
+    for layer in layers:
+        red, green, blue, alpha = layer.rgba
+        fragment = acc[
+            layer.dst_y - top : layer.dst_y - top + layer.h,
+            layer.dst_x - left : layer.dst_x - left + layer.w,
+        ]
+        area = layer.w * layer.h
+        src_alpha = alpha_buffer[:area].reshape(layer.h, layer.w, 1)
+        delta = delta_buffer[: area * 4].reshape(layer.h, layer.w, 4)
+
+        # out = dst + src_alpha * (src_color - dst), with the alpha channel
+        # treated as a color that is always fully opaque
+        np.multiply(
+            _get_mask(layer)[..., None],
+            (255 - alpha) / (255 * 255),
+            out=src_alpha,
+            dtype=np.float32,
+        )
+        np.subtract(
+            np.array(
+                (red / 255, green / 255, blue / 255, 1), dtype=np.float32
+            ),
+            fragment,
+            out=delta,
+        )
+        np.multiply(delta, src_alpha, out=delta)
+        np.add(fragment, delta, out=fragment)
+
+    # transparent pixels have no color to recover, so any divisor will do
+    acc_alpha = acc[..., 3]
+    color_scale = np.maximum(acc_alpha, 1e-6)
+    np.divide(255, color_scale, out=color_scale)
+    np.multiply(acc[..., :3], color_scale[..., None], out=acc[..., :3])
+    np.multiply(acc_alpha, 255, out=acc_alpha)
+    np.add(acc, 0.5, out=acc)
+    np.copyto(image_data[top:bottom, left:right], acc, casting="unsafe")
+
+
+# libass track method and its arguments
+_TrackChange = T.Tuple[T.Any, ...]
 
 
 class AssRenderer:
@@ -39,6 +126,17 @@ class AssRenderer:
         self._renderer = self._ctx.make_renderer()
         self._renderer.set_fonts()
         self._track: T.Optional[libass.AssTrack] = None
+        # serializes the use of the track and the libass renderer
+        self._render_lock = threading.Lock()
+        # guards the source lists and the changes waiting to be applied to
+        # the track; it's only held briefly, so that editing the subtitles
+        # never waits for the rendering
+        self._changes_lock = threading.Lock()
+        self._changes: T.List[_TrackChange] = []
+        self._track_dirty = False
+        self._n_events = 0
+        self._changes_in_progress = 0
+        self._rebuilt_during_change = False
         self.style_list: T.Optional[AssStyleList] = None
         self.event_list: T.Optional[AssEventList] = None
         self.meta: T.Optional[AssMeta] = None
@@ -53,36 +151,212 @@ class AssRenderer:
     ) -> None:
         """Set source ASS data.
 
+        The libass track is reused for as long as the same lists are passed.
+        Changes to the events are recorded as they happen and applied to it
+        before the next rendering, while changes to the styles or metadata
+        rebuild it, so repeated calls for the same document are cheap.
+
         :param style_list: list of ASS styles
         :param event_list: list of ASS events
         :param meta: ASS metadata
         :param video_resolution: (width, height) tuple
         """
-        self.style_list = style_list
-        self.event_list = event_list
-        self.meta = meta
-        self.video_resolution = video_resolution
+        with self._render_lock:
+            source: T.Optional[
+                T.Tuple[T.List[AssStyle], T.List[AssEvent]]
+            ] = None
+            with self._changes_lock:
+                if (
+                    style_list is not self.style_list
+                    or event_list is not self.event_list
+                    or meta is not self.meta
+                ):
+                    self._disconnect_source()
+                    self.style_list = style_list
+                    self.event_list = event_list
+                    self.meta = meta
+                    self._connect_source()
+                    self._track_dirty = True
 
-        self._track = self._ctx.make_track()
-        self._track.populate(style_list, event_list)
+                if self._track_dirty or self._track is None:
+                    # the lists might be edited on another thread, so the
+                    # track is built from their snapshot
+                    source = (list(style_list), list(event_list))
+                    self._track_dirty = False
+                    self._changes.clear()
+                    self._n_events = len(event_list)
+                    self._rebuilt_during_change = self._changes_in_progress > 0
 
-        self._track.play_res_x = int(
-            meta.get("PlayResX") or video_resolution[0]
-        )
-        self._track.play_res_y = int(
-            meta.get("PlayResY") or video_resolution[1]
-        )
-        self._track.wrap_style = int(meta.get("WrapStyle") or 1)
-        self._track.scaled_border_and_shadow = (
-            meta.get("ScaledBorderAndShadow", "yes") == "yes"
-        )
+            if source is not None:
+                self._track = self._ctx.make_track()
+                self._track.populate(*source)
+                self._track.wrap_style = int(meta.get("WrapStyle") or 1)
+                self._track.scaled_border_and_shadow = (
+                    meta.get("ScaledBorderAndShadow", "yes") == "yes"
+                )
+                self.video_resolution = None
+            self._apply_changes()
+            assert self._track is not None
+
+            if video_resolution != self.video_resolution:
+                self.video_resolution = video_resolution
+                self._track.play_res_x = int(
+                    meta.get("PlayResX") or video_resolution[0]
+                )
+                self._track.play_res_y = int(
+                    meta.get("PlayResY") or video_resolution[1]
+                )
+                self._renderer.storage_size = (
+                    self._track.play_res_x,
+                    self._track.play_res_y,
+                )
+                self._renderer.frame_size = video_resolution
+                self._renderer.pixel_aspect = 1.0
+
+    def close(self) -> None:
+        """Stop following the source lists and free the libass track.
+
+        The renderer needs a new source before rendering again.
+        """
+        with self._render_lock:
+            with self._changes_lock:
+                self._disconnect_source()
+                self.style_list = None
+                self.event_list = None
+                self.meta = None
+                self._changes.clear()
+                self._changes_in_progress = 0
+                self._rebuilt_during_change = False
+            self._track = None
+            self.video_resolution = None
+
+    def _get_source_connections(
+        self,
+    ) -> T.List[T.Tuple[T.Any, T.Callable[..., None]]]:
+        ret: T.List[T.Tuple[T.Any, T.Callable[..., None]]] = []
+        if self.style_list is not None:
+            ret += [
+                (
+                    self.style_list.items_about_to_be_inserted,
+                    self._begin_change,
+                ),
+                (
+                    self.style_list.items_about_to_be_removed,
+                    self._begin_change,
+                ),
+                (self.style_list.items_about_to_be_moved, self._begin_change),
+                (self.style_list.item_modified, self._invalidate_track),
+                (self.style_list.items_inserted, self._on_styles_changed),
+                (self.style_list.items_removed, self._on_styles_changed),
+                (self.style_list.items_moved, self._on_styles_changed),
+            ]
+        if self.event_list is not None:
+            ret += [
+                (
+                    self.event_list.items_about_to_be_inserted,
+                    self._begin_change,
+                ),
+                (
+                    self.event_list.items_about_to_be_removed,
+                    self._begin_change,
+                ),
+                (self.event_list.items_about_to_be_moved, self._begin_change),
+                (self.event_list.item_modified, self._on_event_modified),
+                (self.event_list.items_inserted, self._on_events_inserted),
+                (self.event_list.items_removed, self._on_events_removed),
+                (self.event_list.items_moved, self._on_events_moved),
+            ]
+        if self.meta is not None:
+            ret.append((self.meta.changed, self._invalidate_track))
+        return ret
+
+    def _connect_source(self) -> None:
+        for signal, slot in self._get_source_connections():
+            signal.connect(slot)
+
+    def _disconnect_source(self) -> None:
+        for signal, slot in self._get_source_connections():
+            signal.disconnect(slot)
+
+    def _apply_changes(self) -> None:
+        with self._changes_lock:
+            changes, self._changes = self._changes, []
+        if self._track is not None:
+            for method, *args in changes:
+                method(self._track, *args)
+
+    def _invalidate_track(self, *_args: T.Any) -> None:
+        # styles and metadata affect all the events, so changing them
+        # rebuilds the whole track on the next call to set_source
+        with self._changes_lock:
+            self._track_dirty = True
+            self._changes.clear()
+
+    def _begin_change(self, *_args: T.Any) -> None:
+        with self._changes_lock:
+            self._changes_in_progress += 1
 
-        self._renderer.storage_size = (
-            self._track.play_res_x,
-            self._track.play_res_y,
+    def _end_change(
+        self, change: T.Optional[_TrackChange], n_events_delta: int = 0
+    ) -> None:
+        with self._changes_lock:
+            if self._changes_in_progress:
+                self._changes_in_progress -= 1
+            else:
+                # the change began before the lists were connected, so
+                # there's no telling whether the track already has it
+                self._track_dirty = True
+            if self._rebuilt_during_change:
+                # the track was built from the lists halfway through
+                # a change, so the same goes for it
+                if not self._changes_in_progress:
+                    self._rebuilt_during_change = False
+                    self._track_dirty = True
+            elif change is None:
+                self._track_dirty = True
+            elif not self._track_dirty:
+                self._changes.append(change)
+                self._n_events += n_events_delta
+            if self._track_dirty:
+                self._changes.clear()
+
+    def _on_styles_changed(self, *_args: T.Any) -> None:
+        self._end_change(None)
+
+    def _on_event_modified(self, idx: int) -> None:
+        with self._changes_lock:
+            # events report being modified when they get attached to the
+            # list, before the insertion itself is signalled - these are
+            # populated by _on_events_inserted instead
+            if (
+                not self._track_dirty
+                and self.event_list is not None
+                and len(self.event_list) == self._n_events
+            ):
+                self._changes.append(
+                    (
+                        libass.AssTrack.update_events,
+                        idx,
+                        [self.event_list[idx]],
+                    )
+                )
+
+    def _on_events_inserted(self, idx: int, count: int) -> None:
+        assert self.event_list is not None
+        self._end_change(
+            (
+                libass.AssTrack.insert_events,
+                idx,
+                self.event_list[idx : idx + count],
+            ),
+            count,
         )
-        self._renderer.frame_size = video_resolution
-        self._renderer.pixel_aspect = 1.0
+
+    def _on_events_removed(self, idx: int, count: int) -> None:
+        self._end_change((libass.AssTrack.remove_events, idx, count), -count)
+
+    def _on_events_moved(self, idx: int, count: int, new_idx: int) -> None:
+        self._end_change((libass.AssTrack.move_events, idx, count, new_idx))
 
     def render(
         self, time: int, aspect_ratio: T.Union[float, fractions.Fraction]
@@ -93,63 +367,28 @@ class AssRenderer:
         :param aspect_ratio: pixel aspect ratio to use
         :return: PIL image
         """
-        if self._track is None:
-            raise ValueError("need source to render")
-
-        if any(dim <= 0 for dim in self._renderer.frame_size):
-            raise ValueError("resolution needs to be a positive integer")
-
-        image_data = np.zeros(
-            (self._renderer.frame_size[1], self._renderer.frame_size[0], 4),
-            dtype=np.uint8,
-        )
+        with self._render_lock:
+            if self._track is None:
+                raise ValueError("need source to render")
 
-        for layer in self.render_raw(time):
-            red, green, blue, alpha = layer.rgba
+            if any(dim <= 0 for dim in self._renderer.frame_size):
+                raise ValueError("resolution needs to be a positive integer")
 
-            mask_data = np.lib.stride_tricks.as_strided(
-                np.frombuffer(
-                    (ctypes.c_uint8 * (layer.stride * layer.h)).from_address(
-                        ctypes.addressof(layer.bitmap.contents)
-                    ),
-                    dtype=np.uint8,
+            image_data = np.zeros(
+                (
+                    self._renderer.frame_size[1],
+                    self._renderer.frame_size[0],
+                    4,
                 ),
-                (layer.h, layer.w),
-                (layer.stride, 1),
-            )
-
-            overlay = np.zeros((layer.h, layer.w, 4), dtype=np.uint8)
-            overlay[..., :3] = (red, green, blue)
-            overlay[..., 3] = mask_data
-            overlay[..., 3] = (overlay[..., 3] * (1.0 - alpha / 255.0)).astype(
-                np.uint8
+                dtype=np.uint8,
             )
-
-            fragment = image_data[
-                layer.dst_y : layer.dst_y + layer.h,
-                layer.dst_x : layer.dst_x + layer.w,
-            ]
-
-            src_color = overlay[..., :3].astype(np.float32) / 255.0
-            src_alpha = overlay[..., 3].astype(np.float32) / 255.0
-            dst_color = fragment[..., :3].astype(np.float32) / 255.0
-            dst_alpha = fragment[..., 3].astype(np.float32) / 255.0
-
-            out_alpha = src_alpha + dst_alpha * (1.0 - src_alpha)
-            out_color = (
-                src_color * src_alpha[..., None]
-                + dst_color
-                * dst_alpha[..., None]
-                * (1.0 - src_alpha[..., None])
-            ) / out_alpha[..., None]
-
-            fragment[..., :3] = out_color * 255
-            fragment[..., 3] = out_alpha * 255
+            _composite(list(self._render_raw(time)), image_data)
 
         ret = PIL.Image.fromarray(image_data)
-        ret = ret.resize(
-            (int(ret.width * aspect_ratio), ret.height), PIL.Image.LANCZOS
-        )
+        width = int(ret.width * aspect_ratio)
+        if width == ret.width:
+            return ret
+        ret = ret.resize((width, ret.height), PIL.Image.LANCZOS)
         final = PIL.Image.new("RGBA", self._renderer.frame_size)
         final.paste(ret, ((self._renderer.frame_size[0] - ret.width) // 2, 0))
         return final
@@ -160,7 +399,11 @@ class AssRenderer:
         :param time: PTS to render at
         :return: numpy array with RGB data
         """
+        with self._render_lock:
+            return self._render_raw(time)
+
+    def _render_raw(self, time: int) -> libass.AssImageSequence:
         if self._track is None:
             raise ValueError("need source to render")
-
+        self._apply_changes()
         return self._renderer.render_frame(self._track, now=time)
@@ -43,6 +43,12 @@ def _encode_str(text: T.Optional[str]) -> T.Optional[bytes]:
     return None if text is None else text.encode("utf-8")
 
 
+def _alloc_str(text: T.Optional[str]) -> T.Optional[int]:
+    # libass frees the strings of the styles and events it releases, so they
+    # need to live in the C heap rather than in Python bytes objects
+    return None if text is None else _libc.strdup(_encode_str(text))
+
+
 def _color_to_int(color: T.Tuple[int, int, int, int]) -> int:
     red, green, blue, alpha = color
     return alpha | (blue << 8) | (green << 16) | (red << 24)
@@ -281,8 +287,8 @@ class AssStyle(ctypes.Structure):
         self._track = track
 
     def populate(self, style: bubblesub.fmt.ass.style.AssStyle) -> None:
-        self.name = _encode_str(style.name)
-        self.fontname = _encode_str(style.font_name)
+        self.name = _alloc_str(style.name)
+        self.fontname = _alloc_str(style.font_name)
         self.fontsize = style.font_size
         self.primary_color = _color_to_int(style.primary_color)
         self.secondary_color = _color_to_int(style.secondary_color)
@@ -333,15 +339,19 @@ class AssEvent(ctypes.Structure):
 
     def populate(self, event: bubblesub.fmt.ass.event.AssEvent) -> None:
         self.start_ms = int(event.start)
-        self.duration_ms = int(event.end - event.start)
+        # comments are kept so that the track events line up with the source
+        # event list, but they're never displayed
+        self.duration_ms = (
+            0 if event.is_comment else int(event.end - event.start)
+        )
         self.layer = event.layer
         self.style_id = self._style_name_to_style_id(event.style)
-        self.name = _encode_str(event.actor)
+        self.name = _alloc_str(event.actor)
         self.margin_l = event.margin_left
         self.margin_r = event.margin_right
         self.margin_v = event.margin_vertical
-        self.effect = _encode_str(event.effect)
-        self.text = _encode_str(event.text)
+        self.effect = _alloc_str(event.effect)
+        self.text = _alloc_str(event.text)
 
 
 class AssTrack(ctypes.Structure):
@@ -402,21 +412,97 @@ class AssTrack(ctypes.Structure):
         event._after_init(self)
         return event
 
+    def _get_event_address(self, idx: int) -> int:
+        base = ctypes.addressof(self.events_arr.contents)
+        return base + idx * ctypes.sizeof(AssEvent)
+
+    def _reset_events(self, idx: int, count: int) -> None:
+        for eid in range(idx, idx + count):
+            _libass.ass_free_event(ctypes.byref(self), eid)
+        ctypes.memset(
+            self._get_event_address(idx), 0, count * ctypes.sizeof(AssEvent)
+        )
+
+    def _populate_events(
+        self,
+        idx: int,
+        source_events: T.Iterable[bubblesub.fmt.ass.event.AssEvent],
+    ) -> None:
+        for eid, source_event in enumerate(source_events, idx):
+            event = self.events_arr[eid]
+            event._after_init(self)
+            event.populate(source_event)
+
+    def update_events(
+        self,
+        idx: int,
+        source_events: T.Sequence[bubblesub.fmt.ass.event.AssEvent],
+    ) -> None:
+        if not source_events:
+            return
+        self._reset_events(idx, len(source_events))
+        self._populate_events(idx, source_events)
+
+    def insert_events(
+        self,
+        idx: int,
+        source_events: T.Sequence[bubblesub.fmt.ass.event.AssEvent],
+    ) -> None:
+        count = len(source_events)
+        if not count:
+            return
+        for _ in range(count):
+            _libass.ass_alloc_event(ctypes.byref(self))
+        size = ctypes.sizeof(AssEvent)
+        ctypes.memmove(
+            self._get_event_address(idx + count),
+            self._get_event_address(idx),
+            (self.n_events - count - idx) * size,
+        )
+        ctypes.memset(self._get_event_address(idx), 0, count * size)
+        self._populate_events(idx, source_events)
+
+    def remove_events(self, idx: int, count: int) -> None:
+        if not count:
+            return
+        for eid in range(idx, idx + count):
+            _libass.ass_free_event(ctypes.byref(self), eid)
+        ctypes.memmove(
+            self._get_event_address(idx),
+            self._get_event_address(idx + count),
+            (self.n_events - count - idx) * ctypes.sizeof(AssEvent),
+        )
+        self.n_events -= count
+
+    def move_events(self, idx: int, count: int, new_idx: int) -> None:
+        if not count:
+            return
+        size = ctypes.sizeof(AssEvent)
+        moved = ctypes.create_string_buffer(count * size)
+        ctypes.memmove(moved, self._get_event_address(idx), count * size)
+        ctypes.memmove(
+            self._get_event_address(idx),
+            self._get_event_address(idx + count),
+            (self.n_events - count - idx) * size,
+        )
+        ctypes.memmove(
+            self._get_event_address(new_idx + count),
+            self._get_event_address(new_idx),
+            (self.n_events - count - new_idx) * size,
+        )
+        ctypes.memmove(self._get_event_address(new_idx), moved, count * size)
+
     def __del__(self) -> None:
-        # XXX: we can't use ass_free_track because it assumes we've allocated
-        #      our strings in the heap (wat), so we just free them with libc.
-        _libc.free(self.styles_arr)
-        _libc.free(self.events_arr)
-        _libc.free(ctypes.byref(self))
+        _libass.ass_free_track(ctypes.byref(self))
 
     def populate(
         self,
-        style_list: bubblesub.fmt.ass.style.AssStyleList,
-        event_list: bubblesub.fmt.ass.event.AssEventList,
+        style_list: T.Iterable[bubblesub.fmt.ass.style.AssStyle],
+        event_list: T.Iterable[bubblesub.fmt.ass.event.AssEvent],
     ) -> None:
         self.type = AssTrack.TYPE_ASS
 
-        self.style_format = _encode_str(
+        self.style_format = _alloc_str(
             "Name, Fontname, Fontsize, "
             "PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
             "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, "
@@ -424,7 +510,7 @@ class AssTrack(ctypes.Structure):
             "MarginL, MarginR, MarginV, Encoding"
         )
 
-        self.event_format = _encode_str(
+        self.event_format = _alloc_str(
             "Layer, Start, End, AssStyle, Name, "
             "MarginL, MarginR, MarginV, Effect, Text"
         )
@@ -434,13 +520,13 @@ class AssTrack(ctypes.Structure):
             style.populate(source_style)
 
         for source_event in event_list:
-            if source_event.is_comment:
-                continue
             event = self.make_event()
             event.populate(source_event)
 
 
 _libc.free.argtypes = [ctypes.c_void_p]
+_libc.strdup.argtypes = [ctypes.c_char_p]
+_libc.strdup.restype = ctypes.c_void_p
 _libass.ass_library_init.restype = ctypes.POINTER(AssContext)
 _libass.ass_library_done.argtypes = [ctypes.POINTER(AssContext)]
 _libass.ass_renderer_init.argtypes = [ctypes.POINTER(AssContext)]
@@ -448,6 +534,7 @@ _libass.ass_renderer_init.restype = ctypes.POINTER(AssRenderer)
 _libass.ass_renderer_done.argtypes = [ctypes.POINTER(AssRenderer)]
 _libass.ass_new_track.argtypes = [ctypes.POINTER(AssContext)]
 _libass.ass_new_track.restype = ctypes.POINTER(AssTrack)
+_libass.ass_free_track.argtypes = [ctypes.POINTER(AssTrack)]
 _libass.ass_set_style_overrides.argtypes = [
     ctypes.POINTER(AssContext),
     ctypes.POINTER(ctypes.c_char_p),
@@ -479,3 +566,4 @@ _libass.ass_alloc_style.argtypes = [ctypes.POINTER(AssTrack)]
 _libass.ass_alloc_style.restype = ctypes.c_int
 _libass.ass_alloc_event.argtypes = [ctypes.POINTER(AssTrack)]
 _libass.ass_alloc_event.restype = ctypes.c_int
+_libass.ass_free_event.argtypes = [ctypes.POINTER(AssTrack), ctypes.c_int]
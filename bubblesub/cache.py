@@ -16,13 +16,16 @@
 
 """Caching utilities."""
 
+import hashlib
 import pickle
+import shutil
 import typing as T
 from pathlib import Path
 
 from bubblesub.data import USER_CACHE_DIR
 
 CACHE_SUFFIX = ".dat"
+FINGERPRINT_BLOCK_SIZE = 1024 * 1024
 
 
 def get_cache_dir() -> Path:
@@ -33,13 +36,35 @@ def get_cache_dir() -> Path:
     return USER_CACHE_DIR / "bubblesub"
 
 
-def get_cache_file_path(cache_name: str) -> Path:
+def get_cache_file_path(cache_name: str, suffix: str = CACHE_SUFFIX) -> Path:
     """Translate cache file name into full path.
 
     :param cache_name: name of cache file
+    :param suffix: cache file extension
     :return: full cache file path
     """
-    return get_cache_dir() / (cache_name + CACHE_SUFFIX)
+    return get_cache_dir() / (cache_name + suffix)
+
+
+def get_file_fingerprint(path: Path) -> str:
+    """Compute a content fingerprint of given file.
+
+    Only the file size and its leading and trailing blocks are hashed, so that
+    fingerprinting multi-gigabyte media files stays cheap.
+
+    :param path: path to the file to fingerprint
+    :return: hex digest identifying the file contents
+    """
+    size = path.stat().st_size
+    digest = hashlib.sha1(str(size).encode())
+    with path.open(mode="rb") as handle:
+        digest.update(handle.read(FINGERPRINT_BLOCK_SIZE))
+        if size > FINGERPRINT_BLOCK_SIZE:
+            handle.seek(
+                max(FINGERPRINT_BLOCK_SIZE, size - FINGERPRINT_BLOCK_SIZE)
+            )
+            digest.update(handle.read(FINGERPRINT_BLOCK_SIZE))
+    return digest.hexdigest()
 
 
 def load_cache(cache_name: str) -> T.Any:
@@ -72,6 +97,11 @@ def save_cache(cache_name: str, data: T.Any) -> None:
 
 def wipe_cache() -> None:
     """Delete disk cache."""
-    for path in get_cache_dir().iterdir():
-        if path.suffix == CACHE_SUFFIX:
+    cache_dir = get_cache_dir()
+    if not cache_dir.exists():
+        return
+    for path in cache_dir.iterdir():
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
             path.unlink()
@@ -0,0 +1,47 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+
+from bubblesub.api import Api
+from bubblesub.api.cmd import BaseCommand
+from bubblesub.ui.audio.audio_preview import AudioPreviewMode
+from bubblesub.ui.views import TargetWidget
+
+
+class AudioSetPreviewModeCommand(BaseCommand):
+    names = ["audio-set-preview-mode", "spectrogram-set-preview-mode"]
+    help_text = "Switches the audio preview between spectrogram and waveform."
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.api.gui.is_widget_visible(TargetWidget.Spectrogram.value)
+
+    async def run(self) -> None:
+        self.api.cfg.opt["audio"]["preview_mode"] = self.args.mode.value
+        self.api.cfg.opt.changed.emit()
+
+    @staticmethod
+    def decorate_parser(api: Api, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "mode",
+            help="how to visualize the audio",
+            type=AudioPreviewMode,
+            choices=list(AudioPreviewMode),
+        )
+
+
+COMMANDS = [AudioSetPreviewModeCommand]
@@ -16,10 +16,10 @@
 
 """Presentation timestamp, usable as an argument to commands."""
 
-import bisect
 import enum
 import typing as T
 
+import numpy as np
 import parsimonious
 from dataclasses import dataclass
 
@@ -38,7 +38,10 @@ right_hand = binary_operation / operand
 unary_operation = operator _ right_hand
 binary_operation = operand _ operator _ right_hand
 
+# scene and rel_scene must come before time and rel_subtitle respectively,
+# otherwise "1sc" and "nsc" would be read as seconds and subtitles
 operand =
+    scene /
     time /
     frame /
     keyframe /
@@ -47,6 +50,7 @@ operand =
     audio_view /
     rel_frame /
     rel_keyframe /
+    rel_scene /
     rel_subtitle /
     min / max /
     dialog /
@@ -59,11 +63,13 @@ minutes          = decimal _ 'm' (_ decimal _ 's')?
 colon_time       = ~'((?P<h>\\d?\\d):)?(?P<m>\\d?\\d):(?P<s>\\d\\d)(\\.(?P<ms>\\d+))?'
 frame            = integer _ 'f'
 keyframe         = integer _ 'kf'
+scene            = integer _ 'sc'
 subtitle         = 's' integer (start / end)
 audio_selection  = 'a' (start / end)
 audio_view       = 'av' (start / end)
 rel_frame        = rel 'f'
 rel_keyframe     = rel 'kf'
+rel_scene        = rel 'sc'
 rel_subtitle     = rel 's' (start / end)
 default_duration = 'dsd' / 'default_duration'
 min              = 'min'
@@ -161,6 +167,7 @@ class _TimeUnit(enum.IntEnum):
     ms = 0
     frame = 1
     keyframe = 2
+    scene = 3
 
 
 @dataclass
@@ -210,6 +217,10 @@ class _Time:
             return _Time(
                 _apply_keyframe(api, time1.unpack(api), func(0, time2.value))
             )
+        if time2.unit == _TimeUnit.scene:
+            return _Time(
+                _apply_scene(api, time1.unpack(api), func(0, time2.value))
+            )
         raise NotImplementedError(f"unknown time unit: {time2.unit}")
 
     def unpack(self, api: Api) -> int:
@@ -220,15 +231,20 @@ class _Time:
         """
         current_stream = api.video.current_stream
         if self.unit == _TimeUnit.frame:
-            if not current_stream or not current_stream.timecodes:
+            if not current_stream or not len(current_stream.timecodes):
                 raise CommandError("timecode information is not available")
             idx = max(1, min(self.value, len(current_stream.timecodes))) - 1
-            return current_stream.timecodes[idx]
+            return int(current_stream.timecodes[idx])
         if self.unit == _TimeUnit.keyframe:
-            if not current_stream or not current_stream.timecodes:
+            if not current_stream or not len(current_stream.timecodes):
                 raise CommandError("keyframe information is not available")
-            idx = max(1, min(self.value, len(current_stream.keyframes))) - 1
-            return current_stream.timecodes[current_stream.keyframes[idx]]
+            keyframe_timecodes = current_stream.keyframe_timecodes
+            idx = max(1, min(self.value, len(keyframe_timecodes))) - 1
+            return int(keyframe_timecodes[idx])
+        if self.unit == _TimeUnit.scene:
+            cut_pts = _get_scene_cut_pts(api)
+            idx = max(1, min(self.value, len(cut_pts))) - 1
+            return int(cut_pts[idx])
         if self.unit == _TimeUnit.ms:
             return self.value
         raise NotImplementedError(f"unknown unit: {self.unit}")
@@ -245,34 +261,49 @@ def _flatten(items: T.Any) -> T.List[T.Any]:
     return [items]
 
 
-def _bisect(source: T.List[int], origin: int, delta: int) -> int:
+def _bisect(source: np.array, origin: int, delta: int) -> int:
     if delta >= 0:
         # find leftmost value greater than origin
-        idx = bisect.bisect_right(source, origin)
+        idx = int(np.searchsorted(source, origin, "right"))
         idx += delta - 1
     elif delta < 0:
         # find rightmost value less than origin
-        idx = bisect.bisect_left(source, origin)
+        idx = int(np.searchsorted(source, origin, "left"))
         idx += delta
 
     idx = max(0, min(idx, len(source) - 1))
-    return source[idx]
+    return int(source[idx])
 
 
 def _apply_frame(api: Api, origin: int, delta: int) -> int:
-    if not api.video.current_stream or not api.video.current_stream.timecodes:
+    if not api.video.current_stream or not len(
+        api.video.current_stream.timecodes
+    ):
         raise CommandError("timecode information is not available")
     return _bisect(api.video.current_stream.timecodes, origin, delta)
 
 
 def _apply_keyframe(api: Api, origin: int, delta: int) -> int:
-    if not api.video.current_stream or not api.video.current_stream.keyframes:
+    if not api.video.current_stream or not len(
+        api.video.current_stream.keyframes
+    ):
         raise CommandError("keyframe information is not available")
-    possible_pts = [
-        api.video.current_stream.timecodes[i]
-        for i in api.video.current_stream.keyframes
-    ]
-    return _bisect(possible_pts, origin, delta)
+    return _bisect(api.video.current_stream.keyframe_timecodes, origin, delta)
+
+
+def _get_scene_cut_pts(api: Api) -> np.array:
+    current_stream = api.video.current_stream
+    if (
+        not current_stream
+        or not current_stream.scene_index
+        or not len(current_stream.scene_index.cuts)
+    ):
+        raise CommandError("scene change information is not available")
+    return current_stream.scene_index.cut_pts
+
+
+def _apply_scene(api: Api, origin: int, delta: int) -> int:
+    return _bisect(_get_scene_cut_pts(api), origin, delta)
 
 
 class _PtsNodeVisitor(_AsyncNodeVisitor):
@@ -395,6 +426,10 @@ class _PtsNodeVisitor(_AsyncNodeVisitor):
         num, _ = _flatten(visited)
         return _Time(num, _TimeUnit.keyframe)
 
+    async def visit_scene(self, node: T.Any, visited: T.List[T.Any]) -> T.Any:
+        num, _ = _flatten(visited)
+        return _Time(num, _TimeUnit.scene)
+
     async def visit_rel_subtitle(
         self, node: T.Any, visited: T.List[T.Any]
     ) -> T.Any:
@@ -443,6 +478,18 @@ class _PtsNodeVisitor(_AsyncNodeVisitor):
         delta = _Token.delta_from_direction(direction)
         return _Time(_apply_keyframe(self._api, origin, delta))
 
+    async def visit_rel_scene(
+        self, node: T.Any, visited: T.List[T.Any]
+    ) -> T.Any:
+        direction, _ = _flatten(visited)
+        origin = self._api.playback.current_pts
+        if direction == _Token.first:
+            return _Time(1, _TimeUnit.scene)
+        if direction == _Token.last:
+            return _Time(len(_get_scene_cut_pts(self._api)), _TimeUnit.scene)
+        delta = _Token.delta_from_direction(direction)
+        return _Time(_apply_scene(self._api, origin, delta))
+
     async def visit_audio_selection(
         self, node: T.Any, visited: T.List[T.Any]
     ) -> T.Any:
@@ -51,8 +51,16 @@ class SaveAudioSampleCommand(BaseCommand):
             ),
         )
 
-        self.api.audio.current_stream.save_wav(path, start, end)
-        self.api.log.info(f"saved audio sample to {path}")
+        stream = self.api.audio.current_stream
+        if await self.api.gui.run_with_progress(
+            "Saving audio sample...",
+            lambda progress_callback: stream.save_wav(
+                path, start, end, progress_callback
+            ),
+        ):
+            self.api.log.info(f"saved audio sample to {path}")
+        else:
+            self.api.log.warn("saving audio sample canceled")
 
     @staticmethod
     def decorate_parser(api: Api, parser: argparse.ArgumentParser) -> None:
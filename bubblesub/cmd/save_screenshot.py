@@ -17,9 +17,9 @@
 import argparse
 
 from bubblesub.api import Api
-from bubblesub.api.cmd import BaseCommand
-from bubblesub.cmd.common import FancyPath, Pts
-from bubblesub.util import ms_to_str
+from bubblesub.api.cmd import BaseCommand, CommandUnavailable
+from bubblesub.cmd.common import FancyPath, Pts, SubtitlesSelection
+from bubblesub.util import ms_to_str, sanitize_file_name
 
 
 class SaveScreenshotCommand(BaseCommand):
@@ -96,4 +96,123 @@ class SaveScreenshotCommand(BaseCommand):
         )
 
 
-COMMANDS = [SaveScreenshotCommand]
+class SaveScreenshotsCommand(BaseCommand):
+    names = ["save-screenshots"]
+    help_text = "Makes screenshots of many video frames at once."
+    help_text_extra = (
+        "Prompts user to choose where to save the files to if the path wasn't "
+        "specified in the command arguments. "
+        "Each file name is suffixed with the time of its frame."
+    )
+
+    @property
+    def is_enabled(self) -> bool:
+        return (
+            self.api.video.current_stream
+            and self.api.video.current_stream.is_ready
+            and (self.args.pts or self.args.target.makes_sense)
+        )
+
+    async def run(self) -> None:
+        assert self.api.video.current_stream.path
+
+        stream = self.api.video.current_stream
+        if self.args.pts:
+            all_pts = [await pts.get() for pts in self.args.pts]
+        else:
+            all_pts = [
+                sub.start for sub in await self.args.target.get_subtitles()
+            ]
+        # the files are named after the frames, so that times landing on the
+        # same frame don't produce duplicate screenshots
+        all_pts = sorted(
+            {stream.align_pts_to_prev_frame(pts) for pts in all_pts}
+        )
+        if not all_pts:
+            raise CommandUnavailable("nothing to save")
+
+        path = await self.args.path.get_save_path(
+            file_filter=(
+                "Portable Network Graphics (*.png);;JPEG (*.jpg *.jpeg)"
+            ),
+            default_file_name="shot-{}.png".format(stream.path.name),
+        )
+
+        items = [
+            (
+                pts,
+                path.with_name(
+                    sanitize_file_name(
+                        f"{path.stem}-{ms_to_str(pts)}{path.suffix}"
+                    )
+                ),
+            )
+            for pts in all_pts
+        ]
+        count = await self.api.gui.run_with_progress(
+            "Saving screenshots...",
+            lambda progress_callback: stream.save_screenshots(
+                items,
+                self.args.include_subs,
+                self.args.width,
+                self.args.height,
+                progress_callback,
+            ),
+        )
+        if count < len(items):
+            self.api.log.warn(
+                f"saving screenshots canceled after {count} of {len(items)}"
+            )
+        self.api.log.info(f"saved {count} screenshots to {path.parent}")
+
+    @staticmethod
+    def decorate_parser(api: Api, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "-t",
+            "--target",
+            help="subtitles whose starts to make screenshots of",
+            type=lambda value: SubtitlesSelection(api, value),
+            default="selected",
+        )
+        parser.add_argument(
+            "--pts",
+            help="which frames to make screenshots of (overrides --target)",
+            type=lambda value: Pts(api, value),
+            nargs="*",
+        )
+        parser.add_argument(
+            "-p",
+            "--path",
+            help=(
+                "base path to save the screenshots to; "
+                "its extension determines the image format"
+            ),
+            type=lambda value: FancyPath(api, value),
+            default="",
+        )
+        parser.add_argument(
+            "-i",
+            "--include-subs",
+            help='whether to "burn" the subtitles into the screenshots',
+            action="store_true",
+        )
+        parser.add_argument(
+            "--width",
+            help="width of the screenshots (by default, original video width)",
+            type=int,
+        )
+        parser.add_argument(
+            "--height",
+            help=(
+                "height of the screenshots "
+                "(by default, original video height)"
+            ),
+            type=int,
+        )
+        parser.epilog = (
+            "If only either of width or height is given, "
+            "the command tries to maintain aspect ratio."
+        )
+
+
+COMMANDS = [SaveScreenshotCommand, SaveScreenshotsCommand]
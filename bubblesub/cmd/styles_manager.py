@@ -57,6 +57,18 @@ class _StylePreview(QtWidgets.QGroupBox):
 
         self._renderer = AssRenderer()
 
+        # the renderer keeps its track for as long as these don't change, so
+        # they're updated in place rather than recreated on every keystroke
+        self._fake_style = AssStyle(name="Default")
+        self._fake_style_list = AssStyleList()
+        self._fake_style_list.append(self._fake_style)
+        self._fake_event = AssEvent(
+            start=0, end=1000, style=self._fake_style.name
+        )
+        self._fake_event_list = AssEventList()
+        self._fake_event_list.append(self._fake_event)
+        self._fake_meta = AssMeta()
+
         self._editor = QtWidgets.QPlainTextEdit()
         self._editor.setPlainText(api.cfg.opt["styles"]["preview_test_text"])
         self._editor.setFixedWidth(400)
@@ -129,7 +141,6 @@ class _StylePreview(QtWidgets.QGroupBox):
             return
 
         fake_style = copy(selected_style)
-        fake_style.name = "Default"
         if (
             self._api.video.current_stream
             and self._api.video.current_stream.is_ready
@@ -137,19 +148,13 @@ class _StylePreview(QtWidgets.QGroupBox):
             fake_style.scale(
                 resolution[1] / self._api.video.current_stream.height
             )
-        fake_style_list = AssStyleList()
-        fake_style_list.append(fake_style)
-
-        fake_event = AssEvent(
-            start=0,
-            end=1000,
-            text=self.preview_text.replace("\n", "\\N"),
-            style=fake_style.name,
-        )
-        fake_event_list = AssEventList()
-        fake_event_list.append(fake_event)
+        self._fake_style.begin_update()
+        for key, value in fake_style.__dict__.items():
+            if not key.startswith("_") and key != "style_list":
+                setattr(self._fake_style, key, value)
+        self._fake_style.end_update()
 
-        fake_meta = AssMeta()
+        self._fake_event.text = self.preview_text.replace("\n", "\\N")
 
         image = PIL.Image.new(mode="RGBA", size=resolution)
 
@@ -161,7 +166,10 @@ class _StylePreview(QtWidgets.QGroupBox):
                     image.paste(background, (x, y))
 
         self._renderer.set_source(
-            fake_style_list, fake_event_list, fake_meta, resolution
+            self._fake_style_list,
+            self._fake_event_list,
+            self._fake_meta,
+            resolution,
         )
         subs_image = self._renderer.render(
             time=0,
@@ -177,6 +185,9 @@ class _StylePreview(QtWidgets.QGroupBox):
         image = QtGui.QImage(image)
         self._preview_box.setPixmap(QtGui.QPixmap.fromImage(image))
 
+    def shutdown(self) -> None:
+        self._renderer.close()
+
 
 class _StyleList(QtWidgets.QWidget):
     def __init__(
@@ -699,6 +710,10 @@ class _StylesManagerDialog(Dialog):
 
         self._sync_preview_text()
 
+    def done(self, code: int) -> None:
+        self._preview_box.shutdown()
+        super().done(code)
+
     def resizeEvent(self, event: QtGui.QResizeEvent) -> None:
         self._preview_box.update_preview()
 
@@ -17,11 +17,12 @@
 import argparse
 import typing as T
 
+import numpy as np
 from PyQt5 import QtWidgets
 
 from bubblesub.api import Api
 from bubblesub.api.cmd import BaseCommand, CommandCanceled, CommandUnavailable
-from bubblesub.cmd.common import Pts, SubtitlesSelection
+from bubblesub.cmd.common import SubtitlesSelection
 from bubblesub.fmt.ass.event import AssEvent
 from bubblesub.ui.util import time_jump_dialog
 
@@ -45,21 +46,23 @@ class SubtitlesShiftCommand(BaseCommand):
 
         delta = await self._get_delta(subs, main_window)
 
+        starts = np.array([sub.start for sub in subs], dtype=np.int64) + delta
+        ends = np.array([sub.end for sub in subs], dtype=np.int64) + delta
+        video_stream = self.api.video.current_stream
+        if video_stream and not self.args.no_align:
+            starts = video_stream.align_pts_to_near_frame(starts)
+            ends = video_stream.align_pts_to_near_frame(ends)
+
         with self.api.undo.capture():
-            for sub in subs:
+            for sub, start, end in zip(subs, starts.tolist(), ends.tolist()):
                 sub.begin_update()
-                sub.start = await delta.get(
-                    origin=sub.start,
-                    align_to_near_frame=not self.args.no_align,
-                )
-                sub.end = await delta.get(
-                    origin=sub.end, align_to_near_frame=not self.args.no_align
-                )
+                sub.start = start
+                sub.end = end
                 sub.end_update()
 
     async def _get_delta(
         self, subs: T.List[AssEvent], main_window: QtWidgets.QMainWindow
-    ) -> Pts:
+    ) -> int:
         ret = await time_jump_dialog(
             main_window,
             absolute_label="Time to move to:",
@@ -73,7 +76,7 @@ class SubtitlesShiftCommand(BaseCommand):
         if not is_relative and subs:
             delta -= subs[0].start
 
-        return Pts(self.api, f"{delta:+d}ms")
+        return delta
 
     @staticmethod
     def decorate_parser(api: Api, parser: argparse.ArgumentParser) -> None:
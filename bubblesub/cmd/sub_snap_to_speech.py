@@ -0,0 +1,117 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+
+import numpy as np
+
+from bubblesub.api import Api
+from bubblesub.api.cmd import BaseCommand, CommandUnavailable
+from bubblesub.cmd.common import SubtitlesSelection
+
+
+class SubtitlesSnapToSpeechCommand(BaseCommand):
+    names = ["sub-snap-to-speech"]
+    help_text = (
+        "Snaps given subtitles starts and ends to the nearest speech onsets "
+        "and offsets."
+    )
+    help_text_extra = (
+        "Uses the speech index of the audio instead of decoding it. The "
+        "index is built in the background the first time the command is "
+        "used, or once the audio is loaded if the audio.speech_index option "
+        "is on, and is cached afterwards. Boundaries further away than the "
+        "maximum distance are left intact."
+    )
+
+    @property
+    def is_enabled(self) -> bool:
+        return (
+            self.args.target.makes_sense
+            and self.api.audio.current_stream
+            and self.api.audio.current_stream.is_ready
+        )
+
+    async def run(self) -> None:
+        subs = await self.args.target.get_subtitles()
+        if not subs:
+            raise CommandUnavailable("nothing to update")
+
+        stream = self.api.audio.current_stream
+        speech_index = stream.speech_index
+        if speech_index is None:
+            stream.request_speech_index()
+            raise CommandUnavailable(
+                "building speech index, try again once it's ready"
+            )
+
+        starts = np.array([sub.start for sub in subs]) - stream.delay
+        ends = np.array([sub.end for sub in subs]) - stream.delay
+        if not self.args.no_start:
+            starts = speech_index.snap_starts(starts, self.args.max_distance)
+        if not self.args.no_end:
+            ends = speech_index.snap_ends(ends, self.args.max_distance)
+        starts += stream.delay
+        ends += stream.delay
+
+        video_stream = self.api.video.current_stream
+        if video_stream and not self.args.no_align:
+            starts = video_stream.align_pts_to_near_frame(starts)
+            ends = video_stream.align_pts_to_near_frame(ends)
+
+        with self.api.undo.capture():
+            for sub, start, end in zip(subs, starts.tolist(), ends.tolist()):
+                if end < start or (start, end) == (sub.start, sub.end):
+                    continue
+                sub.begin_update()
+                sub.start = start
+                sub.end = end
+                sub.end_update()
+
+    @staticmethod
+    def decorate_parser(api: Api, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "-t",
+            "--target",
+            help="subtitles to snap",
+            type=lambda value: SubtitlesSelection(api, value),
+            default="selected",
+        )
+        parser.add_argument(
+            "-d",
+            "--max-distance",
+            help="how far to look for speech boundaries (in milliseconds)",
+            type=int,
+            default=500,
+        )
+        parser.add_argument(
+            "--no-start",
+            help="don't snap subtitles starts",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--no-end",
+            help="don't snap subtitles ends",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--no-align",
+            help="don't realign subtitles to video frames",
+            action="store_true",
+        )
+
+
+COMMANDS = [SubtitlesSnapToSpeechCommand]
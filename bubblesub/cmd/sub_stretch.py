@@ -16,6 +16,8 @@
 
 import argparse
 
+import numpy as np
+
 from bubblesub.api import Api
 from bubblesub.api.cmd import BaseCommand, CommandUnavailable
 from bubblesub.cmd.common import Pts, SubtitlesSelection
@@ -46,26 +48,33 @@ class SubtitlesStretchCommand(BaseCommand):
         # than by dialogue end
         old_start = subs[0].start
         old_end = subs[-1].start
+        if old_start == old_end:
+            raise CommandUnavailable("subtitles must start at different times")
 
         self.api.log.info(str(old_start))
         self.api.log.info(str(old_end))
 
-        def adjust(pts: int) -> int:
-            pts = int(
+        def adjust(pts: np.array) -> np.array:
+            pts = (
                 start
                 + (pts - old_start) * (end - start) / (old_end - old_start)
-            )
+            ).astype(np.int64)
             if not self.args.no_align and self.api.video.current_stream:
                 pts = self.api.video.current_stream.align_pts_to_near_frame(
                     pts
                 )
             return pts
 
+        starts = adjust(np.array([sub.start for sub in subs], dtype=np.int64))
+        ends = adjust(np.array([sub.end for sub in subs], dtype=np.int64))
+
         with self.api.undo.capture():
-            for sub in subs:
+            for sub, new_start, new_end in zip(
+                subs, starts.tolist(), ends.tolist()
+            ):
                 sub.begin_update()
-                sub.start = adjust(sub.start)
-                sub.end = adjust(sub.end)
+                sub.start = new_start
+                sub.end = new_end
                 sub.end_update()
 
     @staticmethod
@@ -66,69 +66,136 @@ def write_wav(handle: T.IO[bytes], rate: int, data: np.array) -> None:
     :param rate: the sample rate in samples/sec
     :param data: a 1D or 2D numpy array of either integer or float data-type
     """
-    dkind = data.dtype.kind
-
-    if not (
-        dkind == "i"
-        or dkind == "f"
-        or (dkind == "u" and data.dtype.itemsize == 1)
-    ):
-        raise ValueError(f"unsupported data type {data.dtype!r}")
-
-    header_data = b"RIFF"
-    header_data += b"\x00\x00\x00\x00"
-    header_data += b"WAVE"
-
-    # fmt chunk
-    header_data += b"fmt "
-    if dkind == "f":
-        format_tag = WAVE_FORMAT_IEEE_FLOAT
-    else:
-        format_tag = WAVE_FORMAT_PCM
-    if data.ndim == 1:
-        channels = 1
-    else:
-        channels = data.shape[1]
-
-    bit_depth = data.dtype.itemsize * 8
-    bytes_per_second = rate * (bit_depth // 8) * channels
-    block_align = channels * (bit_depth // 8)
-
-    fmt_chunk_data = struct.pack(
-        "<HHIIHH",
-        format_tag,
-        channels,
-        rate,
-        bytes_per_second,
-        block_align,
-        bit_depth,
+    writer = WavWriter(
+        handle, rate, data.dtype, 1 if data.ndim == 1 else data.shape[1]
     )
-    if dkind not in "iu":
-        # add cbSize field for non-PCM files
-        fmt_chunk_data += b"\x00\x00"
-
-    header_data += struct.pack("<I", len(fmt_chunk_data))
-    header_data += fmt_chunk_data
-
-    # fact chunk (non-PCM files)
-    if dkind not in "iu":
-        header_data += b"fact"
-        header_data += struct.pack("<II", 4, data.shape[0])
-
-    # check data size (needs to be immediately before the data chunk)
-    if ((len(header_data) - 4 - 4) + (4 + 4 + data.nbytes)) > 0xFFFFFFFF:
-        raise ValueError("data exceeds wave file size limit")
-
-    handle.write(header_data)
-    handle.write(b"data")
-    handle.write(struct.pack("<I", data.nbytes))
-    if data.dtype.byteorder == ">" or (
-        data.dtype.byteorder == "=" and sys.byteorder == "big"
-    ):
-        data = data.byteswap()
-    handle.write(data.ravel().view("b").data)
-
-    # Determine file size and place it at start of the file.
-    size = handle.tell()
-    handle.seek(4)
-    handle.write(struct.pack("<I", size - 8))
+    writer.write(data)
+    writer.finish()
+
+
+class WavWriter:
+    """Writer of uncompressed WAV files that receives samples in chunks.
+
+    Only one chunk needs to be kept in memory at a time: the header is
+    written with placeholder sizes which are filled in by finish(), so the
+    handle needs to be seekable.
+    """
+
+    def __init__(
+        self, handle: T.IO[bytes], rate: int, dtype: np.dtype, channels: int
+    ) -> None:
+        """Initialize self and write the WAV header.
+
+        :param handle: handle to write the file to
+        :param rate: the sample rate in samples/sec
+        :param dtype: data-type of the samples; determines the bits-per-sample
+            and PCM/float format
+        :param channels: number of channels
+        """
+        dtype = np.dtype(dtype)
+        dkind = dtype.kind
+
+        if not (
+            dkind == "i"
+            or dkind == "f"
+            or (dkind == "u" and dtype.itemsize == 1)
+        ):
+            raise ValueError(f"unsupported data type {dtype!r}")
+
+        header_data = b"RIFF"
+        header_data += b"\x00\x00\x00\x00"
+        header_data += b"WAVE"
+
+        # fmt chunk
+        header_data += b"fmt "
+        if dkind == "f":
+            format_tag = WAVE_FORMAT_IEEE_FLOAT
+        else:
+            format_tag = WAVE_FORMAT_PCM
+
+        bit_depth = dtype.itemsize * 8
+        bytes_per_second = rate * (bit_depth // 8) * channels
+        block_align = channels * (bit_depth // 8)
+
+        fmt_chunk_data = struct.pack(
+            "<HHIIHH",
+            format_tag,
+            channels,
+            rate,
+            bytes_per_second,
+            block_align,
+            bit_depth,
+        )
+        if dkind not in "iu":
+            # add cbSize field for non-PCM files
+            fmt_chunk_data += b"\x00\x00"
+
+        header_data += struct.pack("<I", len(fmt_chunk_data))
+        header_data += fmt_chunk_data
+
+        # fact chunk (non-PCM files)
+        self._fact_offset: T.Optional[int] = None
+        if dkind not in "iu":
+            header_data += b"fact"
+            header_data += struct.pack("<I", 4)
+            self._fact_offset = len(header_data)
+            header_data += b"\x00\x00\x00\x00"
+
+        # data chunk (needs to be immediately after the header)
+        header_data += b"data"
+        self._data_size_offset = len(header_data)
+        header_data += b"\x00\x00\x00\x00"
+
+        self._handle = handle
+        self._start = handle.tell()
+        self._header_size = len(header_data)
+        self._dtype = dtype
+        self._channels = channels
+        self._data_size = 0
+        self._byteswap = dtype.byteorder == ">" or (
+            dtype.byteorder == "=" and sys.byteorder == "big"
+        )
+        handle.write(header_data)
+
+    @property
+    def frame_count(self) -> int:
+        """Return number of frames written so far.
+
+        :return: number of frames
+        """
+        return self._data_size // max(1, self._dtype.itemsize * self._channels)
+
+    def write(self, data: np.array) -> None:
+        """Append samples to the file.
+
+        :param data: a 1D or 2D (Nsamples, Nchannels) numpy array of the
+            data-type and channel count the writer was created with
+        """
+        if data.dtype != self._dtype:
+            raise ValueError(f"unexpected data type {data.dtype!r}")
+        if (data.shape[1] if data.ndim > 1 else 1) != self._channels:
+            raise ValueError("unexpected number of channels")
+
+        # check data size
+        if (
+            (self._header_size - 4 - 4) + self._data_size + data.nbytes
+        ) > 0xFFFFFFFF:
+            raise ValueError("data exceeds wave file size limit")
+
+        if self._byteswap:
+            data = data.byteswap()
+        self._handle.write(np.ascontiguousarray(data).ravel().view("b").data)
+        self._data_size += data.nbytes
+
+    def finish(self) -> None:
+        """Fill in the sizes in the header."""
+        # Determine file size and place it at start of the file.
+        end = self._handle.tell()
+        self._handle.seek(self._start + 4)
+        self._handle.write(struct.pack("<I", end - self._start - 8))
+        if self._fact_offset is not None:
+            self._handle.seek(self._start + self._fact_offset)
+            self._handle.write(struct.pack("<I", self.frame_count))
+        self._handle.seek(self._start + self._data_size_offset)
+        self._handle.write(struct.pack("<I", self._data_size))
+        self._handle.seek(end)
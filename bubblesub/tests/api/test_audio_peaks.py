@@ -0,0 +1,106 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tests for bubblesub.api.audio_peaks module."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from bubblesub.api.audio_peaks import (
+    PEAK_BLOCK_SIZE,
+    PEAK_LEVEL_FACTOR,
+    PEAK_MAX,
+    PEAK_MIN,
+    PEAK_RMS,
+    AudioPeaks,
+)
+
+
+def _get_samples() -> np.array:
+    """Generate a deterministic signal that spans several pyramid levels.
+
+    :return: 1D float32 array of samples
+    """
+    return (
+        np.random.default_rng(0)
+        .uniform(-1, 1, PEAK_BLOCK_SIZE * PEAK_LEVEL_FACTOR ** 3 + 123)
+        .astype(np.float32)
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [100, PEAK_BLOCK_SIZE, 1 << 20])
+def test_compute_is_independent_of_chunking(chunk_size: int) -> None:
+    """Test that the finest level summarizes each block of samples.
+
+    :param chunk_size: size of chunks the samples are fed in
+    """
+    samples = _get_samples()
+    peaks = AudioPeaks.compute(
+        samples[i : i + chunk_size] for i in range(0, len(samples), chunk_size)
+    )
+    level = peaks.levels[0]
+    assert len(level) == -(-len(samples) // PEAK_BLOCK_SIZE)
+    for i in (0, 1, len(level) - 1):
+        block = samples[i * PEAK_BLOCK_SIZE : (i + 1) * PEAK_BLOCK_SIZE]
+        assert level[i, PEAK_MIN] == block.min()
+        assert level[i, PEAK_MAX] == block.max()
+        assert level[i, PEAK_RMS] == pytest.approx(
+            np.sqrt(np.mean(block.astype(np.float64) ** 2))
+        )
+    assert len(peaks.levels[-1]) == 1
+
+
+@pytest.mark.parametrize("count", [1, 7, 100, 5000])
+def test_get(count: int) -> None:
+    """Test that slices summarize the samples they span at any zoom.
+
+    :param count: number of slices
+    """
+    samples = _get_samples()
+    peaks = AudioPeaks.compute([samples])
+    values = peaks.get(0, len(samples), count)
+    assert values.shape == (count, 3)
+    assert values[:, PEAK_MIN].min() == samples.min()
+    assert values[:, PEAK_MAX].max() == samples.max()
+    assert np.all(values[:, PEAK_MIN] <= values[:, PEAK_MAX])
+
+
+def test_get_outside_of_audio() -> None:
+    """Test that slices outside of the audio are empty."""
+    peaks = AudioPeaks.compute([_get_samples()])
+    values = peaks.get(-PEAK_BLOCK_SIZE * 10, 0, 10)
+    assert not np.any(values)
+
+
+def test_save_and_load(tmp_path: Path) -> None:
+    """Test that the pyramid survives a round trip through a file.
+
+    :param tmp_path: temporary directory
+    """
+    peaks = AudioPeaks.compute([_get_samples()])
+    path = tmp_path / "peaks.npz"
+    with path.open("wb") as handle:
+        peaks.save(handle)
+    loaded = AudioPeaks.load(path)
+    assert loaded is not None
+    assert len(loaded.levels) == len(peaks.levels)
+    for level1, level2 in zip(loaded.levels, peaks.levels):
+        assert np.array_equal(level1, level2)
+
+    path.write_bytes(b"garbage")
+    assert AudioPeaks.load(path) is None
@@ -0,0 +1,134 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tests for bubblesub.api.audio_speech module."""
+
+import typing as T
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from bubblesub.api.audio_speech import SPEECH_FRAME_DURATION, SpeechIndex
+
+SAMPLE_RATE = 8000
+
+
+def _get_samples(
+    speech_ranges: T.List[T.Tuple[int, int]], duration: int
+) -> np.array:
+    """Generate quiet noise with loud noise in given ranges.
+
+    :param speech_ranges: ranges of loud noise in milliseconds
+    :param duration: total duration in milliseconds
+    :return: 1D float32 array of samples
+    """
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 0.001, duration * SAMPLE_RATE // 1000)
+    for start, end in speech_ranges:
+        start = start * SAMPLE_RATE // 1000
+        end = end * SAMPLE_RATE // 1000
+        samples[start:end] += rng.normal(0, 0.3, end - start)
+    return samples.astype(np.float32)
+
+
+def _create_index(
+    speech_ranges: T.List[T.Tuple[int, int]], duration: int
+) -> SpeechIndex:
+    """Build speech index for generated samples, in uneven chunks.
+
+    :param speech_ranges: ranges of loud noise in milliseconds
+    :param duration: total duration in milliseconds
+    :return: speech index
+    """
+    samples = _get_samples(speech_ranges, duration)
+    return SpeechIndex.compute(
+        np.array_split(samples, [123, 4567, 4568]), SAMPLE_RATE
+    )
+
+
+def test_compute() -> None:
+    """Test that speech boundaries are found."""
+    speech_index = _create_index([(1000, 2500), (3000, 4000)], 5000)
+    assert len(speech_index.energy) == 5000 // SPEECH_FRAME_DURATION
+    assert speech_index.onsets.tolist() == [1000, 3000]
+    assert speech_index.offsets.tolist() == [2500, 4000]
+
+
+def test_compute_bridges_short_pauses() -> None:
+    """Test that short pauses and short bursts don't split speech."""
+    speech_index = _create_index(
+        [(1000, 2000), (2100, 3000), (4000, 4020)], 5000
+    )
+    assert speech_index.onsets.tolist() == [1000]
+    assert speech_index.offsets.tolist() == [3000]
+
+
+def test_compute_silence() -> None:
+    """Test that empty audio doesn't contain any speech."""
+    speech_index = SpeechIndex.compute([], SAMPLE_RATE)
+    assert not len(speech_index.onsets)
+    assert speech_index.snap_starts(np.array([100]), 500).tolist() == [100]
+
+
+@pytest.mark.parametrize(
+    "pts,max_distance,expected",
+    [
+        ([900, 2000, 3100, 4500], 150, [1000, 2000, 3000, 4500]),
+        ([900, 2000, 3100, 4500], 50, [900, 2000, 3100, 4500]),
+        ([2100], 5000, [3000]),
+        ([1900], 5000, [1000]),
+    ],
+)
+def test_snap_starts(
+    pts: T.List[int], max_distance: int, expected: T.List[int]
+) -> None:
+    """Test that start times snap to the nearest onset.
+
+    :param pts: start times to snap
+    :param max_distance: how far the onset can be
+    :param expected: expected start times
+    """
+    speech_index = _create_index([(1000, 2500), (3000, 4000)], 5000)
+    actual = speech_index.snap_starts(np.array(pts), max_distance)
+    assert actual.tolist() == expected
+
+
+def test_snap_ends() -> None:
+    """Test that end times snap to the nearest offset."""
+    speech_index = _create_index([(1000, 2500), (3000, 4000)], 5000)
+    actual = speech_index.snap_ends(np.array([2400, 3100, 4100]), 200)
+    assert actual.tolist() == [2500, 3100, 4000]
+
+
+def test_save_and_load(tmp_path: Path) -> None:
+    """Test that the index survives a round trip through a file.
+
+    :param tmp_path: temporary directory
+    """
+    speech_index = _create_index([(1000, 2500)], 3000)
+    path = tmp_path / "speech.npz"
+    with path.open("wb") as handle:
+        speech_index.save(handle)
+    loaded = SpeechIndex.load(path)
+    assert loaded is not None
+    assert np.array_equal(loaded.energy, speech_index.energy)
+    assert loaded.frame_duration == speech_index.frame_duration
+    assert loaded.onsets.tolist() == speech_index.onsets.tolist()
+    assert loaded.offsets.tolist() == speech_index.offsets.tolist()
+
+    path.write_bytes(b"garbage")
+    assert SpeechIndex.load(path) is None
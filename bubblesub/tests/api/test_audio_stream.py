@@ -0,0 +1,405 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tests for bubblesub.api.audio_stream module."""
+
+import io
+import threading
+import typing as T
+import wave
+from pathlib import Path
+from unittest.mock import MagicMock, Mock, patch
+
+import ffms2
+import numpy as np
+import pytest
+
+from bubblesub.api.audio_stream import WAV_EXPORT_CHUNK_SIZE, AudioStream
+
+
+def _create_stream() -> AudioStream:
+    """Create an audio stream that never loads anything on its own.
+
+    :return: audio stream
+    """
+    return AudioStream(MagicMock(), Mock(), Mock(), Path("dummy"))
+
+
+def test_get_mono_samples_from_pcm_cache() -> None:
+    """Test that cached samples are served as views of the cache."""
+    stream = _create_stream()
+    pcm_cache = np.arange(100, dtype=np.float32)
+    stream._pcm_cache = pcm_cache  # pylint: disable=protected-access
+
+    samples = stream.get_mono_samples(10, 20)
+    np.testing.assert_array_equal(samples, pcm_cache[10:30])
+    assert np.shares_memory(samples, pcm_cache)
+
+    assert len(stream.get_mono_samples(90, 20)) == 10
+    assert len(stream.get_mono_samples(-5, 10)) == 10
+
+
+@pytest.mark.parametrize(
+    "sample_format,samples,expected",
+    [
+        (ffms2.FFMS_FMT_U8, [[0, 0], [128, 128], [255, 1]], [-1, 0, 0]),
+        (ffms2.FFMS_FMT_U8, [[255, 255], [64, 64]], [127 / 128, -0.5]),
+        (ffms2.FFMS_FMT_S16, [[-32768, 0], [16384, 16384]], [-0.5, 0.5]),
+        (ffms2.FFMS_FMT_S32, [[-(1 << 31), -(1 << 31)]], [-1]),
+        (
+            ffms2.FFMS_FMT_S32,
+            [[1 << 30, 1 << 30], [0, -(1 << 30)]],
+            [0.5, -0.25],
+        ),
+        (ffms2.FFMS_FMT_FLT, [[0.25, 0.75], [-1.0, 1.0]], [0.5, 0]),
+    ],
+)
+def test_get_mono_samples_downmix(
+    sample_format: int, samples: T.List[T.List[int]], expected: T.List[float]
+) -> None:
+    """Test that decoded samples are downmixed and normalized.
+
+    :param sample_format: FFMS sample format to emulate
+    :param samples: raw samples returned by the decoder
+    :param expected: expected mono samples
+    """
+    stream = _create_stream()
+    # pylint: disable=protected-access
+    stream._source = Mock()
+    stream._sample_format = sample_format
+    with patch.object(stream, "get_samples", return_value=np.array(samples)):
+        actual = stream.get_mono_samples(0, len(samples))
+    assert actual.dtype == np.float32
+    np.testing.assert_allclose(actual, expected)
+
+
+@pytest.mark.parametrize(
+    "sample_format,dtype,bits",
+    [
+        (ffms2.FFMS_FMT_S16, np.int16, 16),
+        (ffms2.FFMS_FMT_S32, np.int32, 32),
+    ],
+)
+def test_get_mono_samples_level(
+    sample_format: int, dtype: T.Any, bits: int
+) -> None:
+    """Test that the same signal gets the same level in every format.
+
+    :param sample_format: FFMS sample format to emulate
+    :param dtype: numpy type of the raw samples
+    :param bits: bit depth of the raw samples
+    """
+    signal = np.sin(np.linspace(0, 2 * np.pi, 64)) * 0.5
+    samples = (signal * (1 << (bits - 1))).astype(dtype)[:, None]
+    stream = _create_stream()
+    # pylint: disable=protected-access
+    stream._source = Mock()
+    stream._sample_format = sample_format
+    with patch.object(stream, "get_samples", return_value=samples):
+        actual = stream.get_mono_samples(0, len(samples))
+    np.testing.assert_allclose(actual, signal, atol=1e-4)
+
+
+def _create_stream_with_samples(
+    samples: np.array, sample_format: int
+) -> AudioStream:
+    """Create an audio stream that serves given samples.
+
+    :param samples: 2D array of samples
+    :param sample_format: FFMS sample format of the samples
+    :return: audio stream
+    """
+    stream = _create_stream()
+    # pylint: disable=protected-access
+    stream._sample_rate = 1000
+    stream._sample_count = len(samples)
+    stream._sample_format = sample_format
+    stream._delay = 0
+    stream._source = Mock()
+    stream._source.get_audio.side_effect = lambda start_frame: samples[
+        start_frame : start_frame + stream._source.init_buffer.call_args[0][0]
+    ]
+    stream._source_ready.set()
+    return stream
+
+
+@pytest.mark.parametrize(
+    "sample_format,dtype",
+    [(ffms2.FFMS_FMT_S16, np.int16), (ffms2.FFMS_FMT_FLT, np.float32)],
+)
+def test_save_wav(sample_format: int, dtype: T.Any) -> None:
+    """Test that long ranges are streamed in chunks into a valid WAV file.
+
+    :param sample_format: FFMS sample format to emulate
+    :param dtype: sample type matching the sample format
+    """
+    samples = (np.arange(WAV_EXPORT_CHUNK_SIZE * 5) % 1000 - 500).reshape(
+        -1, 2
+    )
+    if dtype == np.float32:
+        samples = samples.astype(dtype) / 1000
+    else:
+        samples = samples.astype(dtype)
+    stream = _create_stream_with_samples(samples, sample_format)
+
+    progress: T.List[T.Tuple[int, int]] = []
+    handle = io.BytesIO()
+    assert stream.save_wav(
+        handle,
+        1000,
+        200_000,
+        lambda current, total: bool(progress.append((current, total))),
+    )
+
+    # the range reaches past the end of the audio, and each chunk is read
+    # separately
+    expected = samples[1000:]
+    assert stream._source.init_buffer.call_count == 3
+    assert progress[0] == (0, 199_000)
+    assert progress[-1] == (199_000, 199_000)
+
+    handle.seek(0)
+    with wave.open(handle) as wav:
+        assert wav.getnchannels() == 2
+        assert wav.getframerate() == 1000
+        assert wav.getnframes() == len(expected)
+        actual = wav.readframes(wav.getnframes())
+
+    if dtype == np.float32:
+        expected = (expected * (1 << 31)).astype(np.int32)
+    np.testing.assert_array_equal(
+        np.frombuffer(actual, dtype=expected.dtype).reshape(-1, 2), expected
+    )
+
+
+def test_save_wav_cancel(tmp_path: Path) -> None:
+    """Test that canceled export doesn't leave a partial file behind.
+
+    :param tmp_path: temporary directory
+    """
+    samples = np.zeros((WAV_EXPORT_CHUNK_SIZE * 3, 1), dtype=np.int16)
+    stream = _create_stream_with_samples(samples, ffms2.FFMS_FMT_S16)
+    path = tmp_path / "test.wav"
+
+    assert not stream.save_wav(
+        path, 0, len(samples), lambda current, _total: current > 0
+    )
+    assert stream._source.init_buffer.call_count == 1
+    assert not path.exists()
+
+
+def _create_stream_with_pcm_cache_path(
+    tmp_path: Path, monkeypatch: T.Any, sample_count: int
+) -> AudioStream:
+    """Create an audio stream that keeps its decoded samples cache in given
+    directory.
+
+    :param tmp_path: cache directory
+    :param monkeypatch: pytest monkeypatch fixture
+    :param sample_count: number of samples of the audio
+    :return: audio stream
+    """
+    monkeypatch.setattr(
+        "bubblesub.api.audio_stream.get_file_fingerprint",
+        lambda path: "fingerprint",
+    )
+    monkeypatch.setattr(
+        "bubblesub.api.audio_stream.get_cache_file_path",
+        lambda name, suffix: tmp_path / (name + suffix),
+    )
+    stream = _create_stream()
+    stream._sample_count = sample_count  # pylint: disable=protected-access
+    return stream
+
+
+def test_pcm_cache_empty_track(tmp_path: Path, monkeypatch: T.Any) -> None:
+    """Test that there's no decoded samples cache for silent tracks.
+
+    :param tmp_path: temporary directory
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    stream = _create_stream_with_pcm_cache_path(tmp_path, monkeypatch, 0)
+    # pylint: disable=protected-access
+    assert stream._build_pcm_cache(Mock()) is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_pcm_cache_decoding_failure(
+    tmp_path: Path, monkeypatch: T.Any
+) -> None:
+    """Test that decoding failures don't leave partial caches behind.
+
+    :param tmp_path: temporary directory
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    stream = _create_stream_with_pcm_cache_path(tmp_path, monkeypatch, 10)
+
+    def iter_mono_chunks(_source: T.Any) -> T.Iterable[np.array]:
+        """Decode the first chunk, then fail.
+
+        :param _source: audio source
+        :return: generator of chunks
+        """
+        yield np.zeros(5, dtype=np.float32)
+        raise ffms2.Error("decoding failed")
+
+    # pylint: disable=protected-access
+    with patch.object(stream, "_iter_mono_chunks", iter_mono_chunks):
+        assert stream._build_pcm_cache(Mock()) is None
+    assert not list(tmp_path.iterdir())
+
+
+class _PairedDecoder:
+    """Audio decoder that waits for another decoder to decode alongside it,
+    recording its own concurrent use.
+    """
+
+    def __init__(self, barrier: threading.Barrier) -> None:
+        """Initialize self.
+
+        :param barrier: barrier shared with the other decoder
+        """
+        self._barrier = barrier
+        self._lock = threading.Lock()
+        self._count = 0
+        self._active = 0
+        self.max_active = 0
+        self.decoded_alone = False
+
+    def init_buffer(self, count: int) -> None:
+        """Set how many samples to decode.
+
+        :param count: number of samples
+        """
+        self._count = count
+
+    def get_audio(self, _start_frame: int) -> np.array:
+        """Decode samples.
+
+        :param _start_frame: start frame
+        :return: 2D array of samples
+        """
+        with self._lock:
+            self._active += 1
+            self.max_active = max(self.max_active, self._active)
+        try:
+            self._barrier.wait()
+        except threading.BrokenBarrierError:
+            self.decoded_alone = True
+        with self._lock:
+            self._active -= 1
+        return np.zeros((self._count, 1), dtype=np.int16)
+
+
+def test_streams_decode_in_parallel() -> None:
+    """Test that independent streams don't wait for each other's decoders,
+    while a single decoder is never used concurrently.
+    """
+    requests_per_thread = 5
+    # every decoding waits until the other stream decodes too, which
+    # never happens if the streams share a lock; the timeout only keeps
+    # such a failure from hanging the test
+    barrier = threading.Barrier(2, timeout=5)
+    streams = []
+    for _ in range(2):
+        stream = _create_stream()
+        # pylint: disable=protected-access
+        stream._sample_count = 1000
+        stream._source = _PairedDecoder(barrier)
+        stream._source_ready.set()
+        streams.append(stream)
+
+    # two threads per stream
+    threads = [
+        threading.Thread(
+            target=lambda stream=stream: [
+                stream.get_samples(0, 10) for _ in range(requests_per_thread)
+            ]
+        )
+        for stream in streams * 2
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for stream in streams:
+        assert not stream._source.decoded_alone
+        assert stream._source.max_active == 1
+
+
+def test_samples_available_once_loaded() -> None:
+    """Test that readers waiting for the audio proceed as soon as it loads."""
+    stream = _create_stream()
+    assert not stream.wait_until_ready(timeout=0.01)
+
+    results: T.List[np.array] = []
+    thread = threading.Thread(
+        target=lambda: results.append(stream.get_samples(0, 10))
+    )
+    thread.start()
+    thread.join(0.05)
+    assert thread.is_alive()
+
+    source = Mock()
+    source.properties.FirstTime = 0.0
+    source.properties.LastTime = 1.0
+    source.properties.Channels = 1
+    source.properties.BitsPerSample = 16
+    source.properties.NumSamples = 1000
+    source.properties.SampleRate = 1000
+    source.properties.SampleFormat = ffms2.FFMS_FMT_S16
+    source.get_audio.return_value = np.ones((10, 1), dtype=np.int16)
+    stream._set_source(source)  # pylint: disable=protected-access
+
+    thread.join(1)
+    assert not thread.is_alive()
+    assert stream.wait_until_ready(timeout=0)
+    np.testing.assert_array_equal(results[0], np.ones((10, 1)))
+
+
+def test_samples_available_once_loading_fails() -> None:
+    """Test that readers waiting for the audio proceed if it fails to load."""
+    stream = _create_stream()
+    stream._set_source(None)  # pylint: disable=protected-access
+    assert not stream.wait_until_ready()
+    assert not np.any(stream.get_samples(0, 10))
+
+
+def test_samples_available_once_loading_crashes() -> None:
+    """Test that readers waiting for the audio proceed if loading it raises
+    an unexpected error.
+    """
+    stream = _create_stream()
+    with patch(
+        "bubblesub.api.audio_stream._load_audio_source",
+        side_effect=IsADirectoryError,
+    ), pytest.raises(IsADirectoryError):
+        stream._load_source()  # pylint: disable=protected-access
+    assert not stream.wait_until_ready(timeout=0)
+    assert not np.any(stream.get_samples(0, 10))
+
+
+def test_samples_available_once_loading_is_canceled() -> None:
+    """Test that readers waiting for the audio proceed once its loading is
+    canceled, even if the loading thread is still busy.
+    """
+    stream = _create_stream()
+    thread = threading.Thread(target=lambda: stream.get_samples(0, 10))
+    thread.start()
+    stream.cancel_loading()
+    thread.join(1)
+    assert not thread.is_alive()
@@ -0,0 +1,98 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tests for bubblesub.api.threading module."""
+
+import typing as T
+from unittest.mock import MagicMock
+
+from bubblesub.api.threading import QueueWorker, ThreadingApi
+
+
+class _RecordingWorker(QueueWorker):
+    """Worker that records processed tasks and quits after the last one."""
+
+    def __init__(self) -> None:
+        """Initialize self."""
+        super().__init__(MagicMock())
+        self.processed: T.List[T.Any] = []
+
+    def _process_task(self, task: T.Any) -> None:
+        """Record the task.
+
+        :param task: task to process
+        """
+        if task == "cancel":
+            before = self._is_task_canceled()
+            self.clear_tasks()
+            task = (before, self._is_task_canceled())
+            self.schedule_task("last")
+        self.processed.append(task)
+        if task == "last":
+            self._running = False
+
+
+def test_priority_order() -> None:
+    """Test that tasks are processed by priority, then in FIFO order."""
+    worker = _RecordingWorker()
+    worker.schedule_task("last", priority=10)
+    worker.schedule_task("c", priority=2)
+    worker.schedule_task("a", priority=1)
+    worker.schedule_task("b", priority=1)
+    worker.schedule_task("d")
+    worker.run()
+    assert worker.processed == ["d", "a", "b", "c", "last"]
+
+
+def test_clear_tasks_drops_queued_tasks() -> None:
+    """Test that tasks scheduled before clearing are never processed."""
+    worker = _RecordingWorker()
+    worker.schedule_task("stale")
+    worker.clear_tasks()
+    worker.schedule_task("fresh")
+    worker.schedule_task("last", priority=1)
+    worker.run()
+    assert worker.processed == ["fresh", "last"]
+
+
+def test_current_task_cancellation() -> None:
+    """Test that the task being processed learns about being canceled."""
+    worker = _RecordingWorker()
+    worker.schedule_task("cancel")
+    worker.schedule_task("stale")
+    worker.run()
+    assert worker.processed == [(False, True), "last"]
+
+
+def test_stopped_queue_workers_release_threads() -> None:
+    """Test that queue workers grow the thread pool only while running."""
+    api = ThreadingApi(MagicMock())
+    # pylint: disable=protected-access
+    thread_pool = api._thread_pool
+    thread_count = thread_pool.maxThreadCount()
+    thread_counts: T.List[int] = []
+
+    for _ in range(3):
+        worker = _RecordingWorker()
+        worker._started = lambda: thread_counts.append(  # type: ignore
+            thread_pool.maxThreadCount()
+        )
+        worker.schedule_task("last")
+        api.schedule_runnable(worker)
+        assert thread_pool.waitForDone(5000)
+
+    assert thread_counts == [thread_count + 1] * 3
+    assert thread_pool.maxThreadCount() == thread_count
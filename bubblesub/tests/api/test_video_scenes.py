@@ -0,0 +1,74 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tests for bubblesub.api.video_scenes module."""
+
+import numpy as np
+
+from bubblesub.api.video_scenes import (
+    SCENE_HISTOGRAM_BINS,
+    SCENE_SCORE_SCALE,
+    SceneIndex,
+    compute_histogram,
+    compute_scores,
+)
+
+
+def test_compute_histogram() -> None:
+    """Test that each channel gets its own bins."""
+    frame = np.zeros((2, 3, 3), dtype=np.uint8)
+    frame[:, :, 0] = 255
+    frame[0, :, 1] = 128
+    histogram = compute_histogram(frame)
+    assert histogram.shape == (3 * SCENE_HISTOGRAM_BINS,)
+    assert histogram[SCENE_HISTOGRAM_BINS - 1] == 6
+    assert histogram[SCENE_HISTOGRAM_BINS] == 3
+    assert histogram[SCENE_HISTOGRAM_BINS + SCENE_HISTOGRAM_BINS // 2] == 3
+    assert histogram[2 * SCENE_HISTOGRAM_BINS] == 6
+    assert histogram.sum() == 18
+
+
+def test_compute_scores() -> None:
+    """Test that the scores grow with the difference between frames."""
+    black = compute_histogram(np.zeros((4, 4, 3), dtype=np.uint8))
+    white = compute_histogram(np.full((4, 4, 3), 255, dtype=np.uint8))
+    half = compute_histogram(
+        np.concatenate(
+            (
+                np.zeros((2, 4, 3), dtype=np.uint8),
+                np.full((2, 4, 3), 255, dtype=np.uint8),
+            )
+        )
+    )
+    scores = compute_scores(
+        np.array([black, white, half]), np.array([black, black, black])
+    )
+    assert scores.tolist() == [0, SCENE_SCORE_SCALE, 128]
+
+
+def test_scene_index() -> None:
+    """Test that the cuts follow the scores."""
+    index = SceneIndex(np.zeros(5, dtype=np.uint8), [0, 10, 20, 30, 40])
+    assert index.cuts.tolist() == []
+    assert index.cut_pts.tolist() == []
+
+    index.update(np.array([1, 3]), np.array([SCENE_SCORE_SCALE, 50]))
+    assert index.cuts.tolist() == [1]
+    assert index.cut_pts.tolist() == [10]
+
+    index.update(np.array([3]), np.array([SCENE_SCORE_SCALE]))
+    assert index.cuts.tolist() == [1, 3]
+    assert index.cut_pts.tolist() == [10, 30]
@@ -16,11 +16,14 @@
 
 """Tests for bubblesub.api.video module."""
 
+import threading
 import typing as T
 from pathlib import Path
-from unittest.mock import Mock, PropertyMock, patch
+from unittest.mock import MagicMock, Mock, PropertyMock, patch
 
+import ffms2
 import numpy as np
+import PIL.Image
 import pytest
 
 from bubblesub.api.video import VideoStream
@@ -33,6 +36,9 @@ def _test_align_pts_to_frame(
 ) -> None:
     """Test aligning PTS to frames using a few mocked frames.
 
+    Every frame is mocked as a keyframe as well, so that the same
+    expectations hold for aligning to keyframes.
+
     :param origin: source PTS
     :param expected: expected PTS
     :param align_func: the function to test
@@ -44,11 +50,24 @@ def _test_align_pts_to_frame(
     with patch(
         VideoStream.__module__ + "." + VideoStream.__name__ + ".timecodes",
         new_callable=PropertyMock,
-        return_value=[0, 10, 20],
+        return_value=np.array([0, 10, 20]),
+    ), patch(
+        VideoStream.__module__
+        + "."
+        + VideoStream.__name__
+        + ".keyframe_timecodes",
+        new_callable=PropertyMock,
+        return_value=np.array([0, 10, 20]),
     ):
-        stream = VideoStream(threading_api, log_api, subs_api, Path("dummy"))
+        stream = VideoStream(
+            MagicMock(), threading_api, log_api, subs_api, Path("dummy")
+        )
         actual = align_func(stream)(origin)
         assert actual == expected
+        assert isinstance(actual, int)
+
+        actual_array = align_func(stream)(np.array([origin, origin]))
+        assert actual_array.tolist() == [expected, expected]
 
 
 @pytest.mark.parametrize(
@@ -68,7 +87,7 @@ def _test_align_pts_to_frame(
     ],
 )
 def test_align_pts_to_prev_frame(origin: int, expected: int) -> None:
-    """Test aligning PTS to the previous frame.
+    """Test aligning PTS to the previous frame and keyframe.
 
     :param origin: source PTS
     :param expected: expected PTS
@@ -76,6 +95,9 @@ def test_align_pts_to_prev_frame(origin: int, expected: int) -> None:
     _test_align_pts_to_frame(
         origin, expected, lambda stream: stream.align_pts_to_prev_frame
     )
+    _test_align_pts_to_frame(
+        origin, expected, lambda stream: stream.align_pts_to_prev_keyframe
+    )
 
 
 @pytest.mark.parametrize(
@@ -95,7 +117,7 @@ def test_align_pts_to_prev_frame(origin: int, expected: int) -> None:
     ],
 )
 def test_align_pts_to_next_frame(origin: int, expected: int) -> None:
-    """Test aligning PTS to the next frame.
+    """Test aligning PTS to the next frame and keyframe.
 
     :param origin: source PTS
     :param expected: expected PTS
@@ -103,6 +125,9 @@ def test_align_pts_to_next_frame(origin: int, expected: int) -> None:
     _test_align_pts_to_frame(
         origin, expected, lambda stream: stream.align_pts_to_next_frame
     )
+    _test_align_pts_to_frame(
+        origin, expected, lambda stream: stream.align_pts_to_next_keyframe
+    )
 
 
 @pytest.mark.parametrize(
@@ -126,7 +151,7 @@ def test_align_pts_to_next_frame(origin: int, expected: int) -> None:
     ],
 )
 def test_align_pts_to_near_frame(origin: int, expected: int) -> None:
-    """Test aligning PTS to the nearest frame.
+    """Test aligning PTS to the nearest frame and keyframe.
 
     :param origin: source PTS
     :param expected: expected PTS
@@ -134,6 +159,9 @@ def test_align_pts_to_near_frame(origin: int, expected: int) -> None:
     _test_align_pts_to_frame(
         origin, expected, lambda stream: stream.align_pts_to_near_frame
     )
+    _test_align_pts_to_frame(
+        origin, expected, lambda stream: stream.align_pts_to_near_keyframe
+    )
 
 
 @pytest.mark.parametrize(
@@ -192,12 +220,435 @@ def test_frame_idx_from_pts(
     with patch(
         VideoStream.__module__ + "." + VideoStream.__name__ + ".timecodes",
         new_callable=PropertyMock,
-        return_value=timecodes,
+        return_value=np.array(timecodes, dtype=np.int64),
     ):
-        stream = VideoStream(threading_api, log_api, subs_api, Path("dummy"))
+        stream = VideoStream(
+            MagicMock(), threading_api, log_api, subs_api, Path("dummy")
+        )
         if isinstance(pts, np.ndarray):
             np.testing.assert_array_equal(
                 stream.frame_idx_from_pts(pts), expected
             )
         else:
             assert stream.frame_idx_from_pts(pts) == expected
+
+
+def test_timecodes_and_keyframes() -> None:
+    """Test that frame and keyframe times are kept as sorted arrays."""
+    source = Mock()
+    source.track.timecodes = [20.4, 0.0, 9.6, 30.2]
+    source.track.keyframes = [2, 0]
+    source.properties.FPSNumerator = 100
+    source.properties.FPSDenominator = 1
+    source.properties.SARNum = 0
+    source.properties.SARDen = 0
+    source.get_frame.return_value = Mock(EncodedWidth=4, EncodedHeight=2)
+    stream = VideoStream(MagicMock(), Mock(), Mock(), Mock(), Path("dummy"))
+    stream._set_source(source)  # pylint: disable=protected-access
+
+    assert stream.timecodes.tolist() == [0, 10, 20, 30]
+    assert stream.keyframes.tolist() == [0, 2]
+    assert stream.keyframe_timecodes.tolist() == [0, 20]
+    assert stream.min_pts == 0
+    assert stream.max_pts == 30
+    assert stream.align_pts_to_next_keyframe(5) == 20
+    assert stream.align_pts_to_prev_keyframe(np.array([5, 25])).tolist() == [
+        0,
+        20,
+    ]
+
+
+def test_load_progress_and_cancel() -> None:
+    """Test that indexing progress is reported as percentages and that
+    canceling the load asks the indexer to stop.
+    """
+    threading_api = Mock()
+    log_api = Mock()
+    subs_api = Mock()
+
+    stream = VideoStream(
+        MagicMock(), threading_api, log_api, subs_api, Path("dummy")
+    )
+    percentages: T.List[int] = []
+    stream.load_progress.connect(percentages.append)
+
+    # pylint: disable=protected-access
+    assert not stream._on_load_progress(0, 200)
+    assert not stream._on_load_progress(1, 200)
+    assert not stream._on_load_progress(100, 200)
+    stream.cancel_loading()
+    assert stream._on_load_progress(200, 200)
+    assert percentages == [0, 50, 100]
+
+
+def test_frames_available_once_loading_crashes() -> None:
+    """Test that readers waiting for the video proceed if loading it raises
+    an unexpected error.
+    """
+    stream = VideoStream(MagicMock(), Mock(), Mock(), Mock(), Path("dummy"))
+    with patch(
+        "bubblesub.api.video_stream._load_video_source",
+        side_effect=PermissionError,
+    ), pytest.raises(PermissionError):
+        stream._load_source()  # pylint: disable=protected-access
+    assert not stream.wait_until_ready(timeout=0)
+    # pylint: disable=protected-access
+    assert stream._get_frame(0, 10, 10) is None
+
+
+def test_frames_available_once_loading_is_canceled() -> None:
+    """Test that readers waiting for the video proceed once its loading is
+    canceled, even if the loading thread is still busy.
+    """
+    stream = VideoStream(MagicMock(), Mock(), Mock(), Mock(), Path("dummy"))
+    stream._timecodes = np.arange(10)  # pylint: disable=protected-access
+    thread = threading.Thread(
+        # pylint: disable=protected-access
+        target=lambda: stream._get_frame(0, 10, 10)
+    )
+    thread.start()
+    stream.cancel_loading()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert not stream.wait_until_ready(timeout=0)
+
+
+def test_first_frame_decoding_failure() -> None:
+    """Test that the video is reported as broken if its first frame can't
+    be decoded.
+    """
+    log_api = Mock()
+    stream = VideoStream(MagicMock(), Mock(), log_api, Mock(), Path("dummy"))
+    source = Mock()
+    source.track.timecodes = [0.0]
+    source.track.keyframes = [0]
+    source.properties.FPSNumerator = 24
+    source.properties.FPSDenominator = 1
+    source.properties.SARNum = 0
+    source.properties.SARDen = 0
+    source.get_frame.side_effect = ffms2.Error("cannot decode")
+    errored = Mock()
+    stream.errored.connect(errored)
+
+    with patch(
+        "bubblesub.api.video_stream._load_video_source", return_value=source
+    ):
+        # pylint: disable=protected-access
+        stream._got_source(stream._load_source())
+
+    assert not stream.wait_until_ready(timeout=0)
+    log_api.error.assert_called_once()
+    errored.assert_called_once_with()
+
+
+class _FakeVideoSource:
+    """Video decoder that fills frames with their index."""
+
+    def __init__(self) -> None:
+        """Initialize self."""
+        self.decoded: T.List[int] = []
+        self._width = 0
+        self._height = 0
+
+    def set_output_format(
+        self, _pix_fmts: T.Any, width: int, height: int, _resizer: int
+    ) -> None:
+        """Set output frame size.
+
+        :param _pix_fmts: pixel formats
+        :param width: output width
+        :param height: output height
+        :param _resizer: resizing algorithm
+        """
+        self._width = width
+        self._height = height
+
+    def get_frame(self, frame_idx: int) -> T.Any:
+        """Decode a frame.
+
+        :param frame_idx: frame index
+        :return: decoded frame, with padded lines
+        """
+        self.decoded.append(frame_idx)
+        linesize = self._width * 3 + 5
+        return Mock(
+            planes=[np.full(linesize * self._height, frame_idx, np.uint8)],
+            Linesize=[linesize],
+        )
+
+
+def _create_loaded_stream(
+    frame_cache_size: int, frame_prefetch: int
+) -> VideoStream:
+    """Create a video stream with 100 frames decoded by a fake decoder.
+
+    :param frame_cache_size: frame cache budget in bytes
+    :param frame_prefetch: how many frames to prefetch
+    :return: video stream
+    """
+    cfg = Mock()
+    cfg.opt = {
+        "video": {
+            "frame_cache_size": frame_cache_size,
+            "frame_prefetch": frame_prefetch,
+            "screenshot_workers": 2,
+        }
+    }
+    threading_api = Mock()
+    threading_api.schedule_runnable.side_effect = lambda worker: (
+        threading.Thread(target=worker.run, daemon=True).start()
+    )
+    stream = VideoStream(
+        cfg, threading_api, MagicMock(), Mock(), Path("dummy")
+    )
+    # pylint: disable=protected-access
+    stream._source = _FakeVideoSource()
+    stream._timecodes = np.arange(0, 1000, 10)
+    stream._source_ready.set()
+    return stream
+
+
+def test_get_frame_cache() -> None:
+    """Test that frames are decoded once and evicted beyond the budget."""
+    frame_size = 4 * 2 * 3
+    stream = _create_loaded_stream(frame_size * 2, 0)
+    source = stream._source  # pylint: disable=protected-access
+
+    frame = stream.get_frame(5, 4, 2)
+    assert frame.shape == (2, 4, 3)
+    assert np.all(frame == 5)
+    assert not frame.flags.writeable
+    assert stream.get_frame(5, 4, 2) is frame
+    assert source.decoded == [5]
+
+    # different size is a different frame
+    stream.get_frame(5, 2, 1)
+    assert source.decoded == [5, 5]
+
+    # the least recently used frame is evicted
+    stream.get_frame(5, 4, 2)
+    stream.get_frame(6, 4, 2)
+    stream.get_frame(5, 4, 2)
+    stream.get_frame(7, 4, 2)
+    stream.get_frame(5, 4, 2)
+    assert source.decoded == [5, 5, 6, 7]
+    stream.get_frame(6, 4, 2)
+    assert source.decoded == [5, 5, 6, 7, 6]
+
+    assert stream.get_frame(100, 4, 2) is None
+
+
+def test_get_frame_prefetch() -> None:
+    """Test that neighboring frames get decoded in the background."""
+    stream = _create_loaded_stream(1 << 20, 3)
+    source = stream._source  # pylint: disable=protected-access
+
+    stream.get_frame(50, 4, 2)
+    stream._prefetcher._queue.join()  # pylint: disable=protected-access
+    assert source.decoded == [50, 47, 48, 49, 51, 52, 53]
+
+    stream.get_frame(51, 4, 2)
+    stream.get_frame(52, 4, 2)
+    stream._prefetcher._queue.join()  # pylint: disable=protected-access
+    assert source.decoded[:7] == [50, 47, 48, 49, 51, 52, 53]
+    assert sorted(source.decoded[7:]) == [54, 55]
+
+    stream.cancel_loading()
+
+
+def test_iter_frames() -> None:
+    """Test that frames are decoded in order by a dedicated decoder."""
+    stream = _create_loaded_stream(1 << 20, 0)
+    main_source = stream._source  # pylint: disable=protected-access
+    main_source.track_number = 0
+    main_source.index = Mock()
+    sequential_source = _FakeVideoSource()
+    sequential_source.set_output_format = Mock(
+        side_effect=sequential_source.set_output_format
+    )
+
+    with patch(
+        "bubblesub.api.video_stream.ffms2.VideoSource",
+        return_value=sequential_source,
+    ):
+        frames = list(stream.iter_frames([7, 3, 5, 150, 4], 1, 2))
+
+    assert [frame_idx for frame_idx, _frame in frames] == [3, 4, 5, 7]
+    for frame_idx, frame in frames:
+        assert frame.shape == (2, 1, 3)
+        assert np.all(frame == frame_idx)
+    assert sequential_source.decoded == [3, 4, 5, 7]
+    assert sequential_source.set_output_format.call_count == 1
+    assert not main_source.decoded
+
+
+def test_iter_frames_concurrently() -> None:
+    """Test that concurrent batches get their own decoders, which are then
+    reused.
+    """
+    stream = _create_loaded_stream(1 << 20, 0)
+    main_source = stream._source  # pylint: disable=protected-access
+    main_source.track_number = 0
+    main_source.index = Mock()
+    decoders: T.List[_FakeVideoSource] = []
+
+    with patch(
+        "bubblesub.api.video_stream.ffms2.VideoSource",
+        side_effect=lambda *_args, **_kwargs: decoders.append(
+            _FakeVideoSource()
+        )
+        or decoders[-1],
+    ) as video_source:
+        frames1 = iter(stream.iter_frames(range(0, 10), 1, 2))
+        frames2 = iter(stream.iter_frames(range(50, 60), 1, 2))
+        assert next(frames1)[0] == 0
+        assert next(frames2)[0] == 50
+        assert next(frames1)[0] == 1
+        assert len(decoders) == 2
+        assert decoders[0].decoded == [0, 1]
+        assert decoders[1].decoded == [50]
+        assert len(list(frames1)) == 8
+        assert len(list(frames2)) == 9
+
+        assert len(list(stream.iter_frames(range(20, 30), 1, 2))) == 10
+        assert len(decoders) == 2
+        assert all(
+            call[1]["num_threads"] == 1 for call in video_source.call_args_list
+        )
+
+    # unloading the stream releases the decoders
+    stream.cancel_loading()
+    assert not stream._spare_decoders  # pylint: disable=protected-access
+
+
+def test_save_screenshots(tmp_path: Path) -> None:
+    """Test that screenshots are saved from frames decoded in order.
+
+    :param tmp_path: temporary directory
+    """
+    stream = _create_loaded_stream(1 << 20, 0)
+    main_source = stream._source  # pylint: disable=protected-access
+    main_source.track_number = 0
+    main_source.index = Mock()
+    sequential_source = _FakeVideoSource()
+    progress: T.List[T.Tuple[int, int]] = []
+
+    with patch(
+        "bubblesub.api.video_stream.ffms2.VideoSource",
+        return_value=sequential_source,
+    ):
+        count = stream.save_screenshots(
+            [
+                (75, tmp_path / "a.png"),
+                (30, tmp_path / "b.png"),
+                (35, tmp_path / "c.jpg"),
+            ],
+            include_subtitles=False,
+            width=4,
+            height=2,
+            progress_callback=lambda done, total: bool(
+                progress.append((done, total))
+            ),
+        )
+
+    assert count == 3
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    assert sequential_source.decoded == [3, 7]
+    assert not main_source.decoded
+    with PIL.Image.open(tmp_path / "a.png") as image:
+        assert image.size == (4, 2)
+        assert image.getpixel((0, 0)) == (7, 7, 7)
+    with PIL.Image.open(tmp_path / "b.png") as image:
+        assert image.getpixel((0, 0)) == (3, 3, 3)
+    with PIL.Image.open(tmp_path / "c.jpg") as image:
+        assert image.format == "JPEG"
+
+
+def _create_fake_renderer(
+    renderers: T.List[Mock], render_threads: T.Set[int], image: PIL.Image
+) -> Mock:
+    """Create a fake subtitle renderer.
+
+    :param renderers: list to add the renderer to
+    :param render_threads: set to add the threads rendering with it to
+    :param image: image to render
+    :return: fake renderer
+    """
+    renderer = Mock()
+    renderer.render.side_effect = lambda **_kwargs: (
+        render_threads.add(threading.get_ident()) or image
+    )
+    renderers.append(renderer)
+    return renderer
+
+
+def test_save_screenshots_subtitles(tmp_path: Path) -> None:
+    """Test that each worker renders the subtitles with its own renderer.
+
+    :param tmp_path: temporary directory
+    """
+    stream = _create_loaded_stream(1 << 20, 0)
+    main_source = stream._source  # pylint: disable=protected-access
+    main_source.track_number = 0
+    main_source.index = Mock()
+    stream._aspect_ratio = 1  # pylint: disable=protected-access
+    subs_image = PIL.Image.new("RGBA", (4, 2), (255, 0, 0, 255))
+    renderers: T.List[Mock] = []
+    render_threads: T.Set[int] = set()
+
+    with patch(
+        "bubblesub.api.video_stream.ffms2.VideoSource",
+        return_value=_FakeVideoSource(),
+    ), patch(
+        "bubblesub.api.video_stream.AssRenderer",
+        side_effect=lambda: _create_fake_renderer(
+            renderers, render_threads, subs_image
+        ),
+    ):
+        count = stream.save_screenshots(
+            [(pts, tmp_path / f"{pts}.png") for pts in range(0, 200, 10)],
+            include_subtitles=True,
+            width=4,
+            height=2,
+        )
+
+    assert count == 20
+    assert 1 <= len(renderers) <= 2
+    assert threading.get_ident() not in render_threads
+    assert sum(renderer.render.call_count for renderer in renderers) == 20
+    for renderer in renderers:
+        renderer.set_source.assert_called_with(
+            stream._subs_api.styles,  # pylint: disable=protected-access
+            stream._subs_api.events,  # pylint: disable=protected-access
+            stream._subs_api.meta,  # pylint: disable=protected-access
+            (4, 2),
+        )
+        renderer.close.assert_called_once_with()
+    with PIL.Image.open(tmp_path / "50.png") as image:
+        assert image.getpixel((0, 0)) == (255, 0, 0)
+
+
+def test_save_screenshots_cancel(tmp_path: Path) -> None:
+    """Test that the export stops once the progress callback says so.
+
+    :param tmp_path: temporary directory
+    """
+    stream = _create_loaded_stream(1 << 20, 0)
+    main_source = stream._source  # pylint: disable=protected-access
+    main_source.track_number = 0
+    main_source.index = Mock()
+
+    with patch(
+        "bubblesub.api.video_stream.ffms2.VideoSource",
+        return_value=_FakeVideoSource(),
+    ):
+        count = stream.save_screenshots(
+            [(pts, tmp_path / f"{pts}.png") for pts in range(0, 1000, 10)],
+            include_subtitles=False,
+            width=4,
+            height=2,
+            progress_callback=lambda done, total: done >= 2,
+        )
+
+    assert count == 2
+    assert len(list(tmp_path.iterdir())) < 100
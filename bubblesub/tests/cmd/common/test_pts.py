@@ -20,9 +20,11 @@ import asyncio
 import typing as T
 from unittest.mock import Mock
 
+import numpy as np
 import pytest
 
 from bubblesub.api.cmd import CommandError
+from bubblesub.api.video_scenes import SCENE_SCORE_SCALE, SceneIndex
 from bubblesub.cmd.common import Pts
 
 
@@ -278,8 +280,13 @@ def test_frames(
     :param expected_value: expected PTS
     """
     api = Mock()
-    api.video.current_stream.timecodes = frame_times
-    api.video.current_stream.keyframes = keyframe_indexes
+    api.video.current_stream.timecodes = np.array(frame_times, dtype=np.int64)
+    api.video.current_stream.keyframes = np.array(
+        keyframe_indexes, dtype=np.int64
+    )
+    api.video.current_stream.keyframe_timecodes = (
+        api.video.current_stream.timecodes[api.video.current_stream.keyframes]
+    )
     if cur_frame_idx is Ellipsis:
         api.playback.current_pts = 0
     else:
@@ -289,6 +296,68 @@ def test_frames(
     _assert_pts_value(pts, expected_value)
 
 
+@pytest.mark.parametrize(
+    "expr,cut_frame_idxs,cur_frame_idx,expected_value",
+    [
+        ("fsc", [1, 3], 0, 20),
+        ("lsc", [1, 3], 0, 40),
+        ("csc", [1, 3], 2, 20),
+        ("csc", [1, 3], 3, 40),
+        ("psc", [1, 3], 3, 20),
+        ("psc", [1, 3], 0, 20),
+        ("nsc", [1, 3], 1, 40),
+        ("nsc", [1, 3], 4, 40),
+        ("1sc", [1, 3], ..., 20),
+        ("2sc", [1, 3], ..., 40),
+        ("0sc", [1, 3], ..., 20),
+        ("5sc", [1, 3], ..., 40),
+        ("10ms+1sc", [1, 3], ..., 20),
+        ("20ms+1sc", [1, 3], ..., 40),
+        ("45ms-1sc", [1, 3], ..., 40),
+        ("40ms-1sc", [1, 3], ..., 20),
+        ("1sc+10ms", [1, 3], ..., 30),
+        ("1sc+1sc", [1, 3], ..., 40),
+        ("1s", [1, 3], ..., 1000),
+        ("nsc", [], 0, CommandError),
+        ("1sc", [], ..., CommandError),
+        ("10ms+1sc", [], ..., CommandError),
+    ],
+)
+def test_scenes(
+    expr: str,
+    cut_frame_idxs: T.List[int],
+    cur_frame_idx: T.Any,
+    expected_value: T.Union[int, T.Type[CommandError]],
+) -> None:
+    """Test scene change arithmetic.
+
+    :param expr: input expression to parse
+    :param cut_frame_idxs: which frames start new scenes to simulate
+    :param cur_frame_idx: current video frame index to simulate
+    :param expected_value: expected PTS
+    """
+    frame_times = [10, 20, 30, 40, 50]
+    scores = np.zeros(len(frame_times), dtype=np.uint8)
+    scores[cut_frame_idxs] = SCENE_SCORE_SCALE
+    api = Mock()
+    api.video.current_stream.timecodes = np.array(frame_times)
+    api.video.current_stream.scene_index = SceneIndex(scores, frame_times)
+    if cur_frame_idx is Ellipsis:
+        api.playback.current_pts = 0
+    else:
+        api.playback.current_pts = frame_times[cur_frame_idx]
+    pts = Pts(api, expr)
+
+    _assert_pts_value(pts, expected_value)
+
+
+def test_scenes_without_index() -> None:
+    """Test scene change arithmetic before the scenes are known."""
+    api = Mock()
+    api.video.current_stream.scene_index = None
+    _assert_pts_value(Pts(api, "nsc"), CommandError)
+
+
 @pytest.mark.parametrize(
     "expr,selection,expected_value", [("a.s", (1, 2), 1), ("a.e", (1, 2), 2)]
 )
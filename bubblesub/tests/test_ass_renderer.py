@@ -0,0 +1,371 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tests for bubblesub.ass_renderer module."""
+
+import ctypes
+import threading
+import typing as T
+
+import numpy as np
+import pytest
+
+from bubblesub.ass_renderer import AssRenderer, libass
+from bubblesub.ass_renderer.ass_renderer import _composite
+from bubblesub.fmt.ass.event import AssEvent, AssEventList
+from bubblesub.fmt.ass.meta import AssMeta
+from bubblesub.fmt.ass.style import AssStyle, AssStyleList
+
+
+def _make_source() -> T.Tuple[AssStyleList, AssEventList, AssMeta]:
+    """Create a minimal ASS document.
+
+    :return: style list, event list and metadata
+    """
+    style_list = AssStyleList()
+    style_list.append(AssStyle(name="Default"))
+    event_list = AssEventList()
+    event_list.append(AssEvent(start=0, end=1000, text="first"))
+    event_list.append(AssEvent(start=1000, end=2000, text="second"))
+    return style_list, event_list, AssMeta()
+
+
+def test_set_source_reuses_track() -> None:
+    """Test that setting the same unchanged source keeps the track."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    track = renderer._track
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    assert renderer._track is track
+    assert [event.text for event in track.events] == [b"first", b"second"]
+
+
+def test_set_source_resolution_change() -> None:
+    """Test that changing the resolution doesn't repopulate the track."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    track = renderer._track
+    renderer.set_source(style_list, event_list, meta, (320, 240))
+    assert renderer._track is track
+    assert (track.play_res_x, track.play_res_y) == (320, 240)
+
+
+def _get_track_texts(renderer: AssRenderer) -> T.List[bytes]:
+    """Read event texts from the renderer's libass track, once the recorded
+    changes are applied to it by rendering.
+
+    :param renderer: renderer to read the track of
+    :return: texts of the track events
+    """
+    renderer.render_raw(0)
+    return [event.text for event in renderer._track.events]
+
+
+def test_set_source_event_change() -> None:
+    """Test that edits to the events are applied to the same track."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    track = renderer._track
+    event_list[0].text = "changed"
+    assert _get_track_texts(renderer) == [b"changed", b"second"]
+    event_list.remove(1, 1)
+    assert _get_track_texts(renderer) == [b"changed"]
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    assert renderer._track is track
+
+
+def test_events_inserted() -> None:
+    """Test that inserted events land at the right track positions."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    event_list.insert(1, *[AssEvent(text=str(i)) for i in range(50)])
+    event_list.insert(0, AssEvent(text="zeroth"))
+    assert _get_track_texts(renderer) == (
+        [b"zeroth", b"first"]
+        + [str(i).encode() for i in range(50)]
+        + [b"second"]
+    )
+
+
+def test_events_moved() -> None:
+    """Test that moving events reorders the track."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    event_list.append(AssEvent(text="third"), AssEvent(text="fourth"))
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    event_list.move(0, 2, 2)
+    assert _get_track_texts(renderer) == [
+        b"third",
+        b"fourth",
+        b"first",
+        b"second",
+    ]
+    event_list.move(3, 1, 0)
+    assert _get_track_texts(renderer) == [
+        b"second",
+        b"third",
+        b"fourth",
+        b"first",
+    ]
+
+
+def test_events_replaced() -> None:
+    """Test that replacing an event updates the track."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    event_list[1] = AssEvent(text="replaced")
+    assert _get_track_texts(renderer) == [b"first", b"replaced"]
+
+
+def test_comments_hidden() -> None:
+    """Test that comments stay in the track without being displayed."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    event_list[0].is_comment = True
+    renderer.render_raw(0)
+    assert [event.duration_ms for event in renderer._track.events] == [
+        0,
+        1000,
+    ]
+
+
+def test_style_change_rebuilds_track() -> None:
+    """Test that style edits rebuild the track."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    track = renderer._track
+    style_list[0].font_size = 40
+    event_list[0].text = "changed"
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    assert renderer._track is not track
+    assert renderer._track.styles[0].fontsize == 40
+    assert _get_track_texts(renderer) == [b"changed", b"second"]
+
+
+def test_set_source_meta_change() -> None:
+    """Test that changes to the metadata reach the track."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    meta.set("PlayResX", "1280")
+    meta.set("PlayResY", "720")
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    assert (renderer._track.play_res_x, renderer._track.play_res_y) == (
+        1280,
+        720,
+    )
+
+
+def test_set_source_new_lists() -> None:
+    """Test that switching to other lists stops tracking the old ones."""
+    renderer = AssRenderer()
+    old_style_list, old_event_list, old_meta = _make_source()
+    renderer.set_source(old_style_list, old_event_list, old_meta, (640, 480))
+    style_list, event_list, meta = _make_source()
+    event_list[0].text = "new"
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    track = renderer._track
+    assert track.events[0].text == b"new"
+
+    old_event_list[0].text = "ignored"
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    assert renderer._track is track
+
+
+def test_changes_applied_on_render() -> None:
+    """Test that list changes reach the track only once it's used."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    event_list.insert(0, AssEvent(text="zeroth"))
+    assert [event.text for event in renderer._track.events] == [
+        b"first",
+        b"second",
+    ]
+    assert _get_track_texts(renderer) == [b"zeroth", b"first", b"second"]
+
+
+def test_render_during_change() -> None:
+    """Test that rendering from another thread doesn't wait for list
+    changes, nor sees them halfway through.
+    """
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    texts: T.List[T.List[bytes]] = []
+
+    def on_items_about_to_be_inserted(_idx: int, _count: int) -> None:
+        """Render while the insertion is underway.
+
+        :param _idx: where the events are inserted
+        :param _count: how many events are inserted
+        """
+        thread = threading.Thread(
+            target=lambda: texts.append(_get_track_texts(renderer))
+        )
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+
+    event_list.items_about_to_be_inserted.connect(
+        on_items_about_to_be_inserted
+    )
+    event_list.insert(0, AssEvent(text="zeroth"))
+    assert texts == [[b"first", b"second"]]
+    assert _get_track_texts(renderer) == [b"zeroth", b"first", b"second"]
+
+
+def test_interrupted_change() -> None:
+    """Test that a change that never finishes doesn't block rendering."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    event_list.items_about_to_be_inserted.emit(0, 1)
+
+    thread = threading.Thread(target=lambda: renderer.render(0, 1))
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_change_before_following_lists() -> None:
+    """Test that changes which began before the lists were followed end up
+    in the track.
+    """
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+
+    def on_items_about_to_be_inserted(_idx: int, _count: int) -> None:
+        """Start following the lists while the insertion is underway.
+
+        :param _idx: where the events are inserted
+        :param _count: how many events are inserted
+        """
+        renderer.set_source(style_list, event_list, meta, (640, 480))
+
+    event_list.items_about_to_be_inserted.connect(
+        on_items_about_to_be_inserted
+    )
+    event_list.insert(0, AssEvent(text="zeroth"))
+    event_list.items_about_to_be_inserted.disconnect(
+        on_items_about_to_be_inserted
+    )
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    assert _get_track_texts(renderer) == [b"zeroth", b"first", b"second"]
+
+
+def test_close() -> None:
+    """Test that closed renderers stop following the lists."""
+    renderer = AssRenderer()
+    style_list, event_list, meta = _make_source()
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    renderer.close()
+    event_list.insert(0, AssEvent(text="zeroth"))
+    assert not renderer._changes  # pylint: disable=protected-access
+    with pytest.raises(ValueError):
+        renderer.render(0, 1)
+
+    renderer.set_source(style_list, event_list, meta, (640, 480))
+    assert _get_track_texts(renderer) == [b"zeroth", b"first", b"second"]
+
+
+def _make_image(
+    mask: np.array, rgba: T.Tuple[int, int, int, int], x: int, y: int
+) -> libass.AssImage:
+    """Create a libass image over given coverage bitmap.
+
+    :param mask: 2D array of uint8 coverage
+    :param rgba: color, with libass alpha (0 = opaque)
+    :param x: left position of the bitmap
+    :param y: top position of the bitmap
+    :return: libass image
+    """
+    height, width = mask.shape
+    stride = width + 3
+    data = np.zeros((height, stride), dtype=np.uint8)
+    data[:, :width] = mask
+    buffer = ctypes.create_string_buffer(data.tobytes(), data.size)
+    red, green, blue, alpha = rgba
+    image = libass.AssImage()
+    image.w = width
+    image.h = height
+    image.stride = stride
+    image.bitmap = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_char))
+    image.color = alpha | (blue << 8) | (green << 16) | (red << 24)
+    image.dst_x = x
+    image.dst_y = y
+    return image
+
+
+def test_composite_opaque() -> None:
+    """Test that opaque images are copied within their bounding boxes."""
+    image_data = np.zeros((6, 8, 4), dtype=np.uint8)
+    mask = np.full((2, 3), 255, dtype=np.uint8)
+    _composite([_make_image(mask, (10, 20, 30, 0), 4, 1)], image_data)
+    assert (image_data[1:3, 4:7] == (10, 20, 30, 255)).all()
+    image_data[1:3, 4:7] = 0
+    assert not image_data.any()
+
+
+def test_composite_transparent() -> None:
+    """Test that fully transparent images leave no trace."""
+    image_data = np.zeros((4, 4, 4), dtype=np.uint8)
+    mask = np.full((2, 2), 255, dtype=np.uint8)
+    _composite([_make_image(mask, (10, 20, 30, 255), 1, 1)], image_data)
+    assert not image_data.any()
+
+
+def test_composite_blending() -> None:
+    """Test that overlapping images are blended with the over operator."""
+    image_data = np.zeros((4, 5, 4), dtype=np.uint8)
+    bottom_mask = np.array([[255, 128, 64], [32, 0, 255]], dtype=np.uint8)
+    top_mask = np.array([[200, 100], [50, 255]], dtype=np.uint8)
+    _composite(
+        [
+            _make_image(bottom_mask, (200, 100, 0, 0), 1, 1),
+            _make_image(top_mask, (0, 50, 250, 128), 2, 2),
+        ],
+        image_data,
+    )
+
+    expected = np.zeros((4, 5, 4))
+    for mask, (red, green, blue, alpha), x, y in (
+        (bottom_mask, (200, 100, 0, 0), 1, 1),
+        (top_mask, (0, 50, 250, 128), 2, 2),
+    ):
+        height, width = mask.shape
+        src_alpha = mask[..., None] / 255 * (1 - alpha / 255)
+        fragment = expected[y : y + height, x : x + width]
+        dst_alpha = fragment[..., 3:]
+        out_alpha = src_alpha + dst_alpha * (1 - src_alpha)
+        fragment[..., :3] = np.divide(
+            np.array((red, green, blue)) * src_alpha
+            + fragment[..., :3] * dst_alpha * (1 - src_alpha),
+            out_alpha,
+            out=np.zeros_like(fragment[..., :3]),
+            where=out_alpha > 0,
+        )
+        fragment[..., 3:] = out_alpha
+    expected[..., 3] *= 255
+
+    assert np.abs(image_data - expected).max() <= 1
@@ -0,0 +1,70 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tests for bubblesub.cache module."""
+
+from pathlib import Path
+
+import pytest
+
+from bubblesub.cache import FINGERPRINT_BLOCK_SIZE, get_file_fingerprint
+
+
+@pytest.mark.parametrize(
+    "size", [0, 1, FINGERPRINT_BLOCK_SIZE, FINGERPRINT_BLOCK_SIZE * 3]
+)
+def test_file_fingerprint_is_stable(tmp_path: Path, size: int) -> None:
+    """Test that fingerprinting the same contents yields the same result.
+
+    :param tmp_path: temporary directory
+    :param size: file size
+    """
+    path1 = tmp_path / "file1"
+    path2 = tmp_path / "file2"
+    path1.write_bytes(b"x" * size)
+    path2.write_bytes(b"x" * size)
+    assert get_file_fingerprint(path1) == get_file_fingerprint(path2)
+
+
+@pytest.mark.parametrize(
+    "offset", [0, FINGERPRINT_BLOCK_SIZE - 1, FINGERPRINT_BLOCK_SIZE * 3 - 1]
+)
+def test_file_fingerprint_detects_changes(tmp_path: Path, offset: int) -> None:
+    """Test that changing the leading or trailing bytes changes the
+    fingerprint.
+
+    :param tmp_path: temporary directory
+    :param offset: offset of the modified byte
+    """
+    path = tmp_path / "file"
+    data = bytearray(b"x" * FINGERPRINT_BLOCK_SIZE * 3)
+    path.write_bytes(data)
+    before = get_file_fingerprint(path)
+    data[offset] = ord("y")
+    path.write_bytes(data)
+    assert get_file_fingerprint(path) != before
+
+
+def test_file_fingerprint_detects_size_changes(tmp_path: Path) -> None:
+    """Test that appending to a file changes the fingerprint.
+
+    :param tmp_path: temporary directory
+    """
+    path = tmp_path / "file"
+    path.write_bytes(b"x" * 10)
+    before = get_file_fingerprint(path)
+    path.write_bytes(b"x" * 11)
+    assert get_file_fingerprint(path) != before
@@ -0,0 +1,148 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tests for bubblesub.ui.audio.audio_preview module."""
+
+import typing as T
+from types import SimpleNamespace
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from bubblesub.ui.audio.audio_preview import (
+    DERIVATION_DISTANCE,
+    MAX_LEVEL,
+    PREVIEW_LEVEL_OFFSET,
+    AudioPreview,
+    AudioPreviewMode,
+)
+
+
+def _create_preview(width: int, view_size: int) -> T.Any:
+    """Create a fake audio preview of audio with one block per millisecond.
+
+    :param width: width of the preview in pixels
+    :param view_size: size of the view in milliseconds
+    :return: fake audio preview
+    """
+    audio_stream = Mock(
+        sample_rate=1000 << DERIVATION_DISTANCE,
+        sample_count=(1 << 30) << DERIVATION_DISTANCE,
+    )
+    preview = SimpleNamespace(
+        _api=Mock(),
+        _view=Mock(view_size=view_size),
+        _mode=AudioPreviewMode.Spectrogram,
+        _spectrum_cache=MagicMock(),
+        _spectrum_workers=[Mock()],
+        width=lambda: width,
+        block_idx_from_x=lambda x: x * view_size // width,
+        repaint_if_needed=Mock(),
+    )
+    preview._api.audio.current_stream = audio_stream
+    preview._spectrum_cache.__contains__.return_value = False
+    preview._get_spectrogram_level = lambda: (
+        AudioPreview._get_spectrogram_level(preview)
+    )
+    return preview
+
+
+@pytest.mark.parametrize(
+    "width,view_size,expected",
+    [
+        (100, 100, 0),
+        (100, 199, 0),
+        (100, 200, 1),
+        (100, 800, 3),
+        (100, 1599, 3),
+        (100, 1600, 4),
+        (200, 1600, 3),
+        (100, 100 << MAX_LEVEL, MAX_LEVEL),
+        (100, 100 << (MAX_LEVEL + 4), MAX_LEVEL),
+        (0, 800, 0),
+    ],
+)
+def test_spectrogram_level(width: int, view_size: int, expected: int) -> None:
+    """Test that the spectrogram level follows the zoom.
+
+    :param width: width of the preview in pixels
+    :param view_size: size of the view in milliseconds
+    :param expected: expected level
+    """
+    preview = _create_preview(width, view_size)
+    assert AudioPreview._get_spectrogram_level(preview) == expected
+
+
+def test_spectrogram_level_without_audio() -> None:
+    """Test that the finest level is used when there's no audio."""
+    preview = _create_preview(100, 800)
+    preview._api.audio.current_stream = None
+    assert AudioPreview._get_spectrogram_level(preview) == 0
+
+
+def test_coarse_pass_scheduled_first() -> None:
+    """Test that the coarse preview pass gets scheduled before the pass
+    matching the zoom, and that neither repeats cached blocks.
+    """
+    preview = _create_preview(100, 800)
+    preview._spectrum_cache.__contains__.side_effect = (
+        lambda block_idx: block_idx == 8
+    )
+    level = 3
+    coarse_level = level + PREVIEW_LEVEL_OFFSET
+
+    AudioPreview._schedule_current_audio_view(preview)
+
+    worker = preview._spectrum_workers[0]
+    tasks = [call[0] for call in worker.schedule_task.call_args_list]
+    priorities = [priority for _chunk, priority in tasks]
+    assert priorities == sorted(priorities)
+
+    coarse_blocks = [
+        block_idx
+        for chunk, (pass_idx, _distance) in tasks
+        if pass_idx == 0
+        for block_idx in chunk
+    ]
+    fine_blocks = [
+        block_idx
+        for chunk, (pass_idx, _distance) in tasks
+        if pass_idx == 1
+        for block_idx in chunk
+    ]
+    assert coarse_blocks == list(range(0, 1601, 1 << coarse_level))
+    assert sorted(coarse_blocks + fine_blocks + [8]) == list(
+        range(0, 1601, 1 << level)
+    )
+
+    # the chunks around the center of the view go first within each pass
+    fine_priorities = [priority for priority in priorities if priority[0] == 1]
+    assert priorities[0] == (0, 0)
+    assert fine_priorities[0] == (1, 0)
+
+
+def test_coarse_pass_at_max_level() -> None:
+    """Test that the coarse pass doesn't go beyond the coarsest level."""
+    preview = _create_preview(1, 1 << MAX_LEVEL)
+
+    AudioPreview._schedule_current_audio_view(preview)
+
+    worker = preview._spectrum_workers[0]
+    tasks = [call[0] for call in worker.schedule_task.call_args_list]
+    assert [chunk for chunk, _priority in tasks] == [
+        [0, 1 << MAX_LEVEL, 2 << MAX_LEVEL]
+    ]
+    assert [priority for _chunk, priority in tasks] == [(0, 0)]
@@ -0,0 +1,131 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tests for bubblesub.ui.audio.spectrum_cache module."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from bubblesub.ui.audio.spectrum_cache import (
+    SpectrumCache,
+    get_tile_block_idxs,
+    get_tile_pos,
+)
+
+MAX_LEVEL = 4
+
+
+@pytest.mark.parametrize("block_idx", [0, 1, 2, 3, 6, 16, 48, 12345, 65536])
+def test_tile_pos(block_idx: int) -> None:
+    """Test that each block maps to a tile column that maps back to it.
+
+    :param block_idx: block index
+    """
+    tile_key, column_idx = get_tile_pos(block_idx, MAX_LEVEL)
+    assert get_tile_block_idxs(tile_key, MAX_LEVEL)[column_idx] == block_idx
+
+
+def test_persistence(tmp_path: Path) -> None:
+    """Test that computed columns are read back after reopening.
+
+    :param tmp_path: temporary directory
+    """
+    block_idxs = [0, 3, 16, 5000]
+    columns = [np.full(8, i, dtype=np.uint8) for i in range(len(block_idxs))]
+
+    cache = SpectrumCache(MAX_LEVEL)
+    cache.open(tmp_path)
+    cache.load(cache.generation, block_idxs)
+    cache.update(cache.generation, block_idxs, columns)
+    cache.open(None)
+    assert not list(cache.keys())
+
+    cache.open(tmp_path)
+    cache.load(cache.generation, [3])
+    assert list(cache.keys()) == [3]
+    cache.load(cache.generation, block_idxs)
+    assert list(cache.keys()) == block_idxs
+    for block_idx, column in zip(block_idxs, columns):
+        assert np.array_equal(cache[block_idx], column)
+
+
+def test_stale_updates_are_ignored(tmp_path: Path) -> None:
+    """Test that columns computed before reopening are discarded.
+
+    :param tmp_path: temporary directory
+    """
+    cache = SpectrumCache(MAX_LEVEL)
+    generation = cache.generation
+    cache.open(tmp_path)
+    cache.update(generation, [1], [np.zeros(8, dtype=np.uint8)])
+    assert 1 not in cache
+
+
+def test_eviction(tmp_path: Path) -> None:
+    """Test that once the budget is used up, least recently used tiles
+    outside of the pinned range are evicted and can be read back.
+
+    :param tmp_path: temporary directory
+    """
+    column = np.zeros(8, dtype=np.uint8)
+    # three tiles of level 0, each holding one column
+    block_idxs = [1, 2049, 4097]
+
+    cache = SpectrumCache(MAX_LEVEL, max_size=2 * column.nbytes)
+    cache.open(tmp_path)
+    cache.pin(4097, 4097)
+    for block_idx in reversed(block_idxs):
+        cache.update(cache.generation, [block_idx], [column])
+    assert list(cache.keys()) == [1, 4097]
+    assert cache.size == 2 * column.nbytes
+
+    cache.load(cache.generation, [2049])
+    assert list(cache.keys()) == [2049, 4097]
+
+
+def test_size_limit() -> None:
+    """Test that the columns never take more memory than allowed, even
+    when the pinned range alone doesn't fit.
+    """
+    column = np.zeros(8, dtype=np.uint8)
+    block_idxs = list(range(1, 2000, 2))
+
+    cache = SpectrumCache(MAX_LEVEL, max_size=100 * column.nbytes)
+    cache.pin(0, 2000)
+    cache.update(cache.generation, block_idxs, [column] * len(block_idxs))
+    assert cache.size == 100 * column.nbytes
+    assert len(list(cache.keys())) <= 100
+    assert block_idxs[-1] in cache
+
+
+def test_gather() -> None:
+    """Test that missing blocks are substituted with the next computed
+    block.
+    """
+    cache = SpectrumCache(MAX_LEVEL)
+    assert cache.gather(np.array([0, 1])) is None
+
+    block_idxs = [2, 5, 9]
+    cache.update(
+        cache.generation,
+        block_idxs,
+        [np.full(4, block_idx, dtype=np.uint8) for block_idx in block_idxs],
+    )
+    columns = cache.gather(np.array([0, 2, 3, 5, 8, 9, 100]))
+    assert columns.shape == (7, 4)
+    assert list(columns[:, 0]) == [2, 2, 5, 5, 9, 9, 9]
@@ -0,0 +1,221 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tests for bubblesub.ui.audio.video_preview module."""
+
+import typing as T
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from bubblesub.ui.audio.video_preview import (
+    BAND_RESOLUTION,
+    VideoBandCache,
+    split_at_keyframes,
+)
+
+
+def _create_stream(path: Path, frame_count: int) -> T.Any:
+    """Create a fake video stream.
+
+    :param path: path to the video file
+    :param frame_count: number of frames
+    :return: fake video stream
+    """
+    path.write_bytes(b"video")
+    return SimpleNamespace(
+        uid=uuid.uuid4(),
+        path=path,
+        timecodes=list(range(frame_count)),
+        scene_index=None,
+        changed=MagicMock(),
+    )
+
+
+@pytest.mark.parametrize(
+    "frame_idxs,keyframes,chunk_size,expected",
+    [
+        ([], [0], 2, []),
+        ([0, 1, 2, 3, 4, 5], [0, 3], 2, [[0, 1, 2], [3, 4, 5]]),
+        ([0, 1, 2, 3, 4, 5], [0, 3], 4, [[0, 1, 2, 3, 4, 5]]),
+        ([0, 1, 2, 3, 4, 5], [0, 2, 4], 1, [[0, 1], [2, 3], [4, 5]]),
+        ([1, 2, 7, 8, 9], [0, 5, 8], 2, [[1, 2], [7, 8, 9]]),
+        ([1, 2, 7, 8, 9], [0, 5, 8], 1, [[1, 2], [7], [8, 9]]),
+        ([0, 1, 2], [], 1, [[0, 1, 2]]),
+    ],
+)
+def test_split_at_keyframes(
+    frame_idxs: T.List[int],
+    keyframes: T.List[int],
+    chunk_size: int,
+    expected: T.List[T.List[int]],
+) -> None:
+    """Test that chunks only start at GOP boundaries.
+
+    :param frame_idxs: frames to split
+    :param keyframes: keyframe numbers
+    :param chunk_size: minimum chunk size
+    :param expected: expected chunks
+    """
+    assert list(split_at_keyframes(frame_idxs, keyframes, chunk_size)) == (
+        expected
+    )
+
+
+def test_video_band_cache_persistence(
+    tmp_path: Path, monkeypatch: T.Any
+) -> None:
+    """Test that only committed frames survive reopening the band.
+
+    :param tmp_path: temporary directory
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    monkeypatch.setattr(
+        "bubblesub.ui.audio.video_preview.get_cache_file_path",
+        lambda name, suffix: tmp_path / (name + suffix),
+    )
+    stream = _create_stream(tmp_path / "video.mkv", 5)
+    frame = np.full((BAND_RESOLUTION, 2, 3), 7, dtype=np.uint8)
+    black_frame = np.zeros((BAND_RESOLUTION, 2, 3), dtype=np.uint8)
+
+    cache = VideoBandCache(MagicMock(), MagicMock(), 2 ** 20)
+    assert cache.load(stream) == [0, 1, 2, 3, 4]
+    assert cache.update(stream, 1, frame)
+    assert cache.update(stream, 3, black_frame)
+    assert cache.update(stream, 4, frame)
+    cache.commit(stream, [1, 3])
+
+    cache = VideoBandCache(MagicMock(), MagicMock(), 2 ** 20)
+    assert cache.load(stream) == [0, 2, 4]
+    band = cache.get(stream.uid)
+    assert np.array_equal(band[1], frame[:, 0])
+    assert np.array_equal(band[3], black_frame[:, 0])
+
+
+def test_video_band_cache_frame_count_change(
+    tmp_path: Path, monkeypatch: T.Any
+) -> None:
+    """Test that bands of a different length are discarded.
+
+    :param tmp_path: temporary directory
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    monkeypatch.setattr(
+        "bubblesub.ui.audio.video_preview.get_cache_file_path",
+        lambda name, suffix: tmp_path / (name + suffix),
+    )
+    stream = _create_stream(tmp_path / "video.mkv", 3)
+    cache = VideoBandCache(MagicMock(), MagicMock(), 2 ** 20)
+    cache.load(stream)
+    cache.commit(stream, [0, 1, 2])
+    assert cache.load(stream) == []
+
+    stream.timecodes = list(range(4))
+    cache = VideoBandCache(MagicMock(), MagicMock(), 2 ** 20)
+    assert cache.load(stream) == [0, 1, 2, 3]
+    assert cache.get(stream.uid).shape == (4, BAND_RESOLUTION, 3)
+
+
+def test_video_band_cache_commit_after_eviction(
+    tmp_path: Path, monkeypatch: T.Any
+) -> None:
+    """Test that evicted bands are not updated.
+
+    :param tmp_path: temporary directory
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    monkeypatch.setattr(
+        "bubblesub.ui.audio.video_preview.get_cache_file_path",
+        lambda name, suffix: tmp_path / (name + suffix),
+    )
+    frame_count = 10
+    stream1 = _create_stream(tmp_path / "video1.mkv", frame_count)
+    stream2 = _create_stream(tmp_path / "video2.mkv", frame_count)
+    video_api = MagicMock()
+    video_api.current_stream = stream2
+    cache = VideoBandCache(
+        MagicMock(), video_api, frame_count * BAND_RESOLUTION * 3
+    )
+    cache.load(stream1)
+    cache.load(stream2)
+    assert cache.get(stream1.uid) is None
+    assert not cache.update(
+        stream1, 0, np.zeros((BAND_RESOLUTION, 1, 3), dtype=np.uint8)
+    )
+    cache.commit(stream1, [0])
+
+
+def test_video_band_cache_size(tmp_path: Path, monkeypatch: T.Any) -> None:
+    """Test that the cache budget covers all the arrays of a band.
+
+    :param tmp_path: temporary directory
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    monkeypatch.setattr(
+        "bubblesub.ui.audio.video_preview.get_cache_file_path",
+        lambda name, suffix: tmp_path / (name + suffix),
+    )
+    frame_count = 10
+    stream1 = _create_stream(tmp_path / "video1.mkv", frame_count)
+    stream2 = _create_stream(tmp_path / "video2.mkv", frame_count)
+    video_api = MagicMock()
+    video_api.current_stream = stream2
+    # enough for the pixels of both bands, but not for their histograms
+    cache = VideoBandCache(
+        MagicMock(), video_api, 2 * frame_count * BAND_RESOLUTION * 3
+    )
+    cache.load(stream1)
+    cache.load(stream2)
+    assert cache.get(stream1.uid) is None
+    assert cache.get(stream2.uid) is not None
+
+
+def test_video_band_cache_scenes(tmp_path: Path, monkeypatch: T.Any) -> None:
+    """Test that cuts are found across separately committed segments.
+
+    :param tmp_path: temporary directory
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    monkeypatch.setattr(
+        "bubblesub.ui.audio.video_preview.get_cache_file_path",
+        lambda name, suffix: tmp_path / (name + suffix),
+    )
+    stream = _create_stream(tmp_path / "video.mkv", 6)
+    dark_frame = np.zeros((BAND_RESOLUTION, 2, 3), dtype=np.uint8)
+    bright_frame = np.full((BAND_RESOLUTION, 2, 3), 255, dtype=np.uint8)
+
+    cache = VideoBandCache(MagicMock(), MagicMock(), 2 ** 20)
+    cache.load(stream)
+    assert stream.scene_index.cuts.tolist() == []
+
+    for frame_idx in (3, 4, 5):
+        cache.update(stream, frame_idx, bright_frame)
+    cache.commit(stream, [3, 4, 5])
+    assert stream.scene_index.cuts.tolist() == []
+
+    for frame_idx in (0, 1, 2):
+        cache.update(stream, frame_idx, dark_frame)
+    cache.commit(stream, [0, 1, 2])
+    assert stream.scene_index.cuts.tolist() == [3]
+    assert stream.changed.emit.called
+
+    cache = VideoBandCache(MagicMock(), MagicMock(), 2 ** 20)
+    assert cache.load(stream) == []
+    assert stream.scene_index.cuts.tolist() == [3]
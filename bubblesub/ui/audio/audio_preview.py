@@ -14,19 +14,24 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import bisect
+import enum
+import math
+import os
 import typing as T
+from pathlib import Path
 
-import ffms2
 import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets
-from sortedcontainers import SortedDict
 
 from bubblesub.api import Api
+from bubblesub.api.audio_peaks import PEAK_MAX, PEAK_MIN, PEAK_RMS
 from bubblesub.api.audio_stream import AudioStream
 from bubblesub.api.threading import QueueWorker
+from bubblesub.api.video_stream import VideoStream
+from bubblesub.cache import get_cache_dir, get_file_fingerprint
 from bubblesub.fmt.ass.event import AssEvent
 from bubblesub.ui.audio.base import SLIDER_SIZE, BaseLocalAudioWidget, DragMode
+from bubblesub.ui.audio.spectrum_cache import SpectrumCache
 from bubblesub.ui.themes import ThemeManager
 from bubblesub.ui.util import blend_colors
 from bubblesub.util import chunks
@@ -41,90 +46,145 @@ DERIVATION_SIZE = 10
 DERIVATION_DISTANCE = 6
 CHUNK_SIZE = 50
 
+# Level N of the spectrogram pyramid consists of every (2^N)th block, so that
+# zoomed out views need to compute only about one block per pixel. Coarser
+# levels are subsets of the finer ones, so computed blocks are reused when
+# zooming in.
+MAX_LEVEL = 16
+# How many levels coarser the quick preview pass is, compared to the level
+# matching the current zoom.
+PREVIEW_LEVEL_OFFSET = 3
+
+
+class AudioPreviewMode(enum.Enum):
+    def __str__(self) -> str:
+        return self.value
+
+    Spectrogram = "spectrogram"
+    Waveform = "waveform"
+
 
 class SpectrumWorkerSignals(QtCore.QObject):
     finished = QtCore.pyqtSignal()
 
 
 class SpectrumWorker(QueueWorker):
-    def __init__(self, api: Api) -> None:
+    def __init__(self, api: Api, cache: SpectrumCache) -> None:
         super().__init__(api.log)
         self.signals = SpectrumWorkerSignals()
         self._api = api
 
-        self.cache: T.Dict[int, T.List[int]] = SortedDict()
+        self.cache = cache
 
         if pyfftw is not None:
             self._input = pyfftw.empty_aligned(
-                2 << DERIVATION_SIZE, dtype=np.float32
+                (CHUNK_SIZE, 2 << DERIVATION_SIZE), dtype=np.float32
             )
             self._output = pyfftw.empty_aligned(
-                (1 << DERIVATION_SIZE) + 1, dtype=np.complex64
+                (CHUNK_SIZE, (1 << DERIVATION_SIZE) + 1), dtype=np.complex64
             )
             self._fftw = pyfftw.FFTW(
-                self._input, self._output, flags=("FFTW_MEASURE",)
+                self._input, self._output, axes=(1,), flags=("FFTW_MEASURE",)
             )
         else:
-            self._input = np.empty(2 << DERIVATION_SIZE, dtype=np.float32)
+            self._input = np.empty(
+                (CHUNK_SIZE, 2 << DERIVATION_SIZE), dtype=np.float32
+            )
             self._output = np.empty(
-                (1 << DERIVATION_SIZE) + 1, dtype=np.complex64
+                (CHUNK_SIZE, (1 << DERIVATION_SIZE) + 1), dtype=np.complex64
             )
             self._fftw = None
 
     def _process_task(self, task: T.Any) -> None:
-        anything_changed = False
-        for block_idx in task:
-            out = self._get_spectrogram_for_block_idx(block_idx)
-            if out is not None:
-                self.cache[block_idx] = out
-                anything_changed = True
+        generation = self.cache.generation
+        block_idxs = list(task)
+
+        self.cache.load(generation, block_idxs)
+        anything_changed = any(
+            block_idx in self.cache for block_idx in block_idxs
+        )
+        block_idxs = [
+            block_idx
+            for block_idx in block_idxs
+            if block_idx not in self.cache
+        ]
+
+        for chunk in chunks(block_idxs, CHUNK_SIZE):
+            if self._is_task_canceled():
+                break
+            out = self._get_spectrogram_for_block_idxs(chunk)
+            if out is None:
+                continue
+            self.cache.update(generation, chunk, out)
+            anything_changed = True
         if anything_changed:
             self.signals.finished.emit()
 
-    def _get_spectrogram_for_block_idx(self, block_idx: int) -> np.array:
+    def _get_spectrogram_for_block_idxs(
+        self, block_idxs: T.List[int]
+    ) -> T.Optional[np.array]:
         audio_stream = self._api.audio.current_stream
         video_stream = self._api.video.current_stream
-        if not audio_stream or not audio_stream.is_ready or self._fftw is None:
+        if not audio_stream or not audio_stream.is_ready:
             return None
 
-        first_sample = block_idx << DERIVATION_DISTANCE
-        sample_count = 2 << DERIVATION_SIZE
-
-        if video_stream and video_stream.timecodes:
-            first_sample -= (
+        first_samples = (
+            np.array(block_idxs, dtype=np.int64) << DERIVATION_DISTANCE
+        )
+        if video_stream and len(video_stream.timecodes):
+            first_samples -= (
                 video_stream.timecodes[0] * audio_stream.sample_rate // 1000
             )
-        if first_sample < 0:
-            first_sample = 0
-
-        samples = audio_stream.get_samples(first_sample, sample_count)
-        samples = np.mean(samples, axis=1)
-        sample_fmt = audio_stream.sample_format
+        first_samples = np.maximum(first_samples, 0)
 
-        if sample_fmt == ffms2.FFMS_FMT_S16:
-            samples /= 32768.0
-        elif sample_fmt == ffms2.FFMS_FMT_S32:
-            samples /= 4_294_967_296.0
-        elif sample_fmt not in (ffms2.FFMS_FMT_FLT, ffms2.FFMS_FMT_DBL):
-            raise RuntimeError(f"unknown sample format: {sample_fmt}")
+        self._read_windows(audio_stream, first_samples)
 
-        self._input[0 : len(samples)] = samples
-
-        out = self._fftw()
+        if self._fftw is not None:
+            out = self._fftw()
+        else:
+            out = np.fft.rfft(self._input, axis=1)
+        out = out[: len(block_idxs)]
 
         scale_factor = 9 / np.sqrt(2 * (2 << DERIVATION_SIZE))
-        out = np.log10(
-            np.sqrt(np.real(out) * np.real(out) + np.imag(out) * np.imag(out))
-            * scale_factor
-            + 1
-        )
+        out = np.log10(np.abs(out) * scale_factor + 1)
 
-        out *= int(255 * self._api.playback.volume / 100)
+        # volume is applied through the color table, so that changing it
+        # doesn't invalidate the cache
+        out *= 255
         out = np.clip(out, 0, 255)
-        out = np.flip(out, axis=0)
+        out = np.flip(out, axis=1)
         out = out.astype(dtype=np.uint8)
         return out
 
+    def _read_windows(
+        self, audio_stream: AudioStream, first_samples: np.array
+    ) -> None:
+        window_size = 2 << DERIVATION_SIZE
+        self._input[:] = 0
+
+        start = int(first_samples.min())
+        span = int(first_samples.max()) - start + window_size
+
+        if span > len(first_samples) * window_size:
+            # the blocks are too sparse for a single read to pay off
+            for i, first_sample in enumerate(first_samples):
+                samples = audio_stream.get_mono_samples(
+                    int(first_sample), window_size
+                )
+                self._input[i, 0 : len(samples)] = samples
+            return
+
+        samples = np.zeros(span, dtype=np.float32)
+        chunk = audio_stream.get_mono_samples(start, span)
+        samples[0 : len(chunk)] = chunk
+        windows = np.lib.stride_tricks.as_strided(
+            samples,
+            shape=(span - window_size + 1, window_size),
+            strides=(samples.strides[0], samples.strides[0]),
+            writeable=False,
+        )
+        self._input[0 : len(first_samples)] = windows[first_samples - start]
+
 
 class SubtitleLabel:
     text_margin = 4
@@ -167,8 +227,11 @@ class AudioPreview(BaseLocalAudioWidget):
         self._mouse_pos: T.Optional[QtCore.QPoint] = None
         self._color_table: T.List[int] = []
         self._pixels: np.array = np.zeros([0, 0], dtype=np.uint8)
+        self._waveform_pixels: np.array = np.zeros([0, 0], dtype=np.uint8)
+        self._waveform_color_table: T.List[int] = []
 
         self._generate_color_table()
+        self._shown_mode = self._mode
 
         self.setMouseTracking(True)
         QtWidgets.QApplication.instance().installEventFilter(self)
@@ -176,6 +239,11 @@ class AudioPreview(BaseLocalAudioWidget):
         api.audio.stream_loaded.connect(self._on_audio_state_change)
         api.audio.stream_unloaded.connect(self._on_audio_state_change)
         api.audio.current_stream_switched.connect(self._on_audio_state_change)
+        api.audio.stream_changed.connect(self.repaint_if_needed)
+        api.cfg.opt.changed.connect(self._on_options_change)
+        api.video.stream_loaded.connect(self._on_video_state_change)
+        api.video.current_stream_switched.connect(self._on_video_state_change)
+        api.video.stream_changed.connect(self.repaint_if_needed)
         api.audio.view.view_changed.connect(self._on_audio_view_change)
 
         api.audio.view.selection_changed.connect(self.repaint_if_needed)
@@ -189,12 +257,40 @@ class AudioPreview(BaseLocalAudioWidget):
         api.playback.volume_changed.connect(self._on_volume_change)
         api.gui.terminated.connect(self.shutdown)
 
-        self._spectrum_worker = SpectrumWorker(self._api)
-        self._api.threading.schedule_runnable(self._spectrum_worker)
-        self._spectrum_worker.signals.finished.connect(self.repaint)
+        self._spectrum_cache = SpectrumCache(
+            MAX_LEVEL, self._api.cfg.opt["audio"]["spectrogram_cache_size"]
+        )
+        self._spectrum_cache_usage = 0
+        self._spectrum_workers: T.List[SpectrumWorker] = []
+        for _ in range(self._get_spectrum_worker_count()):
+            worker = SpectrumWorker(self._api, self._spectrum_cache)
+            self._api.threading.schedule_runnable(worker)
+            worker.signals.finished.connect(self.repaint)
+            worker.signals.finished.connect(self._report_spectrum_cache_size)
+            self._spectrum_workers.append(worker)
 
     def shutdown(self) -> None:
-        self._spectrum_worker.stop()
+        for worker in self._spectrum_workers:
+            worker.stop()
+        self._spectrum_cache.save()
+
+    def _report_spectrum_cache_size(self) -> None:
+        cache = self._spectrum_cache
+        if not cache.max_size:
+            return
+        usage = cache.size * 10 // cache.max_size
+        if usage != self._spectrum_cache_usage:
+            self._spectrum_cache_usage = usage
+            self._api.log.debug(
+                f"spectrogram cache: {cache.size / 2 ** 20:.1f} MiB "
+                f"of {cache.max_size / 2 ** 20:.1f} MiB used"
+            )
+
+    def _get_spectrum_worker_count(self) -> int:
+        count = self._api.cfg.opt["audio"]["spectrogram_workers"]
+        if not count:
+            count = os.cpu_count() or 1
+        return max(1, count)
 
     def _get_paint_cache_key(self) -> int:
         with self._api.video.stream_lock:
@@ -211,6 +307,13 @@ class AudioPreview(BaseLocalAudioWidget):
                         if self._api.video.current_stream
                         else None
                     ),
+                    # scene changes
+                    (
+                        len(self._api.video.current_stream.scene_index.cuts)
+                        if self._api.video.current_stream
+                        and self._api.video.current_stream.scene_index
+                        else None
+                    ),
                     # audio view
                     self._api.audio.view.view_start,
                     self._api.audio.view.view_end,
@@ -221,6 +324,13 @@ class AudioPreview(BaseLocalAudioWidget):
                     self._api.playback.current_pts,
                     # volume
                     self._api.playback.volume,
+                    # display mode
+                    self._mode,
+                    (
+                        self._api.audio.current_stream.peaks is not None
+                        if self._api.audio.current_stream
+                        else None
+                    ),
                 )
             )
 
@@ -245,11 +355,15 @@ class AudioPreview(BaseLocalAudioWidget):
         painter = QtGui.QPainter()
         painter.begin(self)
 
-        self._draw_spectrogram(painter)
+        if self._mode == AudioPreviewMode.Waveform:
+            self._draw_waveform(painter)
+        else:
+            self._draw_spectrogram(painter)
         self._draw_subtitle_rects(painter)
         self._draw_selection(painter)
         self._draw_frame(painter, bottom_line=False)
         self._draw_keyframes(painter)
+        self._draw_scene_changes(painter)
         self._draw_video_pos(painter)
         self._draw_mouse(painter)
 
@@ -302,7 +416,16 @@ class AudioPreview(BaseLocalAudioWidget):
         super().mouseMoveEvent(event)
 
     def _generate_color_table(self) -> None:
+        volume = float(self._api.playback.volume) / 100
         self._color_table = [
+            blend_colors(
+                self.palette().window().color(),
+                self.palette().text().color(),
+                min(255, int(i * volume)) / 255,
+            )
+            for i in range(256)
+        ]
+        self._waveform_color_table = [
             blend_colors(
                 self.palette().window().color(),
                 self.palette().text().color(),
@@ -315,48 +438,147 @@ class AudioPreview(BaseLocalAudioWidget):
         )
 
     def _on_volume_change(self) -> None:
-        self._spectrum_worker.cache.clear()
-        self._schedule_current_audio_view()
+        self._generate_color_table()
+        self.repaint_if_needed()
 
     def _on_audio_view_change(self) -> None:
         self._schedule_current_audio_view()
 
+    def _on_options_change(self) -> None:
+        # the options only tell that any of them changed, while rescheduling
+        # throws away the spectrum computed so far
+        if self._mode != self._shown_mode:
+            self._shown_mode = self._mode
+            self._schedule_current_audio_view()
+
+    @property
+    def _mode(self) -> AudioPreviewMode:
+        return AudioPreviewMode(self._api.cfg.opt["audio"]["preview_mode"])
+
     def _schedule_current_audio_view(self) -> None:
         audio_stream = self._api.audio.current_stream
         if not audio_stream:
             return
 
         self.repaint_if_needed()
-        self._spectrum_worker.clear_tasks()
+        for worker in self._spectrum_workers:
+            worker.clear_tasks()
 
-        max_block_idx = audio_stream.sample_count >> DERIVATION_DISTANCE
+        if self._mode == AudioPreviewMode.Waveform:
+            audio_stream.request_peaks()
+            return
 
-        blocks_to_update = set()
-        for x in range(self.width() * 2):
-            block_idx = self.block_idx_from_x(x)
-            if block_idx < 0 or (max_block_idx and block_idx >= max_block_idx):
-                continue
-            if block_idx not in self._spectrum_worker.cache:
-                blocks_to_update.add(block_idx)
+        min_block_idx = max(0, self.block_idx_from_x(0))
+        max_block_idx = self.block_idx_from_x(self.width() * 2)
+        if audio_stream.sample_count:
+            max_block_idx = min(
+                max_block_idx,
+                (audio_stream.sample_count >> DERIVATION_DISTANCE) - 1,
+            )
+
+        # keep the visible blocks and their neighbourhood in memory
+        self._spectrum_cache.pin(
+            2 * min_block_idx - max_block_idx,
+            2 * max_block_idx - min_block_idx,
+        )
+
+        # schedule a sparse preview first, so that the view gets filled in
+        # quickly, then refine it to the level matching the zoom; within each
+        # pass, blocks closest to the center of the view go first
+        center_block_idx = self.block_idx_from_x(self.width() // 2)
+        level = self._get_spectrogram_level()
+        scheduled: T.Set[int] = set()
+        tasks: T.List[T.Tuple[T.Tuple[int, int], T.List[int]]] = []
+        for pass_idx, pass_level in enumerate(
+            (min(MAX_LEVEL, level + PREVIEW_LEVEL_OFFSET), level)
+        ):
+            blocks_to_update = [
+                block_idx
+                for block_idx in range(
+                    (min_block_idx >> pass_level) << pass_level,
+                    max_block_idx + 1,
+                    1 << pass_level,
+                )
+                if block_idx not in self._spectrum_cache
+                and block_idx not in scheduled
+            ]
+            scheduled.update(blocks_to_update)
+
+            for chunk in chunks(blocks_to_update, CHUNK_SIZE):
+                if chunk[0] <= center_block_idx <= chunk[-1]:
+                    distance = 0
+                else:
+                    distance = min(
+                        abs(chunk[0] - center_block_idx),
+                        abs(chunk[-1] - center_block_idx),
+                    )
+                tasks.append(((pass_idx, distance), chunk))
 
-        for chunk in chunks(list(sorted(blocks_to_update)), CHUNK_SIZE):
-            self._spectrum_worker.schedule_task(reversed(chunk))
+        # spread the chunks evenly between the workers
+        tasks.sort(key=lambda task: task[0])
+        for i, (priority, chunk) in enumerate(tasks):
+            worker = self._spectrum_workers[i % len(self._spectrum_workers)]
+            worker.schedule_task(chunk, priority)
+
+    def _get_spectrogram_level(self) -> int:
+        audio_stream = self._api.audio.current_stream
+        if not audio_stream or not self.width():
+            return 0
+        blocks_per_pixel = (
+            self._view.view_size
+            * audio_stream.sample_rate
+            / 1000.0
+            / (1 << DERIVATION_DISTANCE)
+            / self.width()
+        )
+        if blocks_per_pixel < 2:
+            return 0
+        return min(MAX_LEVEL, int(math.log2(blocks_per_pixel)))
 
     def _on_audio_state_change(self, stream: AudioStream) -> None:
-        self._spectrum_worker.cache.clear()
+        self._open_spectrum_cache()
         self._schedule_current_audio_view()
 
-    def _draw_spectrogram(self, painter: QtGui.QPainter) -> None:
-        pixels = self._pixels.transpose()
-        zero_column = np.zeros([pixels.shape[1]], dtype=np.uint8)
+    def _on_video_state_change(self, stream: VideoStream) -> None:
+        # the first timecode shifts the spectrogram blocks
+        self._open_spectrum_cache()
+        self._schedule_current_audio_view()
+
+    def _open_spectrum_cache(self) -> None:
+        path = self._get_spectrum_cache_path()
+        if path is None or path != self._spectrum_cache.path:
+            self._spectrum_cache.open(path)
+
+    def _get_spectrum_cache_path(self) -> T.Optional[Path]:
         audio_stream = self._api.audio.current_stream
+        video_stream = self._api.video.current_stream
+        if not audio_stream or not audio_stream.is_ready:
+            return None
+
+        try:
+            fingerprint = get_file_fingerprint(audio_stream.path)
+        except OSError:
+            return None
 
-        cached_blocks = (
-            list(self._spectrum_worker.cache.keys())
-            if self._spectrum_worker
-            else []
+        sample_offset = 0
+        if video_stream and len(video_stream.timecodes):
+            sample_offset = (
+                video_stream.timecodes[0] * audio_stream.sample_rate // 1000
+            )
+
+        return (
+            get_cache_dir()
+            / "spectrogram"
+            / (
+                f"{fingerprint}-{DERIVATION_SIZE}-{DERIVATION_DISTANCE}"
+                f"-{sample_offset}"
+            )
         )
 
+    def _draw_spectrogram(self, painter: QtGui.QPainter) -> None:
+        pixels = self._pixels.transpose()
+        audio_stream = self._api.audio.current_stream
+
         min_pts = self.pts_from_x(0)
         max_pts = self.pts_from_x(self.width() - 1)
         if audio_stream:
@@ -370,19 +592,15 @@ class AudioPreview(BaseLocalAudioWidget):
             / 1000.0
         ).astype(dtype=np.int) // (2 ** DERIVATION_DISTANCE)
 
-        for x, block_idx in enumerate(block_idx_range):
-            column = zero_column
-
-            column = self._spectrum_worker.cache.get(block_idx, zero_column)
+        # snap the columns to the pyramid level matching the zoom
+        level = self._get_spectrogram_level()
+        block_idx_range = (block_idx_range >> level) << level
 
-            if cached_blocks and column is zero_column:
-                tmp = bisect.bisect_left(cached_blocks, block_idx)
-                if tmp == len(cached_blocks):
-                    tmp -= 1
-                nearest_block_idx = cached_blocks[tmp]
-                column = self._spectrum_worker.cache[nearest_block_idx]
-
-            pixels[x] = column
+        columns = self._spectrum_cache.gather(block_idx_range)
+        if columns is None:
+            pixels[:] = 0
+        else:
+            pixels[:] = columns
 
         image = QtGui.QImage(
             self._pixels.data,
@@ -397,6 +615,60 @@ class AudioPreview(BaseLocalAudioWidget):
         painter.drawPixmap(0, 0, QtGui.QPixmap.fromImage(image))
         painter.restore()
 
+    def _draw_waveform(self, painter: QtGui.QPainter) -> None:
+        width = self.width()
+        height = painter.viewport().height()
+        if self._waveform_pixels.shape != (height, width):
+            self._waveform_pixels = np.zeros([height, width], dtype=np.uint8)
+        pixels = self._waveform_pixels
+        pixels[:] = 0
+
+        audio_stream = self._api.audio.current_stream
+        video_stream = self._api.video.current_stream
+        peaks = audio_stream.peaks if audio_stream else None
+        if audio_stream and peaks and width and height:
+            sample_offset = 0
+            if video_stream and len(video_stream.timecodes):
+                sample_offset = (
+                    video_stream.timecodes[0]
+                    * audio_stream.sample_rate
+                    // 1000
+                )
+            start_frame, end_frame = (
+                int(
+                    (self.pts_from_x(x) - audio_stream.delay)
+                    * audio_stream.sample_rate
+                    / 1000.0
+                )
+                - sample_offset
+                for x in (0, width)
+            )
+            values = peaks.get(start_frame, end_frame, width)
+            values = np.clip(
+                values * float(self._api.playback.volume) / 100, -1, 1
+            )
+
+            center = (height - 1) / 2
+            y = np.arange(height)[:, np.newaxis]
+            pixels[
+                (y >= np.floor(center - values[:, PEAK_MAX] * center))
+                & (y <= np.ceil(center - values[:, PEAK_MIN] * center))
+            ] = 128
+            pixels[
+                (y >= np.floor(center - values[:, PEAK_RMS] * center))
+                & (y <= np.ceil(center + values[:, PEAK_RMS] * center))
+            ] = 255
+
+        image = QtGui.QImage(
+            pixels.data,
+            pixels.shape[1],
+            pixels.shape[0],
+            pixels.strides[0],
+            QtGui.QImage.Format_Indexed8,
+        )
+        image.setColorTable(self._waveform_color_table)
+        painter.drawPixmap(0, 0, QtGui.QPixmap.fromImage(image))
+
     def block_idx_from_x(self, x: int) -> int:
         audio_stream = self._api.audio.current_stream
         pts = self.pts_from_x(x)
@@ -411,11 +683,33 @@ class AudioPreview(BaseLocalAudioWidget):
         color = self._theme_mgr.get_color("spectrogram/keyframe")
         painter.setPen(QtGui.QPen(color, 1, QtCore.Qt.SolidLine))
         if self._api.video.current_stream:
-            for keyframe in self._api.video.current_stream.keyframes:
-                timecode = self._api.video.current_stream.timecodes[keyframe]
+            timecodes = self._api.video.current_stream.keyframe_timecodes
+            # only the keyframes within the view
+            start, end = np.searchsorted(
+                timecodes,
+                [self._view.view_start, self._view.view_end],
+            )
+            for timecode in timecodes[start:end]:
                 x = round(self.pts_to_x(timecode))
                 painter.drawLine(x, 0, x, h)
 
+    def _draw_scene_changes(self, painter: QtGui.QPainter) -> None:
+        current_stream = self._api.video.current_stream
+        if not current_stream or not current_stream.scene_index:
+            return
+        h = painter.viewport().height()
+        color = self._theme_mgr.get_color("spectrogram/scene-change")
+        painter.setPen(QtGui.QPen(color, 1, QtCore.Qt.DashLine))
+        cut_pts = current_stream.scene_index.cut_pts
+        # only the cuts within the view
+        start, end = np.searchsorted(
+            cut_pts,
+            [self._view.view_start, self._view.view_end],
+        )
+        for pts in cut_pts[start:end]:
+            x = round(self.pts_to_x(pts))
+            painter.drawLine(x, 0, x, h)
+
     def _draw_subtitle_rects(self, painter: QtGui.QPainter) -> None:
         self._labels[:] = []
 
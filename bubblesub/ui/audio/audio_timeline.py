@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 from bubblesub.api import Api
@@ -120,8 +121,13 @@ class AudioTimeline(BaseLocalAudioWidget):
         color = self._theme_mgr.get_color("spectrogram/keyframe")
         painter.setPen(QtGui.QPen(color, 1, QtCore.Qt.SolidLine))
         if self._api.video.current_stream:
-            for keyframe in self._api.video.current_stream.keyframes:
-                timecode = self._api.video.current_stream.timecodes[keyframe]
+            timecodes = self._api.video.current_stream.keyframe_timecodes
+            # only the keyframes within the view
+            start, end = np.searchsorted(
+                timecodes,
+                [self._view.view_start, self._view.view_end],
+            )
+            for timecode in timecodes[start:end]:
                 x = round(self.pts_to_x(timecode))
                 painter.drawLine(x, 0, x, h)
 
@@ -0,0 +1,419 @@
+# bubblesub - ASS subtitle editor
+# Copyright (C) 2018 Marcin Kurczewski
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import os
+import threading
+import typing as T
+import uuid
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+TILE_SIZE = 1024
+INITIAL_CAPACITY = 1024
+
+# (pyramid level, tile index)
+TileKey = T.Tuple[int, int]
+
+
+def get_block_level(block_idx: int, max_level: int) -> int:
+    """Return the coarsest pyramid level that contains given block.
+
+    :param block_idx: block index
+    :param max_level: coarsest pyramid level
+    :return: pyramid level
+    """
+    if not block_idx:
+        return max_level
+    return min(max_level, (block_idx & -block_idx).bit_length() - 1)
+
+
+def get_tile_pos(block_idx: int, max_level: int) -> T.Tuple[TileKey, int]:
+    """Locate given block within the tile grid.
+
+    Each tile stores consecutive blocks of exactly one pyramid level (blocks
+    that belong to a coarser level are stored only there), so that zoomed out
+    views need to read only the tiles of the coarse levels.
+
+    :param block_idx: block index
+    :param max_level: coarsest pyramid level
+    :return: tile key and the column within that tile
+    """
+    level = get_block_level(block_idx, max_level)
+    pos = block_idx >> (level if level == max_level else level + 1)
+    tile_idx, column_idx = divmod(pos, TILE_SIZE)
+    return (level, tile_idx), column_idx
+
+
+def get_tile_block_idxs(tile_key: TileKey, max_level: int) -> np.array:
+    """Return block indexes of each column of given tile.
+
+    :param tile_key: tile key
+    :param max_level: coarsest pyramid level
+    :return: 1D array of block indexes
+    """
+    level, tile_idx = tile_key
+    pos = np.arange(
+        tile_idx * TILE_SIZE, (tile_idx + 1) * TILE_SIZE, dtype=np.int64
+    )
+    if level == max_level:
+        return pos << level
+    return ((pos << 1) + 1) << level
+
+
+class SpectrumCache:
+    """Spectrogram columns keyed by block index.
+
+    Computed columns are persisted as compressed tiles in given directory and
+    are read back tile by tile as blocks are requested.
+
+    Columns live in one dense array, so that they can be gathered for
+    display with a single fancy indexing operation. The array grows up to
+    the memory budget; once it's full, the least recently used tiles outside
+    of the pinned block range are dropped from memory to make room for new
+    columns.
+    """
+
+    def __init__(self, max_level: int, max_size: int = 0) -> None:
+        self.lock = threading.RLock()
+        self.max_size = max_size
+        self._max_level = max_level
+        self._slab: T.Optional[np.array] = None
+        self._slots: T.Dict[int, int] = {}
+        self._free_slots: T.List[int] = []
+        self._used_slots = 0
+        # sorted block indexes and their slots, for gathering
+        self._keys = np.empty(0, dtype=np.int64)
+        self._key_slots = np.empty(0, dtype=np.int64)
+        self._path: T.Optional[Path] = None
+        self._generation = 0
+        self._loaded_tiles: T.Set[TileKey] = set()
+        self._dirty_tiles: T.Set[TileKey] = set()
+        self._tile_sizes: T.Dict[TileKey, int] = collections.OrderedDict()
+        self._pinned_range = (0, -1)
+
+    @property
+    def path(self) -> T.Optional[Path]:
+        return self._path
+
+    @property
+    def size(self) -> int:
+        """Return how much memory the cached columns take, including the
+        room reserved for more columns.
+
+        :return: size in bytes
+        """
+        return self._slab.nbytes if self._slab is not None else 0
+
+    @property
+    def generation(self) -> int:
+        """Return a number that changes whenever the cache is reset.
+
+        Workers pass it back to updates, so that results computed for the
+        previous audio source are discarded.
+
+        :return: generation number
+        """
+        return self._generation
+
+    def __contains__(self, block_idx: int) -> bool:
+        return block_idx in self._slots
+
+    def __getitem__(self, block_idx: int) -> np.array:
+        assert self._slab is not None
+        return self._slab[self._slots[block_idx]]
+
+    def get(
+        self, block_idx: int, default: T.Optional[np.array] = None
+    ) -> T.Optional[np.array]:
+        if block_idx not in self._slots:
+            return default
+        return self[block_idx]
+
+    def keys(self) -> T.Iterable[int]:
+        return self._keys
+
+    def gather(self, block_idxs: np.array) -> T.Optional[np.array]:
+        """Return columns of given blocks.
+
+        Blocks that weren't computed yet are substituted with the closest
+        following computed block, or the last one if there is none.
+
+        :param block_idxs: 1D array of block indexes
+        :return: 2D array with one column per row, or None if the cache is
+            empty
+        """
+        with self.lock:
+            if not len(self._keys):
+                return None
+            assert self._slab is not None
+            pos = np.minimum(
+                np.searchsorted(self._keys, block_idxs), len(self._keys) - 1
+            )
+            return self._slab[self._key_slots[pos]]
+
+    def open(self, path: T.Optional[Path]) -> None:
+        """Persist pending tiles and switch to another tile directory.
+
+        :param path: tile directory, or None to keep the columns in memory
+            only
+        """
+        with self.lock:
+            self.save()
+            self._path = path
+            self._generation += 1
+            self._slab = None
+            self._slots.clear()
+            self._free_slots.clear()
+            self._used_slots = 0
+            self._keys = np.empty(0, dtype=np.int64)
+            self._key_slots = np.empty(0, dtype=np.int64)
+            self._loaded_tiles.clear()
+            self._dirty_tiles.clear()
+            self._tile_sizes.clear()
+
+    def pin(self, min_block_idx: int, max_block_idx: int) -> None:
+        """Protect tiles overlapping given block range from eviction.
+
+        :param min_block_idx: first block index
+        :param max_block_idx: last block index
+        """
+        with self.lock:
+            self._pinned_range = (min_block_idx, max_block_idx)
+
+    def update(
+        self,
+        generation: int,
+        block_idxs: T.Iterable[int],
+        columns: T.Iterable[np.array],
+    ) -> None:
+        """Store computed columns.
+
+        :param generation: cache generation the columns were computed for
+        :param block_idxs: block indexes
+        :param columns: spectrogram column of each block
+        """
+        with self.lock:
+            if generation != self._generation:
+                return
+            new_block_idxs = []
+            for block_idx, column in zip(block_idxs, columns):
+                tile_key = get_tile_pos(block_idx, self._max_level)[0]
+                if block_idx not in self._slots:
+                    self._slots[block_idx] = self._allocate_slot(
+                        tile_key, column
+                    )
+                    self._add_size(tile_key, column.nbytes)
+                    new_block_idxs.append(block_idx)
+                self[block_idx][:] = column
+                self._touch(tile_key)
+                self._dirty_tiles.add(tile_key)
+            self._index(new_block_idxs)
+
+    def load(self, generation: int, block_idxs: T.Iterable[int]) -> None:
+        """Read the persisted tiles containing given blocks, unless they are
+        already in memory.
+
+        :param generation: cache generation the blocks are requested for
+        :param block_idxs: block indexes
+        """
+        with self.lock:
+            path = self._path
+            if path is None or generation != self._generation:
+                return
+            tile_keys = {
+                get_tile_pos(block_idx, self._max_level)[0]
+                for block_idx in block_idxs
+            } - self._loaded_tiles
+            self._loaded_tiles.update(tile_keys)
+
+        for tile_key in sorted(tile_keys):
+            tile = self._read_tile(path, tile_key)
+            if tile is None:
+                continue
+            mask, columns = tile
+            block_idxs = get_tile_block_idxs(tile_key, self._max_level)[mask]
+            with self.lock:
+                if generation != self._generation:
+                    return
+                new_block_idxs = []
+                for block_idx, column in zip(block_idxs.tolist(), columns):
+                    if block_idx not in self._slots:
+                        self._slots[block_idx] = self._allocate_slot(
+                            tile_key, column
+                        )
+                        self[block_idx][:] = column
+                        self._add_size(tile_key, column.nbytes)
+                        new_block_idxs.append(block_idx)
+                self._index(new_block_idxs)
+                self._touch(tile_key)
+
+    def _evict_lru_tile(self, keep_tile_key: TileKey) -> None:
+        # prefer tiles that aren't on the screen, and the tile that is being
+        # filled in over nothing
+        min_block_idx, max_block_idx = self._pinned_range
+        tile_keys = [
+            tile_key
+            for tile_key in self._tile_sizes.keys()
+            if tile_key != keep_tile_key
+        ] or list(self._tile_sizes.keys())
+        for tile_key in tile_keys:
+            block_idxs = get_tile_block_idxs(tile_key, self._max_level)
+            if block_idxs[0] > max_block_idx or block_idxs[-1] < min_block_idx:
+                break
+        else:
+            tile_key = tile_keys[0]
+            block_idxs = get_tile_block_idxs(tile_key, self._max_level)
+        self._evict_tile(tile_key, block_idxs)
+
+    def _evict_tile(self, tile_key: TileKey, block_idxs: np.array) -> None:
+        # evicted tiles are persisted first, if they changed
+        if tile_key in self._dirty_tiles and self._path is not None:
+            mask, columns = self._collect_tile(tile_key)
+            self._write_tile(self._path, tile_key, mask, columns)
+        self._dirty_tiles.discard(tile_key)
+        self._loaded_tiles.discard(tile_key)
+        evicted_block_idxs = []
+        for block_idx in block_idxs.tolist():
+            slot = self._slots.pop(block_idx, None)
+            if slot is not None:
+                self._free_slots.append(slot)
+                evicted_block_idxs.append(block_idx)
+        keep = np.isin(self._keys, evicted_block_idxs, invert=True)
+        self._keys = self._keys[keep]
+        self._key_slots = self._key_slots[keep]
+        del self._tile_sizes[tile_key]
+
+    def _allocate_slot(self, tile_key: TileKey, column: np.array) -> int:
+        if self._free_slots:
+            return self._free_slots.pop()
+        max_slots = (
+            max(1, self.max_size // column.nbytes) if self.max_size else None
+        )
+        if self._slab is None:
+            self._slab = np.zeros(
+                (
+                    min(INITIAL_CAPACITY, max_slots or INITIAL_CAPACITY),
+                    len(column),
+                ),
+                dtype=np.uint8,
+            )
+        elif self._used_slots == len(self._slab):
+            if max_slots is not None and len(self._slab) >= max_slots:
+                self._evict_lru_tile(tile_key)
+                return self._free_slots.pop()
+            grow_by = len(self._slab)
+            if max_slots is not None:
+                grow_by = min(grow_by, max_slots - len(self._slab))
+            self._slab = np.concatenate(
+                (
+                    self._slab,
+                    np.zeros((grow_by, len(column)), dtype=np.uint8),
+                )
+            )
+        self._used_slots += 1
+        return self._used_slots - 1
+
+    def _index(self, block_idxs: T.List[int]) -> None:
+        # the blocks might have been evicted right away to make room for
+        # the ones that followed them
+        block_idxs = [
+            block_idx for block_idx in block_idxs if block_idx in self._slots
+        ]
+        if not block_idxs:
+            return
+        keys = np.array(sorted(block_idxs), dtype=np.int64)
+        slots = np.array(
+            [self._slots[block_idx] for block_idx in keys.tolist()],
+            dtype=np.int64,
+        )
+        pos = np.searchsorted(self._keys, keys)
+        self._keys = np.insert(self._keys, pos, keys)
+        self._key_slots = np.insert(self._key_slots, pos, slots)
+
+    def _add_size(self, tile_key: TileKey, size: int) -> None:
+        self._tile_sizes[tile_key] = self._tile_sizes.get(tile_key, 0) + size
+
+    def _touch(self, tile_key: TileKey) -> None:
+        if tile_key in self._tile_sizes:
+            self._tile_sizes[tile_key] = self._tile_sizes.pop(tile_key)
+
+    def save(self) -> None:
+        """Persist tiles that have changed since they were last saved."""
+        with self.lock:
+            path = self._path
+            tiles = {
+                tile_key: self._collect_tile(tile_key)
+                for tile_key in self._dirty_tiles
+            }
+            self._dirty_tiles.clear()
+        if path is None:
+            return
+        for tile_key, (mask, columns) in tiles.items():
+            self._write_tile(path, tile_key, mask, columns)
+
+    def _collect_tile(self, tile_key: TileKey) -> T.Tuple[np.array, np.array]:
+        block_idxs = get_tile_block_idxs(tile_key, self._max_level)
+        slots = [
+            self._slots.get(block_idx) for block_idx in block_idxs.tolist()
+        ]
+        mask = np.array([slot is not None for slot in slots], dtype=np.bool_)
+        if self._slab is None:
+            return mask, np.empty((0, 0), dtype=np.uint8)
+        return mask, self._slab[[slot for slot in slots if slot is not None]]
+
+    def _get_tile_path(self, path: Path, tile_key: TileKey) -> Path:
+        level, tile_idx = tile_key
+        return path / f"{level}-{tile_idx}.npz"
+
+    def _read_tile(
+        self, path: Path, tile_key: TileKey
+    ) -> T.Optional[T.Tuple[np.array, np.array]]:
+        tile_path = self._get_tile_path(path, tile_key)
+        try:
+            with np.load(str(tile_path)) as tile:
+                mask = tile["mask"]
+                columns = tile["columns"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # corrupt tile; it will be recomputed and overwritten
+            return None
+        if mask.shape != (TILE_SIZE,) or len(columns) != np.count_nonzero(
+            mask
+        ):
+            return None
+        return mask, columns
+
+    def _write_tile(
+        self,
+        path: Path,
+        tile_key: TileKey,
+        mask: np.array,
+        columns: np.array,
+    ) -> None:
+        tile_path = self._get_tile_path(path, tile_key)
+        tmp_path = tile_path.with_name(tile_path.name + f".{uuid.uuid4()}")
+        try:
+            path.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open("wb") as handle:
+                np.savez_compressed(handle, mask=mask, columns=columns)
+            os.replace(str(tmp_path), str(tile_path))
+        except OSError:
+            if tmp_path.exists():
+                tmp_path.unlink()
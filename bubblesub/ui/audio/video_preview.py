@@ -14,57 +14,209 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
+import collections
+import os
 import threading
 import typing as T
 import uuid
 
 import numpy as np
+from dataclasses import astuple, dataclass
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 from bubblesub.api import Api
 from bubblesub.api.log import LogApi
 from bubblesub.api.threading import QueueWorker
 from bubblesub.api.video import VideoApi
+from bubblesub.api.video_scenes import (
+    SCENE_HISTOGRAM_BINS,
+    SceneIndex,
+    compute_histogram,
+    compute_scores,
+)
 from bubblesub.api.video_stream import VideoStream
-from bubblesub.cache import load_cache, save_cache
+from bubblesub.cache import get_cache_file_path
 from bubblesub.ui.audio.base import BaseLocalAudioWidget
-from bubblesub.util import chunks, sanitize_file_name
+from bubblesub.util import sanitize_file_name
 
-_CACHE_LOCK = threading.Lock()
 BAND_RESOLUTION = 30
 CHUNK_SIZE = 500
+BAND_CACHE_SUFFIX = ".npy"
+# frames are sampled a bit wider than the band, so that the scene change
+# scores see more than a single column of pixels
+SCENE_SAMPLE_WIDTH = 8
 VIDEO_BAND_SIZE = 10
 
 
-class VideoBandWorkerSignals(QtCore.QObject):
-    cache_updated = QtCore.pyqtSignal()
-
-
-class VideoBandWorker(QueueWorker):
-    def __init__(self, log_api: LogApi, video_api: VideoApi) -> None:
-        super().__init__(log_api)
-        self.signals = VideoBandWorkerSignals()
+def split_at_keyframes(
+    frame_idxs: T.List[int], keyframes: T.List[int], chunk_size: int
+) -> T.Iterable[T.List[int]]:
+    """Split sorted frame numbers into chunks of roughly given size that
+    begin at keyframes, so that each GOP is decoded within a single chunk.
+
+    :param frame_idxs: sorted frame numbers
+    :param keyframes: sorted keyframe numbers
+    :param chunk_size: minimum chunk size, unless frames run out
+    :return: chunks
+    """
+    chunk: T.List[int] = []
+    gop_idx = -1
+    for frame_idx in frame_idxs:
+        prev_gop_idx = gop_idx
+        gop_idx = bisect.bisect_right(keyframes, frame_idx)
+        if len(chunk) >= chunk_size and gop_idx != prev_gop_idx:
+            yield chunk
+            chunk = []
+        chunk.append(frame_idx)
+    if chunk:
+        yield chunk
+
+
+@dataclass
+class _VideoBand:
+    pixels: np.array
+    histograms: np.array
+    scores: np.array
+    done: np.array
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in astuple(self))
+
+
+class VideoBandCache:
+    """Video bands of the loaded streams, shared by the band workers."""
+
+    def __init__(
+        self, log_api: LogApi, video_api: VideoApi, max_size: int
+    ) -> None:
+        self.lock = threading.Lock()
+        self._log_api = log_api
         self._video_api = video_api
+        self._max_size = max_size
+        self._bands: T.Dict[uuid.UUID, _VideoBand] = collections.OrderedDict()
+
+    def get(self, uid: uuid.UUID) -> T.Optional[np.array]:
+        band = self._bands.get(uid)
+        return band.pixels if band else None
+
+    def load(self, stream: VideoStream) -> T.List[int]:
+        with self.lock:
+            band = self._open(stream)
+            self._bands[stream.uid] = band
+            self._evict()
+        stream.scene_index = SceneIndex(band.scores, stream.timecodes)
+        return np.flatnonzero(~band.done).tolist()
+
+    def touch(self, stream: VideoStream) -> bool:
+        with self.lock:
+            band = self._bands.pop(stream.uid, None)
+            if band is None:
+                return False
+            self._bands[stream.uid] = band
+            return True
+
+    def update(
+        self, stream: VideoStream, frame_idx: int, frame: np.array
+    ) -> bool:
+        with self.lock:
+            band = self._bands.get(stream.uid)
+            if band is None:
+                # evicted in the meantime
+                return False
+            band.pixels[frame_idx] = frame.mean(axis=1)
+            band.histograms[frame_idx] = compute_histogram(frame)
+            return True
+
+    def commit(self, stream: VideoStream, frame_idxs: T.List[int]) -> None:
+        with self.lock:
+            band = self._bands.get(stream.uid)
+            if band is None:
+                return
+            # write the frames out before marking them as done, so that
+            # only the touched pages are written and an interrupted write
+            # doesn't leave bogus frames behind
+            for array in (band.pixels, band.histograms):
+                if isinstance(array, np.memmap):
+                    array.flush()
+            band.done[frame_idxs] = True
+            if isinstance(band.done, np.memmap):
+                band.done.flush()
+
+            # score the new frames and the frames that follow them, as long
+            # as their predecessors are known
+            idxs = np.asarray(frame_idxs, dtype=np.int64)
+            idxs = np.unique(np.concatenate((idxs, idxs + 1)))
+            idxs = idxs[(idxs > 0) & (idxs < len(band.done))]
+            idxs = idxs[band.done[idxs] & band.done[idxs - 1]]
+            scene_index = stream.scene_index
+            if scene_index is None or scene_index.scores is not band.scores:
+                return
+            scene_index.update(
+                idxs,
+                compute_scores(
+                    band.histograms[idxs], band.histograms[idxs - 1]
+                ),
+            )
+            if isinstance(band.scores, np.memmap):
+                band.scores.flush()
+        stream.changed.emit()
+
+    def _open(self, stream: VideoStream) -> _VideoBand:
+        frame_count = len(stream.timecodes)
+        cache_name = self._get_cache_name(stream)
+        specs = [
+            (cache_name, np.uint8, (frame_count, BAND_RESOLUTION, 3)),
+            (
+                cache_name + "-histograms",
+                np.uint16,
+                (frame_count, 3 * SCENE_HISTOGRAM_BINS),
+            ),
+            (cache_name + "-scenes", np.uint8, (frame_count,)),
+            (cache_name + "-done", np.bool_, (frame_count,)),
+        ]
+
+        if frame_count:
+            try:
+                arrays = [
+                    np.lib.format.open_memmap(
+                        get_cache_file_path(name, BAND_CACHE_SUFFIX),
+                        mode="r+",
+                    )
+                    for name, _dtype, _shape in specs
+                ]
+                if all(
+                    array.dtype == dtype and array.shape == shape
+                    for array, (_name, dtype, shape) in zip(arrays, specs)
+                ):
+                    return _VideoBand(*arrays)
+            except (OSError, ValueError):
+                pass
+
+            try:
+                get_cache_file_path(
+                    cache_name, BAND_CACHE_SUFFIX
+                ).parent.mkdir(parents=True, exist_ok=True)
+                return _VideoBand(
+                    *[
+                        np.lib.format.open_memmap(
+                            get_cache_file_path(name, BAND_CACHE_SUFFIX),
+                            mode="w+",
+                            dtype=dtype,
+                            shape=shape,
+                        )
+                        for name, dtype, shape in specs
+                    ]
+                )
+            except (OSError, ValueError) as ex:
+                self._log_api.warn(
+                    f"video {stream.uid}: could not cache video band ({ex})"
+                )
 
-        self.cache: T.Dict[uuid.UUID, np.array] = {}
-
-        video_api.stream_loaded.connect(self._on_video_stream_load)
-
-    def _process_task(self, task: T.Any) -> None:
-        stream, frame_indexes = task
-        anything_changed = False
-        for frame_idx in frame_indexes:
-            frame = stream.get_frame(frame_idx, 1, BAND_RESOLUTION)
-            if frame is None:
-                continue
-            frame = frame.reshape(BAND_RESOLUTION, 3)
-            with _CACHE_LOCK:
-                self.cache[stream.uid][frame_idx] = frame
-            anything_changed = True
-        if anything_changed:
-            self.signals.cache_updated.emit()
-            cache_name = self._get_cache_name(stream)
-            save_cache(cache_name, self.cache[stream.uid])
+        return _VideoBand(
+            *[np.zeros(shape, dtype=dtype) for _name, dtype, shape in specs]
+        )
 
     def _get_cache_name(self, stream: VideoStream) -> str:
         try:
@@ -73,31 +225,49 @@ class VideoBandWorker(QueueWorker):
             size = 0
         return sanitize_file_name(stream.path) + f"-{size}-video-band"
 
-    def _on_video_stream_unload(self, stream: VideoStream) -> None:
-        with _CACHE_LOCK:
-            # TODO: this also clears queue for unrelated streams!
-            self.clear_tasks()
-            cache_name = self._get_cache_name(stream)
-            save_cache(cache_name, self.cache[stream.uid])
-            del self.cache[stream.uid]
+    def _evict(self) -> None:
+        if not self._max_size:
+            return
+        # bands are written out as they're filled in, so they can be
+        # dropped without saving
+        current_stream = self._video_api.current_stream
+        size = sum(band.nbytes for band in self._bands.values())
+        for uid in list(self._bands.keys()):
+            if size <= self._max_size:
+                break
+            if current_stream and uid == current_stream.uid:
+                continue
+            size -= self._bands.pop(uid).nbytes
+        self._log_api.debug(
+            f"video band cache: {size / 2 ** 20:.1f} MiB "
+            f"of {self._max_size / 2 ** 20:.1f} MiB used"
+        )
+
+
+class VideoBandWorkerSignals(QtCore.QObject):
+    cache_updated = QtCore.pyqtSignal()
 
-    def _on_video_stream_load(self, stream: VideoStream) -> None:
-        with _CACHE_LOCK:
-            cache_name = self._get_cache_name(stream)
-            cache = load_cache(cache_name)
-            if cache is None:
-                cache = np.zeros(
-                    [len(stream.timecodes), BAND_RESOLUTION, 3], dtype=np.uint8
-                )
-            self.cache[stream.uid] = cache
 
-            not_cached_frames = [
-                frame_idx
-                for frame_idx in range(cache.shape[0])
-                if not np.count_nonzero(cache[frame_idx])
-            ]
-            for chunk in chunks(not_cached_frames, CHUNK_SIZE):
-                self._queue.put((stream, chunk))
+class VideoBandWorker(QueueWorker):
+    def __init__(self, log_api: LogApi, cache: VideoBandCache) -> None:
+        super().__init__(log_api)
+        self.signals = VideoBandWorkerSignals()
+        self._cache = cache
+
+    def _process_task(self, task: T.Any) -> None:
+        stream, frame_indexes = task
+        done_frame_indexes: T.List[int] = []
+        for frame_idx, frame in stream.iter_frames(
+            frame_indexes, SCENE_SAMPLE_WIDTH, BAND_RESOLUTION
+        ):
+            if self._is_task_canceled():
+                break
+            if not self._cache.update(stream, frame_idx, frame):
+                return
+            done_frame_indexes.append(frame_idx)
+        if done_frame_indexes:
+            self._cache.commit(stream, done_frame_indexes)
+            self.signals.cache_updated.emit()
 
 
 class VideoPreview(BaseLocalAudioWidget):
@@ -109,9 +279,18 @@ class VideoPreview(BaseLocalAudioWidget):
 
         self._pixels: np.array = np.zeros([0, 0, 3], dtype=np.uint8)
 
-        self._worker = VideoBandWorker(api.log, api.video)
-        self._worker.signals.cache_updated.connect(self.repaint)
-        self._api.threading.schedule_runnable(self._worker)
+        self._cache = VideoBandCache(
+            api.log, api.video, api.cfg.opt["video"]["band_cache_size"]
+        )
+        self._workers: T.List[VideoBandWorker] = []
+        for _ in range(self._get_worker_count()):
+            worker = VideoBandWorker(api.log, self._cache)
+            worker.signals.cache_updated.connect(self.repaint)
+            self._api.threading.schedule_runnable(worker)
+            self._workers.append(worker)
+
+        api.video.stream_loaded.connect(self._on_video_stream_load)
+        api.video.current_stream_switched.connect(self._on_video_stream_switch)
 
         api.video.stream_loaded.connect(self.repaint_if_needed)
         api.video.stream_unloaded.connect(self.repaint_if_needed)
@@ -139,7 +318,32 @@ class VideoPreview(BaseLocalAudioWidget):
             )
 
     def shutdown(self) -> None:
-        self._worker.stop()
+        for worker in self._workers:
+            worker.stop()
+
+    def _get_worker_count(self) -> int:
+        count = self._api.cfg.opt["video"]["band_workers"]
+        if not count:
+            count = os.cpu_count() or 1
+        return max(1, count)
+
+    def _on_video_stream_load(self, stream: VideoStream) -> None:
+        not_cached_frames = self._cache.load(stream)
+        # each worker decodes its own segments of the timeline with its own
+        # decoder
+        for i, chunk in enumerate(
+            split_at_keyframes(not_cached_frames, stream.keyframes, CHUNK_SIZE)
+        ):
+            self._workers[i % len(self._workers)].schedule_task(
+                (stream, chunk)
+            )
+
+    def _on_video_stream_switch(self, stream: T.Optional[VideoStream]) -> None:
+        if not stream or not stream.is_ready:
+            return
+        if not self._cache.touch(stream):
+            # the band was evicted; read it back
+            self._on_video_stream_load(stream)
 
     def resizeEvent(self, event: QtGui.QResizeEvent) -> None:
         self._pixels = np.zeros(
@@ -156,7 +360,7 @@ class VideoPreview(BaseLocalAudioWidget):
 
     def _draw_video_band(self, painter: QtGui.QPainter) -> None:
         current_stream = self._api.video.current_stream
-        if not current_stream or not current_stream.timecodes:
+        if not current_stream or not len(current_stream.timecodes):
             return
 
         pixels = self._pixels.transpose(1, 0, 2)
@@ -169,7 +373,7 @@ class VideoPreview(BaseLocalAudioWidget):
             pts_range
         )
 
-        cache = self._worker.cache.get(current_stream.uid)
+        cache = self._cache.get(current_stream.uid)
         if cache is not None:
             for x, frame_idx in enumerate(frame_idx_range):
                 pixels[x] = cache[frame_idx]
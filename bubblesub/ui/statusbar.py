@@ -15,11 +15,13 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import typing as T
+from functools import partial
 
 from PyQt5 import QtWidgets
 
 import bubblesub.api
 import bubblesub.util
+from bubblesub.api.video_stream import VideoStream
 
 
 class StatusBar(QtWidgets.QStatusBar):
@@ -56,6 +58,19 @@ class StatusBar(QtWidgets.QStatusBar):
         api.audio.view.selection_changed.connect(
             self._on_audio_selection_change
         )
+        api.video.stream_created.connect(self._on_video_stream_create)
+
+    def _on_video_stream_create(self, stream: VideoStream) -> None:
+        stream.load_progress.connect(
+            partial(self._on_video_stream_load_progress, stream)
+        )
+        stream.loaded.connect(self.clearMessage)
+        stream.errored.connect(self.clearMessage)
+
+    def _on_video_stream_load_progress(
+        self, stream: VideoStream, percentage: int
+    ) -> None:
+        self.showMessage(f"Indexing {stream.path.name}: {percentage}%")
 
     def _on_subs_selection_change(self) -> None:
         count = len(self._api.subs.selected_indexes)
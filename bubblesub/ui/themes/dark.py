@@ -29,6 +29,7 @@ class DarkTheme(BaseTheme):
             "spectrogram/mouse-marker": "#40C04080",
             "spectrogram/video-marker": "#00A000",
             "spectrogram/keyframe": "#C8640078",
+            "spectrogram/scene-change": "#C8C80078",
             "spectrogram/selected-sub-text": "#FFFFFF",
             "spectrogram/selected-sub-line": "#2A82DADC",
             "spectrogram/selected-sub-fill": "#2A82DA32",
@@ -29,6 +29,7 @@ class LightTheme(BaseTheme):
             "spectrogram/mouse-marker": "#40C04080",
             "spectrogram/video-marker": "#00A000",
             "spectrogram/keyframe": "#FF800078",
+            "spectrogram/scene-change": "#80800078",
             "spectrogram/selected-sub-text": "#FFFFFF",
             "spectrogram/selected-sub-line": "#2A82DADC",
             "spectrogram/selected-sub-fill": "#2A82DA32",